@@ -0,0 +1,58 @@
+"""
+Выбор по весам за O(1) методом псевдонимов (алгоритм Воуза).
+
+Таблица строится один раз за O(n), после чего каждый выбор — одно случайное
+число и одно сравнение, независимо от размера каталога.
+"""
+from array import array
+
+
+class AliasTable:
+    """Таблица псевдонимов для выбора номера 0..n-1 с вероятностью, пропорциональной весу"""
+
+    def __init__(self, weights):
+        weights = list(weights)
+        size = len(weights)
+        total = sum(weights)
+        if size == 0 or total <= 0:
+            raise ValueError("Для выбора нужен хотя бы один положительный вес")
+        self.size = size
+        # при равных весах выбор совпадает с random.choice, включая расход случайных чисел
+        self.uniform = all(weight == weights[0] for weight in weights)
+        self.probability = array("d", [1.0]) * size
+        self.alias = array("q", range(size))
+        if self.uniform:
+            return
+
+        scaled = [weight * size / total for weight in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+        # остатки из-за погрешности округления выбираются всегда сами собой
+
+    def __len__(self):
+        return self.size
+
+    def sample(self, rng):
+        if self.uniform:
+            return rng.randrange(self.size)
+        u = rng.random() * self.size
+        i = int(u)
+        return i if u - i < self.probability[i] else self.alias[i]
+
+    def sample_many(self, generator, count):
+        """count выборов разом из numpy.random.Generator — массив номеров, без цикла по выборам"""
+        import numpy as np
+
+        if self.uniform:
+            return generator.integers(self.size, size=count)
+        u = generator.random(count) * self.size
+        i = u.astype(np.int64)
+        probability = np.frombuffer(self.probability, dtype=np.float64)
+        alias = np.frombuffer(self.alias, dtype=np.int64)
+        return np.where(u - i < probability[i], i, alias[i])
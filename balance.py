@@ -0,0 +1,248 @@
+"""
+Подбор баланса: полные прохождения подземелья по сетке параметров game_data.json.
+
+Каждая точка сетки — копия игровых данных с подставленными значениями. Для
+каждого героя в точке разыгрываются прохождения create_dungeon_rooms по
+правилам Hero/Enemy/auto_fight. Работа делится на блоки по --chunk прохождений
+и раздается пулу процессов; итоги блоков сразу дописываются в файл результатов,
+поэтому прерванный подбор продолжается с того же места. Первая строка файла —
+отпечаток подбора (сетка, seed, --runs, --chunk и данные): продолжить в том же
+файле подбор с другими настройками нельзя.
+
+    python main.py sweep --param "heroes.*.health=6,8,12" --param "weapons.bone.damage=3:6" \\
+        --runs 2000 --target 0.6:0.7 --output sweep.jsonl
+"""
+import argparse
+import copy
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from content_cache import ContentError, load_json, validate_content
+from grid_dungeon import derive_seed
+from main import DungeonController, DungeonGenerator, NullOutput, SessionRandom
+
+
+class ResumeError(ValueError):
+    """Файл результатов записан другим подбором"""
+
+
+def parse_values(text):
+    """'6,8,12' — перечисление, '3:6' или '3:9:2' — целые от и до включительно с шагом"""
+    if ":" in text:
+        start, stop, *step = (int(part) for part in text.split(":"))
+        return list(range(start, stop + 1, step[0] if step else 1))
+    return [json.loads(value) for value in text.split(",")]
+
+
+def parse_param(text):
+    """'раздел.ключ.поле=значения'; ключ * означает все записи раздела"""
+    path, _, values = text.partition("=")
+    parts = path.split(".")
+    if len(parts) != 3 or not values:
+        raise argparse.ArgumentTypeError(f"Ожидается раздел.ключ.поле=значения: {text}")
+    return tuple(parts), parse_values(values)
+
+
+def expand_grid(params):
+    """Все точки сетки: список словарей {путь: значение} в порядке перебора"""
+    paths = [path for path, _ in params]
+    return [dict(zip(paths, values)) for values in itertools.product(*(values for _, values in params))]
+
+
+def apply_point(data, point):
+    data = copy.deepcopy(data)
+    for (section, key, field), value in point.items():
+        records = data[section]
+        if key == "*":
+            targets = records.values()
+        elif key in records:
+            targets = [records[key]]
+        else:
+            raise ContentError(f"В разделе {section} нет записи {key}")
+        for record in targets:
+            record[field] = value
+    return validate_content(data)
+
+
+def run_dungeon(generator, hero_key, rng, output):
+    """
+    Одно прохождение: герой идет от входа к выходу и сражается со всеми врагами.
+    Возвращает "cleared", "died" или "stuck" — бой, в котором никто не пробивает броню.
+    """
+    hero = generator.create_player(hero_key)
+    for depth, room in enumerate(generator.create_dungeon_rooms(rng)):
+        if room != "E":
+            continue
+        enemy = generator.create_enemy_by_id(generator.random_enemy_id(rng, depth), rng=rng, depth=depth)
+        # такой бой в auto_fight никогда не закончится
+        if hero.weapon.damage <= enemy.armor.defense and enemy.weapon.damage <= hero.armor.defense:
+            return "stuck"
+        if not DungeonController.auto_fight(hero, enemy, output, rng):
+            return "died"
+    return "cleared"
+
+
+_base_data = None
+
+
+def _init_worker(data):
+    global _base_data
+    _base_data = data
+
+
+def run_unit(unit):
+    """Блок прохождений одного героя в одной точке сетки; выполняется в процессе пула"""
+    unit_id, point, hero_key, runs, seed = unit
+    rng = SessionRandom(seed)
+    generator = DungeonGenerator.from_data(apply_point(_base_data, point), rng=rng)
+    output = NullOutput()
+    counts = {"cleared": 0, "died": 0, "stuck": 0}
+    for _ in range(runs):
+        counts[run_dungeon(generator, hero_key, rng, output)] += 1
+    return {"unit": unit_id, "hero": hero_key, "runs": runs, **counts}
+
+
+def plan_units(grid, heroes, runs, chunk, seed):
+    """
+    Блоки работы с постоянными ID и seed: результат не зависит ни от числа процессов,
+    ни от того, сколько раз подбор прерывали
+    """
+    units = []
+    for index, point in enumerate(grid):
+        for hero_key in heroes:
+            for start in range(0, runs, chunk):
+                unit_id = f"{index}/{hero_key}/{start}"
+                units.append((unit_id, point, hero_key, min(chunk, runs - start), derive_seed(seed, unit_id)))
+    return units
+
+
+def fingerprint(data, grid, runs, chunk, seed):
+    """Хеш всего, от чего зависят итоги блоков"""
+    import hashlib
+
+    settings = {
+        "grid": [[[".".join(path), value] for path, value in point.items()] for point in grid],
+        "runs": runs,
+        "chunk": chunk,
+        "seed": seed,
+        "data": data,
+    }
+    encoded = json.dumps(settings, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+def read_done(path, sweep_id):
+    """Итоги уже завершенных блоков из файла результатов подбора sweep_id"""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        header = f.readline()
+        if not header:
+            return done
+        try:
+            header = json.loads(header)
+        except ValueError:
+            header = None
+        if not isinstance(header, dict) or header.get("sweep") != sweep_id:
+            raise ResumeError(f"{path} записан подбором с другой сеткой, seed, --runs, --chunk или данными")
+        for line in f:
+            # недописанная последняя строка после аварийной остановки пропускается
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            done[record["unit"]] = record
+    return done
+
+
+def summarize(grid, results):
+    """Доля прохождений по (точка сетки, герой)"""
+    totals = {}
+    for record in results:
+        point = int(record["unit"].split("/", 1)[0])
+        total = totals.setdefault((point, record["hero"]), {"runs": 0, "cleared": 0, "died": 0, "stuck": 0})
+        for name in total:
+            total[name] += record[name]
+    return {key: dict(total, clear_rate=total["cleared"] / total["runs"]) for key, total in totals.items()}
+
+
+def _describe(point):
+    return ", ".join(f"{'.'.join(path)}={value}" for path, value in point.items()) or "исходные данные"
+
+
+def sweep(data, params, runs=1000, chunk=250, seed=0, workers=None, output=None, on_result=None):
+    """
+    Раздает блоки пулу процессов и возвращает summarize() по всем блокам.
+    output — файл JSON Lines для потоковой записи и продолжения после прерывания.
+    """
+    grid = expand_grid(params)
+    for point in grid:
+        apply_point(data, point)
+    units = plan_units(grid, list(data["heroes"]), runs, chunk, seed)
+    sweep_id = fingerprint(data, grid, runs, chunk, seed)
+    done = read_done(output, sweep_id) if output else {}
+    pending = [unit for unit in units if unit[0] not in done]
+    results = [done[unit[0]] for unit in units if unit[0] in done]
+
+    sink = open(output, "a", encoding="utf-8") if output else None
+    try:
+        if sink is not None and not sink.tell():
+            sink.write(json.dumps({"sweep": sweep_id}) + "\n")
+            sink.flush()
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(data,)) as pool:
+            futures = {pool.submit(run_unit, unit) for unit in pending}
+            while futures:
+                finished, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record = future.result()
+                    results.append(record)
+                    if sink is not None:
+                        sink.write(json.dumps(record, ensure_ascii=False) + "\n")
+                        sink.flush()
+                    if on_result is not None:
+                        on_result(record)
+    finally:
+        if sink is not None:
+            sink.close()
+    return grid, summarize(grid, results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="main.py sweep", description="Подбор баланса по сетке параметров")
+    parser.add_argument("--data", default="data/game_data.json")
+    parser.add_argument("--param", type=parse_param, action="append", default=[],
+                        help="раздел.ключ.поле=значения, например heroes.*.health=6,8,12")
+    parser.add_argument("--runs", type=int, default=1000, help="прохождений на героя в каждой точке")
+    parser.add_argument("--chunk", type=int, default=250, help="прохождений в одном блоке работы")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, help="число процессов, по умолчанию по числу ядер")
+    parser.add_argument("--output", help="файл результатов; если он есть, подбор продолжается")
+    parser.add_argument("--target", help="показать точки, где у каждого героя доля прохождений в диапазоне, например 0.6:0.7")
+    args = parser.parse_args(argv)
+
+    data = load_json(args.data)
+
+    def progress(record):
+        print(f"блок {record['unit']}: прошел {record['cleared']} из {record['runs']}", file=sys.stderr)
+
+    try:
+        grid, summary = sweep(data, args.param, args.runs, args.chunk, args.seed, args.workers,
+                              args.output, progress)
+    except ResumeError as error:
+        print(error, file=sys.stderr)
+        return 2
+
+    low, high = (float(bound) for bound in args.target.split(":")) if args.target else (0.0, 1.0)
+    for index, point in enumerate(grid):
+        rates = {hero: summary[index, hero]["clear_rate"] for hero in data["heroes"]}
+        if all(low <= rate <= high for rate in rates.values()):
+            print(f"{_describe(point)}: " + ", ".join(f"{hero} {rate:.1%}" for hero, rate in rates.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
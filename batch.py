@@ -0,0 +1,125 @@
+"""
+Пакетный режим: много заранее записанных сессий в одном процессе.
+
+Вход — JSON Lines, по строке на сессию: ответы игрока на вопросы ">> " по порядку
+и, по желанию, идентификатор и seed потока случайных чисел:
+
+    {"id": "qa-1", "seed": 42, "answers": ["1", "1", "1", "1"]}
+
+Все сессии идут через DungeonController над одним DungeonGenerator, без ввода
+с клавиатуры. Сессия заканчивается, когда игра завершилась или ответы кончились.
+Итоги пишутся в выходной поток JSON Lines пачками, а не по строке на сессию.
+
+    python main.py --batch sessions.jsonl --output results.jsonl
+    cat sessions.jsonl | python main.py --batch - --seed 7
+"""
+import io
+import json
+import sys
+import time
+
+from main import BufferedOutput, DungeonController, NullOutput, SessionRandom
+
+
+def read_sessions(lines):
+    """(номер строки, запись сессии или текст ошибки) для каждой непустой строки"""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict) or not isinstance(record.get("answers"), list):
+                raise ValueError("ожидается объект с полем answers")
+        except ValueError as e:
+            yield number, str(e)
+        else:
+            yield number, record
+
+
+def run_session(generator, record, rng, transcript=False, metrics=None):
+    """Прогоняет ответы одной сессии через шаги игры и возвращает ее итог"""
+    stream = io.StringIO() if transcript else None
+    output = BufferedOutput(stream) if transcript else NullOutput()
+    controller = DungeonController(generator, output, rng=rng, metrics=metrics)
+    steps = controller.game_steps()
+    answers = record["answers"]
+    used = 0
+    prompt = None
+    try:
+        prompt = next(steps)
+        for answer in answers:
+            used += 1
+            prompt = steps.send(str(answer))
+    except StopIteration:
+        prompt = None
+    else:
+        # ответы кончились раньше игры
+        steps.close()
+    hero = controller.hero
+    result = {
+        "id": record.get("id"),
+        "seed": rng.root_seed,
+        "stream": list(rng.stream),
+        "answers_used": used,
+        "finished": prompt is None,
+        "waiting": prompt,
+        "exit_game": controller.exit_game,
+        "hero": hero.name if hero is not None else None,
+        "hero_alive": hero is not None and hero.current_health > 0,
+        "position": controller.position,
+    }
+    if transcript:
+        output.flush()
+        result["transcript"] = stream.getvalue()
+    return result
+
+
+def run_batch(generator, lines, output, seed=None, transcript=False, metrics=None, flush_every=1000):
+    """
+    Прогоняет все сессии из lines и пишет итоги в output.
+    Сессия без seed получает подпоток (номер строки) от seed, а если нет и его — случайный.
+    Возвращает (число сессий, число строк с ошибками).
+    """
+    pending = []
+    sessions = errors = 0
+    for number, record in read_sessions(lines):
+        if isinstance(record, str):
+            errors += 1
+            pending.append(json.dumps({"line": number, "error": record}, ensure_ascii=False))
+        else:
+            if "seed" in record:
+                rng = SessionRandom(record["seed"], record.get("stream", ()))
+            elif seed is not None:
+                rng = SessionRandom(seed, (number,))
+            else:
+                rng = SessionRandom()
+            if record.get("id") is None:
+                record["id"] = number
+            sessions += 1
+            pending.append(json.dumps(run_session(generator, record, rng, transcript, metrics),
+                                      ensure_ascii=False))
+        if len(pending) >= flush_every:
+            output.write("\n".join(pending) + "\n")
+            pending.clear()
+    if pending:
+        output.write("\n".join(pending) + "\n")
+    output.flush()
+    return sessions, errors
+
+
+def main(generator, source, target=None, seed=None, transcript=False, metrics=None):
+    """Точка входа для main.py --batch; source и target — пути или "-" для stdin/stdout"""
+    inp = sys.stdin if source == "-" else open(source, encoding="utf-8")
+    out = sys.stdout if target in (None, "-") else open(target, "w", encoding="utf-8")
+    started = time.perf_counter()
+    try:
+        sessions, errors = run_batch(generator, inp, out, seed, transcript, metrics)
+    finally:
+        if inp is not sys.stdin:
+            inp.close()
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - started
+    rate = sessions / elapsed if elapsed else float("inf")
+    print(f"Сессий: {sessions}, ошибок во входе: {errors}, {rate:.0f} сессий/с", file=sys.stderr)
+    return 1 if errors else 0
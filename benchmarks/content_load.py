@@ -0,0 +1,34 @@
+"""
+Холодная загрузка игровых данных: разбор JSON против скомпилированного кеша.
+
+    python benchmarks/content_load.py [повторов]
+"""
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from content_cache import ContentCache, load_json
+from main import DungeonGenerator
+
+
+def main(number=2000):
+    json_file = str(Path(__file__).parent.parent / "data" / "game_data.json")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = ContentCache(json_file, cache_dir)
+        cache.load()
+
+        plain = timeit.timeit(lambda: load_json(json_file), number=number) / number
+        cached = timeit.timeit(lambda: ContentCache(json_file, cache_dir).load(), number=number) / number
+        generator = timeit.timeit(
+            lambda: DungeonGenerator(json_file, cache_dir=cache_dir).catalog, number=number
+        ) / number
+
+    print(f"JSON + проверка схемы: {plain * 1e6:.1f} мкс")
+    print(f"Кеш:                   {cached * 1e6:.1f} мкс ({plain / cached:.1f}x)")
+    print(f"Генератор с каталогом: {generator * 1e6:.1f} мкс")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
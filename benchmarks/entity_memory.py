@@ -0,0 +1,45 @@
+"""
+Замер памяти на одного живого врага.
+
+    python benchmarks/entity_memory.py [количество]
+
+Строка пула стоит примерно столько же, сколько слотовый Enemy, а ее представление
+добавляет к ней объект из двух слотов (пул, индекс).
+"""
+import random
+import sys
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from main import DungeonGenerator, EntityPool
+
+
+def bytes_per_enemy(spawn, count):
+    random.seed(0)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    enemies = [spawn() for _ in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del enemies
+    return (after - before) / count
+
+
+def main(count=100000):
+    generator = DungeonGenerator(str(Path(__file__).parent.parent / "data" / "game_data.json"))
+    keys = generator.get_enemies()
+
+    objects = bytes_per_enemy(lambda: generator.create_enemy(random.choice(keys)), count)
+    pool = EntityPool()
+    pooled = bytes_per_enemy(lambda: generator.create_enemy(random.choice(keys), pool), count)
+    pool_only = EntityPool()
+    rows = bytes_per_enemy(lambda: generator.create_enemy(random.choice(keys), pool_only).index, count)
+
+    print(f"Enemy со слотами:          {objects:8.1f} байт")
+    print(f"EntityPool + представление: {pooled:8.1f} байт")
+    print(f"EntityPool, только строка:  {rows:8.1f} байт")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,43 @@
+"""
+Ход отряда: один залп numpy по стопкам против броска за каждого врага по очереди.
+
+    python benchmarks/group_fight.py [повторов]
+"""
+import random
+import sys
+import timeit
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from main import DungeonGenerator, SessionRandom
+
+
+def one_by_one(enemies, hero_defense, rng):
+    """Ход каждого врага так, как его считает auto_fight"""
+    damage = 0
+    for enemy in enemies:
+        if enemy.weapon.success_probability >= rng.randint(0, 100) / 100 and enemy.weapon.damage > hero_defense:
+            damage += enemy.weapon.damage - hero_defense
+    return damage
+
+
+def main(number=200):
+    generator = DungeonGenerator(str(Path(__file__).parent.parent / "data" / "game_data.json"))
+    hero_defense = generator.create_player(generator.get_heroes()[0]).armor.defense
+    print(f"{'врагов':>8} {'стопок':>7} {'по одному, мкс':>15} {'залпом, мкс':>12} {'на врага, нс':>13}")
+    for size in (10, 100, 1000, 10000):
+        rng = SessionRandom(size)
+        group = generator.create_enemy_group(size, rng)
+        enemies = [generator.create_enemy_by_id(generator.random_enemy_id(rng), rng=rng) for _ in range(size)]
+        loop_rng = random.Random(size)
+        numpy_rng = np.random.default_rng(size)
+
+        loop = timeit.timeit(lambda: one_by_one(enemies, hero_defense, loop_rng), number=number) / number
+        volley = timeit.timeit(lambda: group.volley(hero_defense, numpy_rng), number=number) / number
+        print(f"{size:8} {len(group.templates):7} {loop * 1e6:15.1f} {volley * 1e6:12.1f} {volley / size * 1e9:13.1f}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
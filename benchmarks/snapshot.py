@@ -0,0 +1,47 @@
+"""
+Размер снимка сессии и время его восстановления.
+
+    python benchmarks/snapshot.py [повторов]
+"""
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from main import DungeonController, DungeonGenerator, NullOutput
+
+
+def played_session(generator):
+    """Сессия посреди подземелья: все комнаты посещены, часть врагов убита"""
+    random.seed(0)
+    controller = DungeonController(generator, NullOutput())
+    steps = controller.game_steps()
+    next(steps)
+    steps.send("1")
+    steps.send("1")
+    try:
+        while steps.send("1") != "room_exit":
+            pass
+    except StopIteration:
+        raise RuntimeError("Герой не дошел до выхода, смените seed")
+    return controller
+
+
+def main(number=20000):
+    generator = DungeonGenerator(str(Path(__file__).parent.parent / "data" / "game_data.json"))
+    controller = played_session(generator)
+    snapshot = controller.save_snapshot()
+    target = DungeonController(generator, NullOutput())
+
+    save = timeit.timeit(controller.save_snapshot, number=number) / number
+    load = timeit.timeit(lambda: target.load_snapshot(snapshot), number=number) / number
+
+    print(f"Комнат в подземелье: {len(controller.dungeon_map)}")
+    print(f"Размер снимка:       {len(snapshot)} байт")
+    print(f"Сохранение:          {save * 1e6:.1f} мкс")
+    print(f"Восстановление:      {load * 1e6:.1f} мкс")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
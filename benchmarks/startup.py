@@ -0,0 +1,82 @@
+"""
+Время запуска игры: от старта интерпретатора до первого приглашения ввода.
+
+    python benchmarks/startup.py [--runs 20] [--target-ms 60] [--importtime]
+
+Игра запускается отдельным процессом так же, как ее запускает игрок, и замер
+останавливается на первом символе ввода ">> ". Печатаются медиана и лучший
+прогон; при --target-ms код выхода 1, если медиана больше цели. --importtime
+дополнительно показывает самые долгие импорты по данным python -X importtime.
+Перед замером кеш данных прогревается, а модули компилируются в байт-код,
+как у установленной игры.
+"""
+import argparse
+import compileall
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+PROMPT = b">> "
+
+
+def time_to_prompt():
+    """Секунды от запуска процесса до первого приглашения ввода"""
+    env = dict(os.environ, PYTHONUNBUFFERED="1")
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "main.py"], cwd=ROOT, env=env,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    seen = b""
+    while not seen.endswith(PROMPT):
+        chunk = process.stdout.read1(4096)
+        if not chunk:
+            raise RuntimeError("игра завершилась, не дойдя до приглашения ввода")
+        seen += chunk
+    elapsed = time.perf_counter() - started
+    process.kill()
+    process.wait()
+    return elapsed
+
+
+def slowest_imports(count=10):
+    """Самые долгие импорты main с учетом вложенных, в микросекундах"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), name.rstrip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Время до первого приглашения ввода")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--target-ms", type=float, help="допустимая медиана в миллисекундах")
+    parser.add_argument("--importtime", action="store_true", help="показать самые долгие импорты")
+    args = parser.parse_args(argv)
+
+    compileall.compile_dir(ROOT, maxlevels=0, quiet=1)
+    time_to_prompt()
+    samples = [time_to_prompt() * 1000 for _ in range(args.runs)]
+    median = statistics.median(samples)
+    print(f"до приглашения: медиана {median:.1f} мс, лучший {min(samples):.1f} мс за {args.runs} запусков")
+
+    if args.importtime:
+        for cumulative, name in slowest_imports():
+            print(f"{cumulative / 1000:8.1f} мс  {name}")
+
+    if args.target_ms is not None and median > args.target_ms:
+        print(f"Медленнее цели {args.target_ms:.0f} мс")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
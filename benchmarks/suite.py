@@ -0,0 +1,193 @@
+"""
+Набор замеров горячих путей с сохраненной базовой линией.
+
+    python benchmarks/suite.py run [--output benchmarks/baseline.json]
+    python benchmarks/suite.py compare [benchmarks/baseline.json] [--threshold 0.25] [--memory-threshold 0.5]
+
+run печатает операции в секунду и пиковый объем памяти (peak_bytes) за пачку
+вызовов и при --output сохраняет их в JSON. peak_bytes — наибольший прирост
+занятой памяти по tracemalloc во время пачки, а не число и не сумма выделений.
+compare замеряет заново и завершается с кодом 1, если какой-то замер медленнее
+базовой линии больше чем на threshold или его пик памяти больше чем на memory_threshold.
+Базовая линия имеет смысл только для той машины, на которой она записана.
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from main import DungeonController, DungeonGenerator, HealthBarDrawer, NullOutput, SessionRandom
+
+DATA = str(Path(__file__).parent.parent / "data" / "game_data.json")
+BASELINE = str(Path(__file__).parent / "baseline.json")
+SEED = 12345
+# рост пика памяти меньше этого — шум выравнивания и свободных списков, а не регрессия
+MEMORY_NOISE = 1024
+
+
+class ScriptedController(DungeonController):
+    """Контроллер, который на любой вопрос отвечает «1»: выбирает первого героя и идет вперед"""
+
+    def _ask(self, prompt):
+        return "1"
+
+
+def _auto_fight(generator):
+    rng = SessionRandom(SEED)
+    output = NullOutput()
+    hero = generator.create_player(generator.get_heroes()[0])
+
+    def fight():
+        enemy = generator.create_enemy_by_id(generator.random_enemy_id(rng), rng=rng)
+        DungeonController.auto_fight(hero, enemy, output, rng)
+        hero.current_health = hero.max_health
+    return fight
+
+
+def _draw_health_bar(generator):
+    # кеш строк полосок очищается на каждом вызове: замеряется отрисовка, а не поиск в кеше
+    hp = iter(range(10 ** 9))
+    render_bar = HealthBarDrawer.render_bar
+
+    def draw():
+        render_bar.cache_clear()
+        HealthBarDrawer.draw_health_bar("hero", "Герой", next(hp) % 13, 12)
+    return draw
+
+
+def _start_game(generator):
+    seeds = iter(range(10 ** 9))
+
+    def game():
+        ScriptedController(generator, NullOutput(), rng=SessionRandom(next(seeds))).start_game()
+    return game
+
+
+def cases():
+    """Имя замера -> функция, которая готовит и возвращает вызов без аргументов"""
+    return {
+        "auto_fight": lambda generator: _auto_fight(generator),
+        "create_enemy": lambda generator: lambda: generator.create_enemy(generator.get_enemies()[0]),
+        "create_player": lambda generator: lambda: generator.create_player(generator.get_heroes()[0]),
+        "create_dungeon_rooms": lambda generator: lambda: DungeonGenerator.create_dungeon_rooms(generator.rng),
+        "draw_health_bar": _draw_health_bar,
+        "load_json_data": lambda generator: generator._load_json_data,
+        "load_json_data_nocache": lambda generator: DungeonGenerator(DATA, cache=False)._load_json_data,
+        "start_game": _start_game,
+    }
+
+
+def measure(prepare, min_time=0.2, repeats=5):
+    """Лучший из repeats прогонов по min_time секунд и пиковый объем памяти за одну пачку вызовов"""
+    random.seed(SEED)
+    generator = DungeonGenerator(DATA, rng=random.Random(SEED))
+    call = prepare(generator)
+
+    batch = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(batch):
+            call()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time / 10:
+            break
+        batch *= 2
+
+    best = 0.0
+    for _ in range(repeats):
+        calls = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < min_time:
+            for _ in range(batch):
+                call()
+            calls += batch
+        best = max(best, calls / (time.perf_counter() - started))
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    for _ in range(batch):
+        call()
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return {"ops_per_sec": best, "peak_bytes": peak, "batch": batch}
+
+
+def run(names=None, min_time=0.2):
+    results = {}
+    for name, prepare in cases().items():
+        if names and name not in names:
+            continue
+        results[name] = measure(prepare, min_time)
+        result = results[name]
+        print(f"{name:24} {result['ops_per_sec']:14,.0f} оп/с  пик {result['peak_bytes']:10,} байт"
+              f" на {result['batch']} вызовов")
+    return results
+
+
+def compare(baseline, results, threshold, memory_threshold=0.5):
+    """
+    Список регрессий: замеры медленнее базовой линии больше чем на threshold
+    и замеры, пик памяти которых вырос больше чем на memory_threshold
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline["results"].get(name)
+        if reference is None:
+            continue
+        ratio = result["ops_per_sec"] / reference["ops_per_sec"]
+        growth = result["peak_bytes"] - reference["peak_bytes"]
+        memory = result["peak_bytes"] / reference["peak_bytes"] if reference["peak_bytes"] else float("inf")
+        print(f"{name:24} {ratio:7.2f}x по скорости, {memory:7.2f}x по пику памяти от базовой линии")
+        if ratio < 1 - threshold:
+            regressions.append(name)
+        if growth > MEMORY_NOISE and memory > 1 + memory_threshold:
+            regressions.append(f"{name} (память)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры горячих путей")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="замерить и при --output сохранить базовую линию")
+    run_parser.add_argument("--output")
+    compare_parser = commands.add_parser("compare", help="сравнить с сохраненной базовой линией")
+    compare_parser.add_argument("baseline", nargs="?", default=BASELINE)
+    compare_parser.add_argument("--threshold", type=float, default=0.25,
+                                help="допустимое замедление, доля от базовой линии")
+    compare_parser.add_argument("--memory-threshold", type=float, default=0.5,
+                                help="допустимый рост пика памяти, доля от базовой линии")
+    for command in (run_parser, compare_parser):
+        command.add_argument("--only", action="append", help="запустить только этот замер")
+        command.add_argument("--min-time", type=float, default=0.2, help="секунд на один прогон")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        results = run(args.only, args.min_time)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump({
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "seed": SEED,
+                    "results": results,
+                }, f, ensure_ascii=False, indent=2)
+                f.write("\n")
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(baseline, run(args.only, args.min_time), args.threshold, args.memory_threshold)
+    if regressions:
+        print("Хуже базовой линии: " + ", ".join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+"""
+Скорость случайного выбора врага: прежний список на каждый выбор,
+random.choices с весами и таблица псевдонимов.
+
+    python benchmarks/weighted_picks.py [размер каталога] [выборов]
+"""
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from alias_table import AliasTable
+
+
+def main(size=100000, number=20000):
+    rng = random.Random(0)
+    enemies = {f"enemy{i}": {"name": f"Враг {i}", "weight": rng.randint(1, 10)} for i in range(size)}
+    keys = list(enemies)
+    weights = [record["weight"] for record in enemies.values()]
+    table = AliasTable(weights)
+
+    results = {
+        "random.choice(list(...))": timeit.timeit(lambda: rng.choice(list(enemies.values())), number=number // 100) * 100,
+        "random.choices(weights)": timeit.timeit(lambda: rng.choices(keys, weights), number=number // 100) * 100,
+        "AliasTable.sample": timeit.timeit(lambda: keys[table.sample(rng)], number=number),
+    }
+    build = timeit.timeit(lambda: AliasTable(weights), number=1)
+
+    print(f"Каталог: {size} врагов, построение таблицы: {build * 1000:.1f} мс")
+    for name, elapsed in results.items():
+        print(f"{name:26} {number / elapsed:14,.0f} выборов/с")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
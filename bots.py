@@ -0,0 +1,266 @@
+"""
+Автоигра: стратегии-боты проходят полные игры внутри процесса.
+
+Бот отвечает на вопросы игры вместо input(): BotController подменяет только
+_ask, поэтому игра идет по обычному пути start_game -> select_hero ->
+process_dungeon_room, без подмены stdin. Прогон N игр показывает пропускную
+способность всего игрового цикла и распределение исходов.
+
+    python main.py autoplay --policy advance --games 10000 --seed 1
+    python main.py autoplay --policy cautious --grid 40x40 --games 500
+"""
+import argparse
+import random
+import sys
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+
+from fight_odds import solve_fight
+from grid_dungeon import GridDungeon
+from main import DungeonController, DungeonGenerator, NullOutput, SessionRandom
+
+
+# вопросы, с которых начинается каждая посещенная комната
+ROOM_PROMPTS = frozenset(("room_start", "room_empty", "room_enemy", "room_enemy_dead", "room_exit"))
+# ответы, которые понимает игра на каждом вопросе
+MENU_OPTIONS = {
+    "dungeon_approach": ("1", "2"),
+    "room_start": ("1",),
+    "room_empty": ("1", "2"),
+    "room_enemy": ("1", "2"),
+    "room_enemy_dead": ("1", "2"),
+    "room_cleared": ("1", "2"),
+    "room_exit": ("1", "2"),
+}
+
+
+class LeaveGame(Exception):
+    """Бот прекращает игру; outcome — исход, который запишет прогон"""
+
+    def __init__(self, outcome):
+        super().__init__(outcome)
+        self.outcome = outcome
+
+
+class Policy:
+    """Стратегия игрока: выбирает героя и отвечает на каждый вопрос игры"""
+    name = None
+
+    def __init__(self, hero=1):
+        # номер героя в меню, как его ввел бы игрок
+        self.hero = hero
+
+    def answer(self, prompt, controller):
+        if prompt == "hero_menu":
+            return str(self.hero)
+        if prompt == "room_directions":
+            return self.direction(controller)
+        return "1"
+
+    @staticmethod
+    def direction(controller):
+        """
+        Номер соседней комнаты, которая ближе всего к выходу решетки. Комнаты, из
+        которых бот отступил, обходятся, пока есть другой путь; за каждое прошлое
+        посещение комната считается на шаг дальше, чтобы обход не ходил по кругу.
+        """
+        dungeon = controller.dungeon_map
+        neighbors = dungeon.neighbors(controller.position)
+
+        def cost(i):
+            room = neighbors[i][1]
+            return room in controller.avoided, dungeon.distance_to_exit(room) + controller.visits[room]
+
+        best = min(range(len(neighbors)), key=cost)
+        return str(best + 1)
+
+
+class AlwaysAdvance(Policy):
+    """Всегда входит в подземелье, атакует и идет к выходу"""
+    name = "advance"
+
+
+class QuitOnBadOdds(Policy):
+    """Атакует, только если шанс победы не ниже min_odds, иначе бросает игру"""
+    name = "quitter"
+
+    def __init__(self, hero=1, min_odds=0.5):
+        super().__init__(hero)
+        self.min_odds = min_odds
+
+    def bad_odds(self, controller):
+        hero = controller.hero
+        enemy = controller.enemies_in_rooms[controller.position]
+        odds = solve_fight(hero.current_health, hero.weapon.damage, hero.weapon.success_probability,
+                           hero.armor.defense, enemy.current_health, enemy.weapon.damage,
+                           enemy.weapon.success_probability, enemy.armor.defense)
+        return odds.win_probability < self.min_odds
+
+    def answer(self, prompt, controller):
+        if prompt == "room_enemy" and self.bad_odds(controller):
+            raise LeaveGame("quit")
+        return super().answer(prompt, controller)
+
+
+class RetreatOnBadOdds(QuitOnBadOdds):
+    """
+    При шансе победы ниже min_odds отступает в прошлую комнату и ищет путь к
+    выходу в обход врага. Обходить можно только в решетке: в коридоре путь к
+    выходу один, поэтому там стратегия, как QuitOnBadOdds, бросает игру.
+    Если обхода нет и бот снова пришел к тому же врагу, он принимает бой.
+    """
+    name = "cautious"
+
+    def answer(self, prompt, controller):
+        if prompt == "room_enemy" and controller.position not in controller.avoided and self.bad_odds(controller):
+            if not isinstance(controller.dungeon_map, GridDungeon):
+                raise LeaveGame("quit")
+            controller.avoided.add(controller.position)
+            return "2"
+        return Policy.answer(self, prompt, controller)
+
+
+class RandomPolicy(Policy):
+    """Случайный допустимый ответ на каждый вопрос, включая героя"""
+    name = "random"
+
+    def __init__(self, hero=None, rng=None):
+        super().__init__(hero)
+        self.rng = rng if rng is not None else random.Random()
+
+    def answer(self, prompt, controller):
+        if prompt == "hero_menu":
+            return str(self.hero or self.rng.randint(1, len(controller.generator.get_heroes())))
+        if prompt == "room_directions":
+            return str(self.rng.randint(1, len(controller.dungeon_map.neighbors(controller.position))))
+        return self.rng.choice(MENU_OPTIONS[prompt])
+
+
+POLICIES = {policy.name: policy for policy in (AlwaysAdvance, QuitOnBadOdds, RetreatOnBadOdds, RandomPolicy)}
+
+
+class BotController(DungeonController):
+    """Контроллер, в котором на вопросы отвечает стратегия, а не клавиатура"""
+
+    def __init__(self, generator, policy, max_answers=10_000, **kwargs):
+        if kwargs.get("group_size") is not None:
+            # стратегии и проверка безвыходного боя читают оружие и броню одного врага
+            raise ValueError("Автоигра не поддерживает комнаты с отрядами (group_size)")
+        kwargs.setdefault("output", NullOutput())
+        super().__init__(generator, **kwargs)
+        self.policy = policy
+        self.max_answers = max_answers
+        self.answers = 0
+        self.rooms = 0
+        self.last = None
+        # комнаты, из которых стратегия отступила, и сколько раз бот был в каждой комнате
+        self.avoided = set()
+        self.visits = Counter()
+
+    def _ask(self, prompt):
+        self.output.flush()
+        if self.answers >= self.max_answers:
+            raise LeaveGame("stuck")
+        if prompt in ROOM_PROMPTS:
+            self.rooms += 1
+            self.visits[self.position] += 1
+        answer = self.policy.answer(prompt, self)
+        if prompt == "room_enemy" and answer == "1":
+            hero = self.hero
+            enemy = self.enemies_in_rooms[self.position]
+            # в таком бою никто не пробивает броню, и auto_fight не закончится
+            if hero.weapon.damage <= enemy.armor.defense and enemy.weapon.damage <= hero.armor.defense:
+                raise LeaveGame("stuck")
+        self.answers += 1
+        self.last = (prompt, answer)
+        return answer
+
+    def play(self):
+        """Одна полная игра; возвращает исход: cleared, died, passed, quit или stuck"""
+        try:
+            self.start_game()
+        except LeaveGame as leave:
+            return leave.outcome
+        if self.hero is not None and self.hero.current_health <= 0:
+            return "died"
+        if self.last == ("dungeon_approach", "2"):
+            return "passed"
+        return "cleared"
+
+
+@dataclass
+class AutoplayReport:
+    policy: str
+    games: int = 0
+    rooms: int = 0
+    answers: int = 0
+    elapsed: float = 0.0
+    outcomes: Counter = field(default_factory=Counter)
+
+    @property
+    def games_per_second(self):
+        return self.games / self.elapsed if self.elapsed else float("inf")
+
+    @property
+    def rooms_per_second(self):
+        return self.rooms / self.elapsed if self.elapsed else float("inf")
+
+    def describe(self):
+        lines = [
+            f"{self.policy}: {self.games} игр за {self.elapsed:.2f} с — "
+            f"{self.games_per_second:.0f} игр/с, {self.rooms_per_second:.0f} комнат/с",
+        ]
+        for outcome, count in self.outcomes.most_common():
+            lines.append(f"  {outcome:10} {count:8} {count / self.games:7.1%}")
+        return "\n".join(lines)
+
+
+def autoplay(generator, policy, games, seed=None, grid_size=None, max_answers=10_000):
+    """
+    Играет games полных игр подряд. Игра номер i идет в подпотоке (i,) от seed,
+    так что прогон с тем же seed повторяется ход в ход.
+    """
+    report = AutoplayReport(policy.name)
+    root = random.getrandbits(64) if seed is None else seed
+    started = time.perf_counter()
+    for game in range(games):
+        controller = BotController(generator, policy, max_answers, rng=SessionRandom(root, (game,)),
+                                   grid_size=grid_size)
+        report.outcomes[controller.play()] += 1
+        report.games += 1
+        report.rooms += controller.rooms
+        report.answers += controller.answers
+    report.elapsed = time.perf_counter() - started
+    return report
+
+
+def _grid(text):
+    width, _, height = text.partition("x")
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="main.py autoplay", description="Автоигра ботами")
+    parser.add_argument("--data", default="data/game_data.json")
+    parser.add_argument("--policy", choices=sorted(POLICIES), action="append",
+                        help="стратегия; можно указать несколько, по умолчанию все")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--hero", type=int, help="номер героя в меню, у random по умолчанию случайный")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--grid", type=_grid, help="играть в решетке ШИРИНАxВЫСОТА вместо коридора")
+    parser.add_argument("--max-answers", type=int, default=10_000, help="предел ответов в одной игре")
+    args = parser.parse_args(argv)
+
+    generator = DungeonGenerator(args.data)
+    for name in args.policy or sorted(POLICIES):
+        if name == "random":
+            policy = RandomPolicy(args.hero, random.Random(args.seed))
+        else:
+            policy = POLICIES[name](args.hero or 1)
+        print(autoplay(generator, policy, args.games, args.seed, args.grid, args.max_answers).describe())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""
+Скомпилированный кеш игровых данных.
+
+Разобранный и проверенный game_data.json сохраняется рядом с ним (или в
+указанном каталоге) в формате marshal, который читается быстрее разбора JSON
+и не требует повторной проверки схемы.
+Кеш действителен, пока у исходного файла те же mtime и размер; если они
+изменились, сравнивается хеш содержимого. Любая ошибка чтения или записи кеша
+означает обычную загрузку JSON.
+
+Сразу за заголовком лежат ключи героев: их хватает для первого экрана игры,
+поэтому read_heroes() читает только начало файла. json и hashlib нужны лишь
+при промахе кеша и импортируются по требованию, чтобы не замедлять запуск.
+"""
+import marshal
+import os
+import struct
+
+
+class ContentError(ValueError):
+    """Игровые данные не соответствуют схеме"""
+
+
+_CREATURE = {"name": str, "definition": str, "health": int, "death_definition": str}
+
+# обязательные поля записей каждого раздела и их типы
+SCHEMA = {
+    "heroes": _CREATURE,
+    "enemies": _CREATURE,
+    "weapons": {"name": str, "definition": str, "damage": int, "success_probability": (int, float)},
+    "armor": {"name": str, "definition": str, "defense": int},
+}
+
+
+# разделы, записи которых могут задавать вес выбора: число или список весов по диапазонам глубин
+WEIGHTED = ("enemies", "weapons", "armor")
+
+
+def _is_weight(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
+
+
+def _check_brackets(section, records):
+    """Каждый диапазон глубин раздела должен оставлять хотя бы одну запись с положительным весом"""
+    specs = [record.get("weight", 1) for record in records.values()]
+    brackets = max((len(spec) for spec in specs if isinstance(spec, list)), default=1)
+    for bracket in range(brackets):
+        if not any(spec[min(bracket, len(spec) - 1)] if isinstance(spec, list) else spec for spec in specs):
+            raise ContentError(f"Раздел {section}: в диапазоне глубин {bracket} нет записей с положительным весом")
+
+
+def validate_content(data, partial=False):
+    """
+    Проверяет форму данных до того, как по ним начнут создавать сущности.
+    partial=True допускает отсутствие разделов — так выглядят пакеты-дополнения.
+    """
+    if not isinstance(data, dict):
+        raise ContentError("Игровые данные должны быть объектом JSON")
+    for section, fields in SCHEMA.items():
+        if partial and section not in data:
+            continue
+        records = data.get(section)
+        if not isinstance(records, dict):
+            raise ContentError(f"Раздел {section} должен быть объектом")
+        for key, record in records.items():
+            if not isinstance(record, dict):
+                raise ContentError(f"{section}.{key}: запись должна быть объектом")
+            for name, kind in fields.items():
+                if name not in record:
+                    raise ContentError(f"{section}.{key}: нет поля {name}")
+                if not isinstance(record[name], kind) or isinstance(record[name], bool):
+                    raise ContentError(f"{section}.{key}: неверный тип поля {name}")
+            if section in WEIGHTED and "weight" in record:
+                weight = record["weight"]
+                weights = weight if isinstance(weight, list) and weight else [weight]
+                if not all(_is_weight(value) for value in weights):
+                    raise ContentError(f"{section}.{key}: вес должен быть неотрицательным числом или списком чисел")
+        # пакет-дополнение выбирается вместе с базовыми данными, пустым разделом он не ломает выбор
+        if section in WEIGHTED and not partial:
+            _check_brackets(section, records)
+    if partial and "room_definitions" not in data:
+        return data
+    rooms = data.get("room_definitions")
+    if not isinstance(rooms, list) or not all(isinstance(text, str) for text in rooms):
+        raise ContentError("Раздел room_definitions должен быть списком строк")
+    return data
+
+
+class ContentCache:
+    """Файл кеша: заголовок с признаками исходника и данные в формате marshal"""
+    MAGIC = b"DGCC"
+    # меняется вместе со схемой, чтобы старые кеши не читались
+    VERSION = 4
+    # магия, версия, mtime и размер исходника, хеш исходника, размер блока с ключами героев
+    _header = struct.Struct("<4sBqq16sI")
+
+    def __init__(self, json_file, cache_dir=None):
+        self.json_file = json_file
+        if cache_dir is None:
+            self.path = json_file + ".cache"
+        else:
+            import hashlib
+
+            name = os.path.basename(json_file)
+            digest = hashlib.blake2b(os.path.abspath(json_file).encode("utf-8"), digest_size=8).hexdigest()
+            self.path = os.path.join(cache_dir, f"{name}.{digest}.cache")
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _digest(raw):
+        import hashlib
+
+        return hashlib.blake2b(raw, digest_size=16).digest()
+
+    def read_heroes(self):
+        """Ключи героев из свежего кеша без чтения остальных данных; None, если кеш не подходит"""
+        try:
+            stat = os.stat(self.json_file)
+            with open(self.path, "rb") as f:
+                magic, version, mtime, size, _, heroes_size = self._header.unpack(f.read(self._header.size))
+                if (magic, version, mtime, size) != (self.MAGIC, self.VERSION, stat.st_mtime_ns, stat.st_size):
+                    return None
+                return marshal.loads(f.read(heroes_size))
+        except (OSError, ValueError, EOFError, TypeError, struct.error):
+            return None
+
+    def load(self):
+        """Данные из кеша, а если он устарел или недоступен — из JSON с обновлением кеша"""
+        try:
+            stat = os.stat(self.json_file)
+        except OSError:
+            self.misses += 1
+            return load_json(self.json_file)
+
+        raw = None
+        try:
+            with open(self.path, "rb") as f:
+                header = f.read(self._header.size)
+                magic, version, mtime, size, digest, heroes_size = self._header.unpack(header)
+                if magic == self.MAGIC and version == self.VERSION:
+                    if (mtime, size) != (stat.st_mtime_ns, stat.st_size):
+                        # файл трогали, но содержимое могло остаться прежним
+                        with open(self.json_file, "rb") as source:
+                            raw = source.read()
+                        if self._digest(raw) != digest:
+                            raise ValueError("кеш устарел")
+                    f.seek(heroes_size, os.SEEK_CUR)
+                    # marshal.load читает файл мелкими порциями, loads на готовых байтах заметно быстрее
+                    data = marshal.loads(f.read())
+                    self.hits += 1
+                    if raw is not None:
+                        self._write(stat, raw, data)
+                    return data
+        except (OSError, ValueError, EOFError, TypeError, struct.error):
+            pass
+
+        self.misses += 1
+        if raw is None:
+            with open(self.json_file, "rb") as source:
+                raw = source.read()
+        import json
+
+        data = validate_content(json.loads(raw.decode("utf-8")))
+        self._write(stat, raw, data)
+        return data
+
+    def _write(self, stat, raw, data):
+        heroes = marshal.dumps(tuple(data["heroes"]))
+        header = self._header.pack(self.MAGIC, self.VERSION, stat.st_mtime_ns, stat.st_size, self._digest(raw),
+                                   len(heroes))
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            if self.cache_dir is not None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+            with open(temporary, "wb") as f:
+                f.write(header + heroes + marshal.dumps(data))
+            # параллельные процессы не увидят недописанный кеш
+            os.replace(temporary, self.path)
+        except OSError:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+
+
+def load_json(json_file):
+    import json
+
+    with open(json_file, 'r', encoding='utf-8') as f:
+        return validate_content(json.load(f))
@@ -0,0 +1,463 @@
+"""
+Индексированные пакеты игровых данных для очень больших наборов контента.
+
+Пакет — двоичный файл, который открывается через mmap. Каждая запись хранится
+отдельным фрагментом JSON, а индекс смещений и отсортированный по ключам
+порядок позволяют найти запись по номеру или ключу, ничего не разбирая заранее.
+Разбираются только те записи, к которым действительно обратились.
+
+Веса случайного выбора (поле weight) при сборке пакета выписываются в отдельную
+типизированную колонку — по числу на запись и диапазон глубин, — так что таблица
+выбора строится из колонки, не разбирая записи.
+
+Несколько пакетов складываются в стопку: запись из более позднего пакета
+перекрывает запись с тем же ключом из ранних, описания комнат объединяются.
+
+    python content_pack.py build data/game_data.json base.pack
+    python content_pack.py build mods/hard.json hard.pack
+"""
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from collections.abc import Mapping, Sequence
+from functools import cached_property
+
+from content_cache import ContentError, validate_content
+from main import DEPTH_BRACKET, Armor, ContentCatalog, Weapon
+
+
+MAGIC = b"DGPK"
+VERSION = 2
+SECTIONS = ("heroes", "enemies", "weapons", "armor", "room_definitions")
+
+_header = struct.Struct("<4sB3x")
+# число записей, смещение индекса смещений, смещение порядка по ключам,
+# смещение колонки весов и число диапазонов глубин в ней (0 — в разделе нет весов)
+_section = struct.Struct("<QQQQI4x")
+
+
+def _align(body):
+    body.extend(bytes(-len(body) % 8))
+
+
+def write_pack(path, data):
+    """Собирает пакет из словаря в формате game_data.json; разделы можно опускать"""
+    if sys.byteorder != "little":
+        raise ContentError("Пакеты собираются только на little-endian платформах")
+    validate_content(data, partial=True)
+    start = _header.size + _section.size * len(SECTIONS)
+    body = bytearray()
+    table = []
+    for name in SECTIONS:
+        if name == "room_definitions":
+            records = [("", text) for text in data.get(name, ())]
+        else:
+            records = list(data.get(name, {}).items())
+        offsets = array("Q")
+        for key, record in records:
+            offsets.append(start + len(body))
+            body += key.encode("utf-8") + b"\0"
+            body += json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        offsets.append(start + len(body))
+        _align(body)
+        offsets_pos = start + len(body)
+        body += offsets.tobytes()
+        order = array("I", sorted(range(len(records)), key=lambda i: records[i][0]))
+        order_pos = start + len(body)
+        body += order.tobytes()
+        _align(body)
+        weights = [record.get("weight") for _, record in records] if name != "room_definitions" else []
+        brackets = max((len(weight) if isinstance(weight, list) else 1 for weight in weights if weight is not None),
+                       default=0)
+        weights_pos = 0
+        if brackets:
+            # строка на запись: вес в каждом диапазоне, последний повторяется до конца
+            column = array("d")
+            for weight in weights:
+                if weight is None:
+                    weight = 1
+                if isinstance(weight, list):
+                    column.extend(weight + weight[-1:] * (brackets - len(weight)))
+                else:
+                    column.extend([weight] * brackets)
+            weights_pos = start + len(body)
+            body += column.tobytes()
+        table.append(_section.pack(len(records), offsets_pos, order_pos, weights_pos, brackets))
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(_header.pack(MAGIC, VERSION))
+        f.write(b"".join(table))
+        f.write(body)
+    os.replace(temporary, path)
+
+
+class PackSection:
+    """Раздел одного пакета: записи по номеру и поиск номера по ключу"""
+
+    def __init__(self, buffer, view, count, offsets_pos, order_pos, weights_pos, brackets):
+        self._buffer = buffer
+        self._offsets = view[offsets_pos:offsets_pos + 8 * (count + 1)].cast("Q")
+        self._order = view[order_pos:order_pos + 4 * count].cast("I")
+        self._weights = view[weights_pos:weights_pos + 8 * count * brackets].cast("d") if brackets else None
+        self.count = count
+        self.brackets = brackets
+
+    def __len__(self):
+        return self.count
+
+    def weights(self, bracket):
+        """Веса записей в диапазоне глубин bracket по порядку номеров; без колонки — по 1"""
+        if self._weights is None:
+            return [1.0] * self.count
+        return self._weights[min(bracket, self.brackets - 1)::self.brackets].tolist()
+
+    def _split(self, index):
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return start, self._buffer.find(b"\0", start, end), end
+
+    def key(self, index):
+        start, separator, _ = self._split(index)
+        return self._buffer[start:separator].decode("utf-8")
+
+    def record(self, index):
+        _, separator, end = self._split(index)
+        return json.loads(self._buffer[separator + 1:end])
+
+    def sorted_keys(self):
+        """(ключ в UTF-8, номер) по возрастанию ключа; порядок байт UTF-8 совпадает с порядком строк"""
+        buffer = self._buffer
+        for index in self._order:
+            start, separator, _ = self._split(index)
+            yield buffer[start:separator], index
+
+    def shadowed_by(self, later):
+        """Номера записей, ключи которых есть и в разделе later: слияние двух порядков по ключам"""
+        found = []
+        theirs = later.sorted_keys()
+        other = next(theirs, None)
+        for key, index in self.sorted_keys():
+            while other is not None and other[0] < key:
+                other = next(theirs, None)
+            if other is None:
+                break
+            if other[0] == key:
+                found.append(index)
+        return found
+
+    def find(self, key):
+        """Номер записи с ключом key или None: двоичный поиск по порядку ключей"""
+        order = self._order
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key(order[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.key(order[low]) == key:
+            return order[low]
+        return None
+
+
+class ContentPack:
+    """Открытый через mmap файл пакета"""
+
+    def __init__(self, path):
+        if sys.byteorder != "little":
+            raise ContentError("Пакеты читаются только на little-endian платформах")
+        self.path = path
+        with open(path, "rb") as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = _header.unpack_from(self._buffer, 0)
+        if magic != MAGIC:
+            raise ContentError(f"{path} не является пакетом данных")
+        if version != VERSION:
+            raise ContentError(f"{path}: неподдерживаемая версия пакета {version}")
+        view = memoryview(self._buffer)
+        self.sections = {}
+        for i, name in enumerate(SECTIONS):
+            fields = _section.unpack_from(self._buffer, _header.size + i * _section.size)
+            self.sections[name] = PackSection(self._buffer, view, *fields)
+
+
+class OverlaySection(Mapping):
+    """
+    Один раздел из стопки пакетов. Глобальный номер записи — номер внутри пакета
+    плюс число записей во всех пакетах до него. Как словарь раздел отдает
+    ключ -> запись с учетом перекрытий.
+    """
+
+    def __init__(self, sections, keyed=True):
+        self.sections = sections
+        self.keyed = keyed
+        self.starts = list(itertools.accumulate((len(section) for section in sections), initial=0))
+        self.total = self.starts[-1]
+        self.brackets = max(section.brackets for section in sections)
+        self._hidden = None
+        self._hidden_set = None
+
+    def _locate(self, index):
+        pack = bisect_right(self.starts, index) - 1
+        return pack, index - self.starts[pack]
+
+    def key(self, index):
+        pack, local = self._locate(index)
+        return self.sections[pack].key(local)
+
+    def record(self, index):
+        pack, local = self._locate(index)
+        return self.sections[pack].record(local)
+
+    def find(self, key):
+        for pack in range(len(self.sections) - 1, -1, -1):
+            local = self.sections[pack].find(key)
+            if local is not None:
+                return self.starts[pack] + local
+        return None
+
+    @property
+    def hidden(self):
+        """
+        Отсортированные глобальные номера перекрытых записей. Считаются один раз
+        слиянием упорядоченных ключей каждой пары пакетов — без разбора записей.
+        """
+        if self._hidden is None:
+            self._find_hidden()
+        return self._hidden
+
+    def _find_hidden(self):
+        hidden = set()
+        if self.keyed:
+            for earlier, section in enumerate(self.sections):
+                for later in self.sections[earlier + 1:]:
+                    hidden.update(self.starts[earlier] + index for index in section.shadowed_by(later))
+        self._hidden = sorted(hidden)
+        self._hidden_set = hidden
+
+    def is_visible(self, index):
+        """Запись не перекрыта записью с тем же ключом из более позднего пакета"""
+        if self._hidden is None:
+            self._find_hidden()
+        return index not in self._hidden_set
+
+    def visible_index(self, position):
+        """Глобальный номер position-й по счету видимой записи"""
+        hidden = self.hidden
+        index = position
+        while True:
+            shifted = position + bisect_right(hidden, index)
+            if shifted == index:
+                return index
+            index = shifted
+
+    @property
+    def weighted(self):
+        """Хотя бы в одном пакете у записей раздела есть поле weight"""
+        return self.brackets > 0
+
+    def weights(self, bracket):
+        """Веса всех записей по глобальным номерам; у перекрытых записей вес нулевой"""
+        weights = []
+        for section in self.sections:
+            weights.extend(section.weights(bracket))
+        for index in self.hidden:
+            weights[index] = 0.0
+        return weights
+
+    def random_index(self, rng):
+        """
+        Равновероятный выбор среди видимых записей без списка ключей:
+        перекрытые записи отбрасываются, и выбор повторяется
+        """
+        while True:
+            index = rng.randrange(self.total)
+            if self.is_visible(index):
+                return index
+
+    def __getitem__(self, key):
+        index = self.find(key)
+        if index is None:
+            raise KeyError(key)
+        return self.record(index)
+
+    def __iter__(self):
+        for index in range(self.total):
+            if self.is_visible(index):
+                yield self.key(index)
+
+    def __len__(self):
+        return self.total - len(self.hidden)
+
+
+class OverlayIds(Mapping):
+    """Ключ -> глобальный номер видимой записи"""
+
+    def __init__(self, section):
+        self.section = section
+
+    def __getitem__(self, key):
+        index = self.section.find(key)
+        if index is None:
+            raise KeyError(key)
+        return index
+
+    def __iter__(self):
+        return iter(self.section)
+
+    def __len__(self):
+        return len(self.section)
+
+
+class OverlayKeys(Sequence):
+    """Ключи раздела по глобальному номеру"""
+
+    def __init__(self, section):
+        self.section = section
+
+    def __len__(self):
+        return self.section.total
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.section.key(range(self.section.total)[index])
+
+
+class VisibleKeys(Sequence):
+    """Ключи видимых записей раздела по порядку, без построения полного списка"""
+
+    def __init__(self, section):
+        self.section = section
+
+    def __len__(self):
+        return len(self.section)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        return self.section.key(self.section.visible_index(range(len(self))[position]))
+
+
+class LazyRecords(Sequence):
+    """
+    Объекты раздела по глобальному номеру, создаются при первом обращении и запоминаются.
+    keyed=True — build получает ключ записи вторым аргументом.
+    """
+
+    def __init__(self, section, build, keyed=False):
+        self.section = section
+        self.build = build
+        self.keyed = keyed
+        self.built = {}
+
+    def __len__(self):
+        return self.section.total
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = range(self.section.total)[index]
+        value = self.built.get(index)
+        if value is None:
+            record = self.section.record(index)
+            if self.keyed:
+                value = self.build(record, self.section.key(index))
+            else:
+                value = self.build(record)
+            self.built[index] = value
+        return value
+
+
+class PackCatalog(ContentCatalog):
+    """Каталог поверх стопки пакетов с тем же интерфейсом, что у ContentCatalog"""
+
+    def __init__(self, packs):
+        self.packs = packs
+        sections = {
+            name: OverlaySection([pack.sections[name] for pack in packs], keyed=name != "room_definitions")
+            for name in SECTIONS
+        }
+        self.sections = sections
+        self.weight_specs = {}
+        self.alias_tables = {}
+        self.hero_keys = OverlayKeys(sections["heroes"])
+        self.enemy_keys = OverlayKeys(sections["enemies"])
+        self.weapon_keys = OverlayKeys(sections["weapons"])
+        self.armor_keys = OverlayKeys(sections["armor"])
+        self.hero_ids = OverlayIds(sections["heroes"])
+        self.enemy_ids = OverlayIds(sections["enemies"])
+        self.weapon_ids = OverlayIds(sections["weapons"])
+        self.armor_ids = OverlayIds(sections["armor"])
+        self.heroes = LazyRecords(sections["heroes"], self._creature)
+        self.enemies = LazyRecords(sections["enemies"], self._creature)
+        self.weapons = LazyRecords(sections["weapons"], self._weapon, keyed=True)
+        self.armor = LazyRecords(sections["armor"], self._armor, keyed=True)
+        self.room_definitions = LazyRecords(sections["room_definitions"], str)
+        self.data = {name: sections[name] for name in SECTIONS[:-1]}
+        self.data["room_definitions"] = self.room_definitions
+
+    @cached_property
+    def hero_list(self):
+        return VisibleKeys(self.sections["heroes"])
+
+    @cached_property
+    def enemy_list(self):
+        return VisibleKeys(self.sections["enemies"])
+
+    @staticmethod
+    def _weapon(record, key):
+        return Weapon(record["name"], record["definition"], record["damage"], record["success_probability"],
+                      key).freeze()
+
+    @staticmethod
+    def _armor(record, key):
+        return Armor(record["name"], record["definition"], record["defense"], key).freeze()
+
+    def _bracket(self, section, depth):
+        # веса лежат в колонках пакетов, записи для них не разбираются
+        return None, min(depth // DEPTH_BRACKET, max(self.sections[section].brackets, 1) - 1)
+
+    def weights(self, section, depth=0):
+        _, bracket = self._bracket(section, depth)
+        return self.sections[section].weights(bracket)
+
+    def _pick(self, section, rng, depth):
+        overlay = self.sections[section]
+        if overlay.weighted:
+            return self.alias_table(section, depth).sample(rng)
+        # без весов таблица не нужна: хватает повторного выбора мимо перекрытых записей
+        return overlay.random_index(rng)
+
+    def random_enemy_id(self, rng, depth=0):
+        return self._pick("enemies", rng, depth)
+
+    def random_weapon(self, rng, depth=0):
+        return self.weapons[self._pick("weapons", rng, depth)]
+
+    def random_armor(self, rng, depth=0):
+        return self.armor[self._pick("armor", rng, depth)]
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Пакеты игровых данных")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="собрать пакет из JSON")
+    build.add_argument("source")
+    build.add_argument("target")
+    args = parser.parse_args(argv)
+
+    with open(args.source, encoding="utf-8") as f:
+        write_pack(args.target, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
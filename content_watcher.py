@@ -0,0 +1,39 @@
+"""
+Перезагрузка игровых данных без перезапуска процесса.
+
+Фоновый поток раз в interval секунд проверяет mtime и размер файла данных.
+Разбор, проверка схемы и сборка каталога идут в этом потоке, а игра видит
+только готовую версию, подмененную одним присваиванием.
+"""
+import threading
+
+
+class ContentWatcher:
+    """Следит за файлом данных генератора и перезагружает его при изменении"""
+
+    def __init__(self, generator, interval=1.0):
+        self.generator = generator
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="content-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.generator.reload_if_changed()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
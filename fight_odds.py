@@ -0,0 +1,74 @@
+from collections import namedtuple
+from functools import lru_cache
+
+
+# stalemate_probability — доля боев, где никто не пробивает броню; expected_turns считается без них
+FightOdds = namedtuple("FightOdds", ["win_probability", "expected_turns", "expected_hp_left", "stalemate_probability"],
+                       defaults=(0.0,))
+
+
+@lru_cache(maxsize=None)
+def hit_chance(success_probability):
+    """Вероятность попадания при броске success_probability >= randint(0, 100) / 100"""
+    return sum(1 for roll in range(101) if success_probability >= roll / 100) / 101
+
+
+@lru_cache(maxsize=4096)
+def solve_fight(hero_health, hero_damage, hero_probability, hero_defense,
+                enemy_health, enemy_damage, enemy_probability, enemy_defense):
+    """
+    Точное решение боя DungeonController.auto_fight как цепи Маркова.
+
+    Состояние — (здоровье героя, здоровье врага, чей ход). Бой всегда начинается
+    с хода героя. Возвращает вероятность победы героя, ожидаемое число ходов
+    и ожидаемое здоровье героя после победы (до восстановления). Бой, в котором
+    никто не пробивает броню, — ничья: stalemate_probability равна 1, ходов бесконечно.
+    """
+    hero_blow = hero_damage - enemy_defense
+    enemy_blow = enemy_damage - hero_defense
+    # промах и непробитая броня одинаково ничего не меняют
+    q_hero = hit_chance(hero_probability) if hero_blow > 0 else 0.0
+    q_enemy = hit_chance(enemy_probability) if enemy_blow > 0 else 0.0
+
+    stall = 1 - (1 - q_hero) * (1 - q_enemy)
+    if stall == 0:
+        return FightOdds(0.0, float("inf"), 0.0, 1.0)
+
+    # hero_turn[h][e] — (вероятность победы, ожидаемые ходы, здоровье при победе * вероятность)
+    # на ходу героя; ход врага выражается через него же
+    hero_turn = [[None] * (enemy_health + 1) for _ in range(hero_health + 1)]
+
+    def enemy_turn(h, e):
+        if q_enemy and h - enemy_blow > 0:
+            hit = hero_turn[h - enemy_blow][e]
+        else:
+            hit = (0.0, 0.0, 0.0)
+        stay = hero_turn[h][e]
+        win, turns, hp = (q_enemy * a + (1 - q_enemy) * b for a, b in zip(hit, stay))
+        return win, turns + 1, hp
+
+    for h in range(1, hero_health + 1):
+        for e in range(1, enemy_health + 1):
+            # ход героя -> (попадание) ход врага при e - hero_blow либо победа
+            if q_hero and e - hero_blow <= 0:
+                after_hit = (1.0, 0.0, float(h))
+            elif q_hero:
+                after_hit = enemy_turn(h, e - hero_blow)
+            else:
+                after_hit = (0.0, 0.0, 0.0)
+            # промах героя -> ход врага -> (попадание врага) ход героя при h - enemy_blow
+            if q_enemy and h - enemy_blow > 0:
+                after_counter = hero_turn[h - enemy_blow][e]
+            else:
+                after_counter = (0.0, 0.0, 0.0)
+            # цикл «промах героя -> промах врага» возвращает в то же состояние,
+            # поэтому уравнение решается делением на stall
+            win, turns, hp = (
+                (q_hero * a + (1 - q_hero) * q_enemy * b) / stall
+                for a, b in zip(after_hit, after_counter)
+            )
+            turns += (1 + (1 - q_hero)) / stall
+            hero_turn[h][e] = (win, turns, hp)
+
+    win, turns, hp = hero_turn[hero_health][enemy_health]
+    return FightOdds(win, turns, hp / win if win else 0.0)
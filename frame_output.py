@@ -0,0 +1,209 @@
+"""
+Покадровый вывод боя для терминала.
+
+Во время auto_fight экран держит неподвижную область: полоска героя, полоска
+врага и последние log_lines строк журнала боя. Каждый ход собирается в кадр,
+сравнивается с предыдущим по ячейкам, и в терминал уходят только изменившиеся
+ячейки с управляющими последовательностями перемещения курсора — одной записью
+на кадр. При max_fps ходы, пришедшие чаще, сливаются в один кадр; последний
+кадр боя рисуется всегда. Все, что вне боя, выводится обычным текстом.
+
+Для каналов и файлов остаются ConsoleOutput и BufferedOutput: main.py выбирает
+этот вывод, только если stdout — терминал.
+"""
+import sys
+import time
+from collections import deque
+
+from main import HealthBarDrawer, render_message
+
+# ячейка — пара (символ, стиль); стиль — управляющая последовательность цвета или ""
+RESET = HealthBarDrawer.RESET
+# перескок курсора дороже нескольких неизменных ячеек, короткие промежутки перерисовываются
+MIN_GAP = 5
+
+
+def text_cells(text, style=""):
+    return [(char, style) for char in text]
+
+
+class FrameOutput:
+    """Вывод, который рисует бой кадрами в неподвижной области экрана"""
+
+    def __init__(self, stream=None, metrics=None, log_lines=5, width=78, max_fps=None, clock=time.monotonic):
+        self.stream = stream
+        self.metrics = metrics
+        self.width = width
+        self.interval = 1 / max_fps if max_fps else 0.0
+        self.clock = clock
+        self.log = deque(maxlen=log_lines)
+        self._parts = []
+        # строки последнего нарисованного кадра; None — вне боя
+        self._screen = None
+        self._bars = {}
+        self._last_frame = None
+        self._dirty = False
+        # строк журнала в нарисованном кадре и добавлено с тех пор
+        self._drawn_log = 0
+        self._appended = 0
+        self.frames = 0
+
+    @property
+    def in_fight(self):
+        return self._screen is not None
+
+    def emit(self, message_id, **params):
+        if message_id == "health_bar":
+            if self._screen is None:
+                self._screen = []
+                self.log.clear()
+                self._bars.clear()
+                self._drawn_log = self._appended = 0
+            elif params["entity_type"] == "hero" and self._dirty:
+                # полоска героя открывает следующий ход: предыдущий закончен
+                self._frame()
+            self._bars[params["entity_type"]] = params
+            self._dirty = True
+        elif self._screen is not None and message_id == "separator":
+            self._frame(force=True)
+            self._screen = None
+            self._parts.append(render_message(message_id, params) + "\n")
+        elif self._screen is not None:
+            for line in render_message(message_id, params).splitlines():
+                self.log.append(line)
+                self._appended += 1
+            self._dirty = True
+        else:
+            self._parts.append(render_message(message_id, params))
+            self._parts.append("\n")
+
+    def _bar_row(self, entity_type):
+        params = self._bars.get(entity_type)
+        if params is None:
+            return []
+        length = HealthBarDrawer.BAR_LENGTH
+        filled = min(max(int(length * params["current_hp"] / params["max_hp"]), 0), length)
+        style = HealthBarDrawer.GREEN if entity_type == "hero" else HealthBarDrawer.RED
+        label = f"{params['name']} {max(params['current_hp'], 0)}/{params['max_hp']}"
+        label = label[:self.width - length - 3].ljust(self.width - length - 3)
+        return (text_cells(label + " |") + text_cells("█" * filled, style)
+                + text_cells("_" * (length - filled), style) + text_cells("|"))
+
+    def render(self):
+        """Строки кадра в ячейках: две полоски и журнал, дополненный пустыми строками"""
+        rows = [self._bar_row("hero"), self._bar_row("enemy")]
+        log = list(self.log)
+        log += [""] * (self.log.maxlen - len(log))
+        rows.extend(text_cells(line[:self.width]) for line in log)
+        return rows
+
+    def _frame(self, force=False):
+        now = self.clock()
+        if not force and self._last_frame is not None and now - self._last_frame < self.interval:
+            return
+        rows = self.render()
+        if self._screen:
+            text = self._scroll_log() + self.diff(self._screen, rows)
+        else:
+            text = "".join(self.draw_row(row) + "\n" for row in rows)
+        self._write("".join(self._parts) + text)
+        self._parts.clear()
+        self._screen = rows
+        self._last_frame = now
+        self._dirty = False
+        self._drawn_log = len(self.log)
+        self._appended = 0
+        self.frames += 1
+
+    def _scroll_log(self):
+        """
+        Сдвигает строки журнала на экране вверх удалением строк терминала, если журнал
+        прокрутился: тогда перерисовывать нужно только новые строки, а не весь журнал
+        """
+        size = self.log.maxlen
+        shift = self._drawn_log + self._appended - size
+        if shift <= 0 or shift >= size:
+            return ""
+        screen = self._screen
+        top = len(screen) - size
+        # курсор под областью кадра; строки ниже журнала пустые, их сдвиг ничего не портит
+        self._screen = screen[:top] + screen[top + shift:] + [[] for _ in range(shift)]
+        up = len(screen) - top
+        return f"\x1b[{up}A\x1b[{shift}M\x1b[{up}B\r"
+
+    @staticmethod
+    def draw_row(cells):
+        parts = []
+        current = ""
+        for char, style in cells:
+            if style != current:
+                parts.append(style or RESET)
+                current = style
+            parts.append(char)
+        if current:
+            parts.append(RESET)
+        return "".join(parts)
+
+    @classmethod
+    def diff(cls, old, new):
+        """
+        Последовательность, которая превращает нарисованный кадр old в new.
+        Курсор до и после стоит в начале строки под областью кадра.
+        """
+        height = len(new)
+        parts = []
+        cursor = height
+        for row in range(height):
+            before, after = old[row], new[row]
+            runs = cls._changed_runs(before, after)
+            if not runs and len(before) <= len(after):
+                continue
+            if cursor > row:
+                parts.append(f"\x1b[{cursor - row}A")
+            elif cursor < row:
+                parts.append(f"\x1b[{row - cursor}B")
+            cursor = row
+            for start, end in runs:
+                parts.append(f"\x1b[{start + 1}G")
+                parts.append(cls.draw_row(after[start:end]))
+            if len(before) > len(after):
+                parts.append(f"\x1b[{len(after) + 1}G\x1b[K")
+        if cursor < height:
+            parts.append(f"\x1b[{height - cursor}B")
+        if parts:
+            parts.append("\r")
+        return "".join(parts)
+
+    @staticmethod
+    def _changed_runs(before, after):
+        """Отрезки [начало, конец) ячеек строки after, которые отличаются от before"""
+        runs = []
+        start = None
+        for i, cell in enumerate(after):
+            changed = i >= len(before) or before[i] != cell
+            if changed and start is None:
+                if runs and i - runs[-1][1] < MIN_GAP:
+                    start = runs.pop()[0]
+                else:
+                    start = i
+            elif not changed and start is not None:
+                runs.append((start, i))
+                start = None
+        if start is not None:
+            runs.append((start, len(after)))
+        return runs
+
+    def _write(self, text):
+        if not text:
+            return
+        stream = self.stream if self.stream is not None else sys.stdout
+        stream.write(text)
+        stream.flush()
+        if self.metrics is not None:
+            self.metrics.inc("dungeon_output_bytes_total", len(text.encode("utf-8")))
+
+    def flush(self):
+        if self._screen is not None and self._dirty:
+            self._frame(force=True)
+        self._write("".join(self._parts))
+        self._parts.clear()
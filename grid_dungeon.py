@@ -0,0 +1,119 @@
+"""
+Большие подземелья: решетка из комнат, которая генерируется чанками по мере продвижения героя.
+
+Комната задается целым ID = y * width + x. Соседи и направление к выходу
+считаются арифметикой по координатам, поэтому индекс соседей памяти не занимает.
+Чанк зависит только от seed и своих координат: выгруженный чанк при
+повторном посещении генерируется заново точно таким же.
+"""
+import random
+from collections import OrderedDict
+
+
+ROOM_TYPES = ("St", "", "E", "Ex")
+START, EMPTY, ENEMY, EXIT = range(4)
+
+DIRECTIONS = (
+    ("north", 0, -1),
+    ("south", 0, 1),
+    ("west", -1, 0),
+    ("east", 1, 0),
+)
+
+
+def derive_seed(seed, *path):
+    import hashlib
+
+    digest = hashlib.blake2b(repr((seed, path)).encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest, "little")
+
+
+class GridDungeon:
+    """Подземелье-решетка width × height с ленивой генерацией чанками"""
+    CHUNK = 32
+
+    def __init__(self, width, height, seed, enemy_density=0.3, max_chunks=64, unload_radius=2):
+        if width * height < 2:
+            raise ValueError("В подземелье должно быть хотя бы две комнаты")
+        self.width = width
+        self.height = height
+        self.seed = seed
+        self.enemy_density = enemy_density
+        self.max_chunks = max_chunks
+        self.unload_radius = unload_radius
+        self.start = 0
+        exit_rng = random.Random(derive_seed(seed, "exit"))
+        self.exit = exit_rng.randrange(1, width * height)
+        self.chunks = OrderedDict()
+        self.generated = 0
+        self.unloaded = 0
+
+    def __len__(self):
+        return self.width * self.height
+
+    def __getitem__(self, room):
+        x, y = room % self.width, room // self.width
+        chunk = self._chunk(x // self.CHUNK, y // self.CHUNK)
+        return ROOM_TYPES[chunk[(y % self.CHUNK) * self.CHUNK + x % self.CHUNK]]
+
+    def _chunk(self, cx, cy):
+        key = (cx, cy)
+        chunk = self.chunks.get(key)
+        if chunk is not None:
+            self.chunks.move_to_end(key)
+            return chunk
+        chunk = self._generate(cx, cy)
+        self.chunks[key] = chunk
+        self.generated += 1
+        while len(self.chunks) > self.max_chunks:
+            self.chunks.popitem(last=False)
+            self.unloaded += 1
+        return chunk
+
+    def _generate(self, cx, cy):
+        rng = random.Random(derive_seed(self.seed, "chunk", cx, cy))
+        size = self.CHUNK * self.CHUNK
+        chunk = bytearray(rng.choices((EMPTY, ENEMY), (1 - self.enemy_density, self.enemy_density), k=size))
+        # клетки за краем подземелья в последних чанках никогда не читаются
+        for room, code in ((self.start, START), (self.exit, EXIT)):
+            x, y = room % self.width, room // self.width
+            if (x // self.CHUNK, y // self.CHUNK) == (cx, cy):
+                chunk[(y % self.CHUNK) * self.CHUNK + x % self.CHUNK] = code
+        return chunk
+
+    def coordinates(self, room):
+        return room % self.width, room // self.width
+
+    def neighbors(self, room):
+        """Соседние комнаты: список пар (направление, ID комнаты)"""
+        x, y = room % self.width, room // self.width
+        result = []
+        for name, dx, dy in DIRECTIONS:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < self.width and 0 <= ny < self.height:
+                result.append((name, ny * self.width + nx))
+        return result
+
+    def distance_to_exit(self, room):
+        x, y = room % self.width, room // self.width
+        ex, ey = self.exit % self.width, self.exit // self.width
+        return abs(ex - x) + abs(ey - y)
+
+    def direction_to_exit(self, room):
+        """Направление шага, который приближает к выходу, или None, если герой уже на выходе"""
+        distance = self.distance_to_exit(room)
+        for name, neighbor in self.neighbors(room):
+            if self.distance_to_exit(neighbor) < distance:
+                return name
+        return None
+
+    def visit(self, room):
+        """Отмечает положение героя и выгружает чанки, рядом с которыми никого нет"""
+        x, y = room % self.width, room // self.width
+        cx, cy = x // self.CHUNK, y // self.CHUNK
+        far = [key for key in self.chunks
+               if max(abs(key[0] - cx), abs(key[1] - cy)) > self.unload_radius]
+        for key in far:
+            del self.chunks[key]
+            self.unloaded += 1
+        self[room]
@@ -0,0 +1,188 @@
+"""
+Групповые бои: комната с отрядом или роем врагов против одного героя.
+
+Отряд хранится не списком объектов, а стопками одинаковых врагов — по одной на
+сочетание (враг, оружие, броня) — в массивах numpy: число живых, здоровье,
+здоровье переднего врага стопки, урон сквозь броню героя и шанс попадания.
+Герой, как и в auto_fight, бьет на нечетных ходах переднего врага первой
+живой стопки. На четных ходах бьют все живые враги сразу: число попаданий в
+каждой стопке — одна биномиальная выборка, урон — скалярное произведение.
+Ход стоит O(число стопок), а стопок не больше, чем сочетаний в каталоге, так
+что цена на одного врага падает с ростом отряда.
+"""
+import random
+
+import numpy as np
+
+from fight_odds import hit_chance
+
+
+class EnemyGroup:
+    """Отряд врагов одной комнаты, сложенный в стопки одинаковых по характеристикам"""
+    # отряды не хранятся в EntityPool и не пишутся в снимки
+    index = None
+    key = None
+
+    def __init__(self, stacks):
+        """stacks — список пар (Enemy-образец, сколько таких в отряде)"""
+        if not stacks:
+            raise ValueError("В отряде должен быть хотя бы один враг")
+        self.templates = [enemy for enemy, _ in stacks]
+        self.counts = np.array([count for _, count in stacks], dtype=np.int64)
+        self.initial_counts = self.counts.copy()
+        self.health = np.array([enemy.max_health for enemy in self.templates], dtype=np.int64)
+        # здоровье переднего врага каждой стопки, остальные в ней целы
+        self.front = self.health.copy()
+        self.damage = np.array([enemy.weapon.damage for enemy in self.templates], dtype=np.int64)
+        # шанс попадания при броске success_probability >= randint(0, 100) / 100
+        self.chance = np.array([hit_chance(enemy.weapon.success_probability) for enemy in self.templates])
+        self.defense = np.array([enemy.armor.defense for enemy in self.templates], dtype=np.int64)
+        self.size = int(self.counts.sum())
+        self.max_health = int(self.counts @ self.health)
+        self.death_definition = self.templates[0].death_definition
+        # состав отряда при встрече, для сообщения о победе
+        self.title = self.name
+
+    @property
+    def alive(self):
+        return int(self.counts.sum())
+
+    @property
+    def name(self):
+        return ", ".join(f"{enemy.name} ×{count}" for enemy, count in zip(self.templates, self.counts) if count)
+
+    @property
+    def current_health(self):
+        """Суммарное здоровье живых врагов"""
+        return int(self.counts @ self.health - (self.health - self.front) @ (self.counts > 0))
+
+    @current_health.setter
+    def current_health(self, value):
+        """
+        Отряд можно только убить целиком (value <= 0) или восстановить в исходном
+        составе (value == max_health): иначе непонятно, какие враги ранены
+        """
+        if value <= 0:
+            self.counts[:] = 0
+            self.front[:] = 0
+        elif value == self.max_health:
+            self.counts[:] = self.initial_counts
+            self.front[:] = self.health
+        elif value != self.current_health:
+            raise ValueError(f"Здоровье отряда можно сделать только 0 или {self.max_health}, а не {value}")
+
+    def target(self):
+        """Номер стопки, чей передний враг принимает удар героя, или None, если все мертвы"""
+        alive = np.flatnonzero(self.counts)
+        return int(alive[0]) if alive.size else None
+
+    def hit_target(self, stack, damage):
+        """Удар по переднему врагу стопки; True, если он погиб"""
+        self.front[stack] -= damage
+        if self.front[stack] > 0:
+            return False
+        self.counts[stack] -= 1
+        self.front[stack] = self.health[stack] if self.counts[stack] else 0
+        return True
+
+    def volley(self, hero_defense, generator):
+        """Ход отряда: все живые враги бьют разом; возвращает (число попаданий, урон)"""
+        blow = np.maximum(self.damage - hero_defense, 0)
+        hits = generator.binomial(self.counts, self.chance * (blow > 0))
+        landed = int(hits.sum())
+        return landed, int(hits @ blow)
+
+
+def group_fight_steps(hero, group, output=None, rng=None, metrics=None, max_turns=None, events=True):
+    """
+    Бой героя с отрядом по тем же правилам чередования ходов, что и fight_steps:
+    после каждого хода отдает TurnEvent (или None при events=False), итог —
+    True, False или None при остановке по max_turns — значение StopIteration.
+    """
+    from main import ConsoleOutput, TurnEvent, hit_roller
+
+    if output is None:
+        output = ConsoleOutput()
+    roll = hit_roller(rng)
+    # броски отряда идут из numpy, но seed берется из потока сессии, так что бой воспроизводим
+    generator = np.random.default_rng((rng or random).getrandbits(64))
+    i = 1
+
+    try:
+        while hero.current_health > 0 and group.alive:
+            if max_turns is not None and i > max_turns:
+                output.emit("fight_stalled", name=group.name)
+                output.emit("separator")
+                if metrics is not None:
+                    metrics.inc("dungeon_fights_total", result="stalled")
+                return None
+            output.emit("health_bar", entity_type="hero", name=hero.name,
+                        current_hp=hero.current_health, max_hp=hero.max_health)
+            output.emit("health_bar", entity_type="enemy", name=group.name,
+                        current_hp=group.current_health, max_hp=group.max_health)
+            if i == 1:
+                output.emit("fight_start")
+            damage = 0
+            if i % 2 == 1:
+                attacker = "hero"
+                stack = group.target()
+                target = group.templates[stack]
+                output.emit("hero_attack")
+                if hero.hit_probability >= roll() / 100:
+                    if hero.damage > group.defense[stack]:
+                        outcome = "hit"
+                        damage = hero.damage - int(group.defense[stack])
+                        output.emit("hero_hit", damage=damage, name=target.name)
+                        if group.hit_target(stack, damage):
+                            output.emit("group_enemy_down", name=target.name, alive=group.alive)
+                    else:
+                        outcome = "blocked"
+                        output.emit("hero_blocked")
+                else:
+                    outcome = "miss"
+                    output.emit("hero_missed", name=target.name)
+            else:
+                attacker = "group"
+                output.emit("group_attack", alive=group.alive)
+                hits, damage = group.volley(hero.defense, generator)
+                if damage:
+                    outcome = "hit"
+                    hero.current_health = hero.current_health - damage
+                    output.emit("group_hit", hits=hits, damage=damage)
+                elif hits:
+                    outcome = "blocked"
+                    output.emit("group_blocked", hits=hits)
+                else:
+                    outcome = "miss"
+                    output.emit("group_missed")
+
+            yield TurnEvent(i, attacker, outcome, damage, hero.current_health,
+                            group.current_health) if events else None
+
+            if not group.alive:
+                output.emit("health_bar", entity_type="enemy", name=group.title,
+                            current_hp=0, max_hp=group.max_health)
+                output.emit("victory", name=group.title, death_definition=group.death_definition)
+                if hero.current_health < hero.max_health:
+                    hero.current_health = hero.max_health
+                    output.emit("hero_healed")
+                output.emit("separator")
+                if metrics is not None:
+                    metrics.inc("dungeon_fights_total", result="win")
+                    metrics.observe("dungeon_fight_turns", i, metrics.TURN_BUCKETS)
+                return True
+
+            elif hero.current_health <= 0:
+                output.emit("health_bar", entity_type="hero", name=hero.name,
+                            current_hp=0, max_hp=hero.max_health)
+                output.emit("hero_death", death_definition=hero.death_definition)
+                output.emit("separator")
+                if metrics is not None:
+                    metrics.inc("dungeon_fights_total", result="loss")
+                    metrics.observe("dungeon_fight_turns", i, metrics.TURN_BUCKETS)
+                return False
+            i = i + 1
+    except GeneratorExit:
+        if metrics is not None:
+            metrics.inc("dungeon_fights_total", result="cancelled")
+        raise
@@ -0,0 +1,175 @@
+"""
+Журнал ответов игрока и быстрое воспроизведение записанных сессий.
+
+Журнал — файл JSON Lines, в который только дописывают: запись о начале сессии
+с seed ее потока случайных чисел и настройками контроллера и по записи на каждый
+ответ на вопрос ">> ".
+
+    python main.py --journal sessions.jsonl
+    python journal.py sessions.jsonl
+"""
+import json
+import sys
+import time
+import uuid
+from dataclasses import dataclass, field
+
+
+class SessionJournal:
+    """Пишет ответы одной сессии в общий журнал"""
+
+    def __init__(self, stream, session_id=None):
+        self.stream = stream
+        self.session_id = session_id or uuid.uuid4().hex
+
+    @classmethod
+    def open(cls, path, session_id=None):
+        return cls(open(path, "a", encoding="utf-8"), session_id)
+
+    def close(self):
+        self.stream.close()
+
+    def _write(self, record):
+        record["session"] = self.session_id
+        self.stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+        # запись сразу уходит в файл, чтобы журнал пережил падение процесса
+        self.stream.flush()
+
+    def start(self, rng, settings=None):
+        record = {"seed": rng.root_seed, "stream": list(rng.stream)}
+        if settings:
+            record["settings"] = settings
+        self._write(record)
+
+    def record(self, prompt, answer):
+        self._write({"prompt": prompt, "answer": answer})
+
+
+class JournalBuffer:
+    """
+    Поток для SessionJournal, который копит записи в памяти вместо файла.
+    Сервер забирает их через take() и пишет в файл вне цикла событий.
+    """
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def flush(self):
+        # в файл записи уходят пачками через take()
+        pass
+
+    def take(self):
+        text = "".join(self.parts)
+        self.parts.clear()
+        return text
+
+
+def append_text(file, text):
+    """Дописывает text в файл и сбрасывает его на диск; вызывается из пула потоков"""
+    file.write(text)
+    file.flush()
+
+
+@dataclass
+class RecordedSession:
+    session_id: str
+    seed: int
+    stream: tuple
+    answers: list = field(default_factory=list)
+    # аргументы DungeonController из DungeonController.JOURNAL_SETTINGS
+    settings: dict = field(default_factory=dict)
+
+
+@dataclass
+class ReplayResult:
+    session_id: str
+    answers_used: int
+    finished: bool
+    exit_game: bool
+    hero_alive: bool
+    # первый вопрос, на котором игра разошлась с журналом: (номер ответа, ожидалось, получено)
+    divergence: tuple = None
+
+
+def read_journal(lines):
+    """Собирает записи журнала в сессии в порядке их начала"""
+    sessions = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        session_id = record["session"]
+        if "seed" in record:
+            settings = {
+                # JSON превращает пары (ширина, высота) и (меньше, больше) в списки
+                name: tuple(value) if isinstance(value, list) else value
+                for name, value in record.get("settings", {}).items()
+            }
+            sessions[session_id] = RecordedSession(session_id, record["seed"], tuple(record["stream"]),
+                                                   settings=settings)
+        else:
+            sessions[session_id].answers.append((record["prompt"], record["answer"]))
+    return list(sessions.values())
+
+
+def replay_session(generator, session):
+    """Прогоняет записанные ответы через DungeonController без ввода-вывода"""
+    from main import DungeonController, NullOutput, SessionRandom
+
+    controller = DungeonController(generator, NullOutput(), rng=SessionRandom(session.seed, session.stream),
+                                   **session.settings)
+    steps = controller.game_steps()
+    divergence = None
+    used = 0
+    finished = False
+    try:
+        prompt = next(steps)
+        for expected, answer in session.answers:
+            if prompt != expected:
+                divergence = (used, expected, prompt)
+                break
+            used += 1
+            prompt = steps.send(answer)
+    except StopIteration:
+        finished = True
+    hero = controller.hero
+    return ReplayResult(
+        session.session_id, used, finished, controller.exit_game,
+        hero is not None and hero.current_health > 0, divergence,
+    )
+
+
+def replay_journal(generator, lines):
+    return [replay_session(generator, session) for session in read_journal(lines)]
+
+
+def main(argv=None):
+    import argparse
+    from main import DungeonGenerator
+
+    parser = argparse.ArgumentParser(description="Воспроизведение журнала сессий")
+    parser.add_argument("journal")
+    parser.add_argument("--data", default="data/game_data.json")
+    args = parser.parse_args(argv)
+
+    generator = DungeonGenerator(args.data)
+    with open(args.journal, encoding="utf-8") as f:
+        sessions = read_journal(f)
+    started = time.perf_counter()
+    results = [replay_session(generator, session) for session in sessions]
+    elapsed = time.perf_counter() - started
+
+    diverged = [result for result in results if result.divergence]
+    for result in diverged:
+        index, expected, actual = result.divergence
+        print(f"{result.session_id}: ответ №{index + 1} ожидал вопрос {expected}, игра задала {actual}")
+    rate = len(results) / elapsed if elapsed else float("inf")
+    print(f"Сессий: {len(results)}, расхождений: {len(diverged)}, {rate:.0f} сессий/с")
+    return 1 if diverged else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,21 @@
-import json
 import random
 import os
+import sys
+import itertools
+import time
+import struct
+from abc import ABCMeta
+from array import array
+from functools import lru_cache
+from collections import deque, namedtuple
 from random import randint
 
+from alias_table import AliasTable
+from content_cache import WEIGHTED, ContentCache, ContentError, load_json, validate_content
+from fight_odds import FightOdds, solve_fight
+from grid_dungeon import GridDungeon, derive_seed
+from room_cache import RoomCache, RoomSet
+
 
 class HealthBarDrawer:
     """Класс для отрисовки полосок здоровья"""
@@ -10,72 +23,690 @@ class HealthBarDrawer:
     RED = "\033[91m"
     RESET = "\033[0m"
     BAR_LENGTH = 20
+    # полоска зависит только от цвета, заполнения и длины, поэтому готовые строки кешируются
+    CACHE_SIZE = 256
 
     @staticmethod
-    def draw_health_bar(entity_type, name, current_hp, max_hp):
+    def draw_health_bar(entity_type, name, current_hp, max_hp, bar_length=None):
+        width = HealthBarDrawer.BAR_LENGTH if bar_length is None else bar_length
         percentage = current_hp / max_hp
-        filled_length = int(HealthBarDrawer.BAR_LENGTH * percentage)
-        empty_length = HealthBarDrawer.BAR_LENGTH - filled_length
+        filled_length = min(max(int(width * percentage), 0), width)
+        bar = HealthBarDrawer.render_bar(entity_type, filled_length, width)
 
         if entity_type == "hero":
-            part = f"{HealthBarDrawer.GREEN}█" * filled_length
-            full_part = f"{HealthBarDrawer.GREEN}_" * empty_length
-            return (f"Состояние здоровья у вас: \n {name}. {current_hp}/{max_hp} \n"
-                    f"|{part}{full_part}{HealthBarDrawer.RESET}|")
+            return f"Состояние здоровья у вас: \n {name}. {current_hp}/{max_hp} \n{bar}"
         else:
-            part = f"{HealthBarDrawer.RED}█" * filled_length
-            full_part = f"{HealthBarDrawer.RED}_" * empty_length
-            return (f"Состояние здоровья у противника:\n {name}. {current_hp}/{max_hp} \n"
-                    f"|{part}{full_part}{HealthBarDrawer.RESET}|" )
+            return f"Состояние здоровья у противника:\n {name}. {current_hp}/{max_hp} \n{bar}"
+
+    @staticmethod
+    @lru_cache(maxsize=CACHE_SIZE)
+    def render_bar(entity_type, filled_length, width):
+        color = HealthBarDrawer.GREEN if entity_type == "hero" else HealthBarDrawer.RED
+        return f"|{color}{'█' * filled_length}{'_' * (width - filled_length)}{HealthBarDrawer.RESET}|"
 
+MESSAGES = {
+    "separator": "--------------------------------------------------------------------",
+    "exit_game": "Выходим из игры",
+    "dungeon_approach": (
+        "Вы подходите к замшелому подземелью, которое не внушает никакого доверия, "
+        "перед вами стоит выбор: рискнуть или пройти мимо?\n"
+        "1. Войти в подземелье\n"
+        "2. Пройти мимо"
+    ),
+    "hero_menu": lambda heroes: "\n".join(
+        f"{i + 1}. {key}" for i, key in enumerate(heroes)
+    ) + "\nВыберите одного из персонажей:",
+    "hero_selected": "Вы выбрали персонажа \"{name}\", {definition}",
+    "input_not_number": "Ошибка ввода! Введите число.",
+    "hero_out_of_range": "Номер персонажа вне диапазона!",
+    "critical_error": "Критическая ошибка: {error}",
+    "room_start": ("Перед вами: начало подземелья, его ворота уже не открываются изнутри...\n"
+                   "1. Пройти дальше"),
+    "room_empty": "Перед вами: {description}\n1. Пройти дальше\n2. Вернуться назад",
+    "room_enemy_dead": "Вы вошли в комнату и наблюдаете: {death_definition}\n1. Пройти дальше\n2. Вернуться назад",
+    "room_enemy": "Вы зашли в комнату и прямо напротив вас стоит {name}!\n1. Атаковать\n2. Вернуться назад",
+    "room_cleared": "1. Пройти дальше\n2. Вернуться назад",
+    "room_exit": (
+        "Вы успешно зачистили подземелье, выход прямо перед вами, "
+        "но вы все еще можете прогуляться по нему:\n"
+        "1. Выйти из подземелья\n"
+        "2. Вернуться назад"
+    ),
+    "health_bar": HealthBarDrawer.draw_health_bar,
+    "fight_start": "Вы решительно бросаетесь на противника. Завязался бой:",
+    "hero_attack": "Вы наносите удар!",
+    "hero_hit": "Удар пришелся точно в цель! Вы нанесли {damage} урона по цели \"{name}\"",
+    "hero_blocked": "Броня противника не пробита, вы не нанесли урон.",
+    "hero_missed": "{name} смог увернуться от вашего удара!",
+    "enemy_attack": "{name} наносит ответный удар. Берегитесь!",
+    "enemy_hit": "На этот раз вы не смогли увернуться, \"{name}\" нанес вам {damage} урона",
+    "enemy_blocked": "\"{name}\" не смог пробить вашу броню!",
+    "enemy_missed": "Удар был внезапным, но вы смогли увернуться! ",
+    "victory": "Вы одержали победу над {name}! {death_definition}",
+    "hero_healed": "Запасы вашего здоровья восстановлены!",
+    "hero_death": "{death_definition}",
+    "group_enemy_down": "{name} падает замертво. Врагов осталось: {alive}",
+    "group_attack": "Врагов: {alive}, и все они бросаются на вас разом!",
+    "group_hit": "Вас задели {hits} раз, получено {damage} урона",
+    "group_blocked": "Вас задели {hits} раз, но броня выдержала все удары",
+    "group_missed": "Вы уклонились от всех ударов!",
+    "fight_stalled": "Бой с \"{name}\" затянулся, и вы отступаете.",
+    "room_directions": lambda directions, distance: "\n".join(
+        [f"До выхода {distance} комнат. Куда пойдете?"]
+        + [f"{i + 1}. {DIRECTION_NAMES[name]}" for i, name in enumerate(directions)]
+    ),
+}
 
-class Entity:
-    def __init__(self, name, definition, health):
+DIRECTION_NAMES = {
+    "north": "На север",
+    "south": "На юг",
+    "west": "На запад",
+    "east": "На восток",
+}
+
+
+def render_message(message_id, params):
+    template = MESSAGES[message_id]
+    if callable(template):
+        return template(**params)
+    return template.format(**params)
+
+
+class ConsoleOutput:
+    """Вывод сообщений игры в консоль, каждое сообщение сразу через print"""
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+
+    def emit(self, message_id, **params):
+        text = render_message(message_id, params)
+        print(text)
+        if self.metrics is not None:
+            self.metrics.inc("dungeon_output_bytes_total", len(text.encode("utf-8")) + 1)
+
+    def flush(self):
+        pass
+
+
+class NullOutput:
+    """Вывод для симуляций: сообщения не форматируются и никуда не пишутся"""
+
+    def emit(self, message_id, **params):
+        pass
+
+    def flush(self):
+        pass
+
+
+class BufferedOutput:
+    """Копит сообщения и пишет их в поток одним вызовом перед очередным вопросом игроку"""
+
+    def __init__(self, stream=None, metrics=None):
+        self.stream = stream
+        self.metrics = metrics
+        self._parts = []
+
+    def emit(self, message_id, **params):
+        self._parts.append(render_message(message_id, params))
+        self._parts.append("\n")
+
+    def flush(self):
+        if not self._parts:
+            return
+        stream = self.stream if self.stream is not None else sys.stdout
+        text = "".join(self._parts)
+        stream.write(text)
+        stream.flush()
+        if self.metrics is not None:
+            self.metrics.inc("dungeon_output_bytes_total", len(text.encode("utf-8")))
+        self._parts.clear()
+
+
+class StructuredOutput:
+    """Сохраняет идентификаторы сообщений с параметрами вместо готового текста"""
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.events = []
+
+    def emit(self, message_id, **params):
+        if self.callback is not None:
+            self.callback(message_id, params)
+        else:
+            self.events.append((message_id, params))
+
+    def flush(self):
+        pass
+
+
+class GameObject:
+    __slots__ = ("name", "definition")
+
+    def __init__(self, name, definition):
         self.name = name
         self.definition = definition
+
+
+class Entity(GameObject, metaclass=ABCMeta):
+    """
+    Герой или враг. Боевые параметры бой читает через damage, hit_probability
+    и defense: у сущностей из EntityPool они лежат в колонках пула.
+    """
+    __slots__ = ("max_health", "current_health", "weapon", "armor")
+
+    def __init__(self, name, definition, health):
+        super().__init__(name, definition)
         self.max_health = health
         self.current_health = health
         self.weapon = None
         self.armor = None
 
+    @property
+    def damage(self):
+        return self.weapon.damage
+
+    @property
+    def hit_probability(self):
+        return self.weapon.success_probability
+
+    @property
+    def defense(self):
+        return self.armor.defense
+
+
+class Item(GameObject):
+    """
+    Снаряжение: здоровья и своего снаряжения у него нет.
+    key — ключ записи в данных; снимок хранит его, а не сам объект, поэтому
+    сущности, выданные до перезагрузки данных, сохраняются и после нее.
+    """
+    __slots__ = ("frozen", "key")
+    max_health = 0
+    current_health = 0
+    weapon = None
+    armor = None
+
+    def __setattr__(self, name, value):
+        if getattr(self, "frozen", False):
+            raise AttributeError(f"Предмет \"{self.name}\" из каталога нельзя изменить")
+        super().__setattr__(name, value)
 
-class Weapon(Entity):
-    def __init__(self, name, definition, damage, success_probability):
-        super().__init__(name, definition, health=0)
+    def freeze(self):
+        self.frozen = True
+        return self
+
+
+class Weapon(Item):
+    __slots__ = ("damage", "success_probability")
+
+    def __init__(self, name, definition, damage, success_probability, key=None):
+        super().__init__(name, definition)
         self.damage = damage
         self.success_probability = success_probability
+        self.key = key
+
 
+class Armor(Item):
+    __slots__ = ("defense",)
 
-class Armor(Entity):
-    def __init__(self, name, definition, defense):
-        super().__init__(name, definition, health=0)
+    def __init__(self, name, definition, defense, key=None):
+        super().__init__(name, definition)
         self.defense = defense
+        self.key = key
 
 
 class Hero(Entity):
-    def __init__(self, name, definition, health, death_definition):
+    __slots__ = ("death_definition", "key")
+
+    def __init__(self, name, definition, health, death_definition, key=None):
         super().__init__(name, definition, health)
         self.death_definition = death_definition
+        # ключ записи в game_data.json, по нему сущность восстанавливается из снимка
+        self.key = key
 
 
 class Enemy(Entity):
-    def __init__(self, name, definition, health, death_definition):
+    __slots__ = ("death_definition", "key")
+
+    def __init__(self, name, definition, health, death_definition, key=None):
         super().__init__(name, definition, health)
         self.death_definition = death_definition
+        # ключ записи в game_data.json, по нему сущность восстанавливается из снимка
+        self.key = key
+
+
+class EntityPool:
+    """
+    Хранилище живых героев и врагов в колонках: здоровье и боевые параметры
+    снаряжения — в типизированных массивах, имя, описания и ключ — одним общим
+    кортежем на вид сущности, снаряжение — в списках. Объекты, которые выдает пул, —
+    представления (пул, индекс) над строкой; для isinstance они те же Hero и Enemy.
+    Снаряжение считается неизменяемым: его параметры копируются в колонки при выдаче.
+    """
+
+    def __init__(self):
+        self.max_health = array("q")
+        self.current_health = array("q")
+        self.damage = array("q")
+        self.defense = array("q")
+        self.hit_probability = array("d")
+        # (имя, описание, описание смерти, ключ); одинаковые кортежи хранятся один раз
+        self.templates = []
+        self.weapons = []
+        self.armors = []
+        self._template_ids = {}
+        self._free = []
+
+    def __len__(self):
+        return len(self.templates) - len(self._free)
+
+    def template(self, name, definition, death_definition, key):
+        template = (name, definition, death_definition, key)
+        return self._template_ids.setdefault(template, template)
+
+    def add(self, name, definition, health, death_definition, weapon=None, armor=None, key=None):
+        template = self.template(name, definition, death_definition, key)
+        if self._free:
+            index = self._free.pop()
+            self.max_health[index] = health
+            self.current_health[index] = health
+            self.templates[index] = template
+        else:
+            index = len(self.templates)
+            self.max_health.append(health)
+            self.current_health.append(health)
+            self.damage.append(0)
+            self.defense.append(0)
+            self.hit_probability.append(0.0)
+            self.templates.append(template)
+            self.weapons.append(None)
+            self.armors.append(None)
+        self.equip(index, weapon, armor)
+        return index
+
+    def equip(self, index, weapon=None, armor=None):
+        if weapon is not None:
+            self.weapons[index] = weapon
+            self.damage[index] = weapon.damage
+            self.hit_probability[index] = weapon.success_probability
+        if armor is not None:
+            self.armors[index] = armor
+            self.defense[index] = armor.defense
+
+    def release(self, index):
+        self.templates[index] = self.weapons[index] = self.armors[index] = None
+        self._free.append(index)
+
+    def hero(self, index):
+        return PooledHero(self, index)
+
+    def enemy(self, index):
+        return PooledEnemy(self, index)
+
+
+def _pool_column(column):
+    def get(self):
+        return getattr(self.pool, column)[self.index]
+
+    def set(self, value):
+        getattr(self.pool, column)[self.index] = value
+
+    return property(get, set)
+
+
+def _template_field(position):
+    def get(self):
+        return self.pool.templates[self.index][position]
+
+    def set(self, value):
+        fields = list(self.pool.templates[self.index])
+        fields[position] = value
+        self.pool.templates[self.index] = self.pool.template(*fields)
+
+    return property(get, set)
+
+
+class PooledEntity:
+    """Представление сущности из EntityPool: хранит только (пул, индекс)"""
+    __slots__ = ("pool", "index")
+
+    name = _template_field(0)
+    definition = _template_field(1)
+    death_definition = _template_field(2)
+    key = _template_field(3)
+    max_health = _pool_column("max_health")
+    current_health = _pool_column("current_health")
+    damage = property(lambda self: self.pool.damage[self.index])
+    hit_probability = property(lambda self: self.pool.hit_probability[self.index])
+    defense = property(lambda self: self.pool.defense[self.index])
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+
+    @property
+    def weapon(self):
+        return self.pool.weapons[self.index]
+
+    @weapon.setter
+    def weapon(self, weapon):
+        self.pool.equip(self.index, weapon=weapon)
+
+    @property
+    def armor(self):
+        return self.pool.armors[self.index]
+
+    @armor.setter
+    def armor(self, armor):
+        self.pool.equip(self.index, armor=armor)
+
+
+# представления не наследуют Hero и Enemy, чтобы не носить их пустые слоты,
+# а регистрируются как их виртуальные подклассы
+@Hero.register
+class PooledHero(PooledEntity):
+    __slots__ = ()
+
+
+@Enemy.register
+class PooledEnemy(PooledEntity):
+    __slots__ = ()
+
+
+# сколько комнат от входа занимает один диапазон глубин для весов из данных
+DEPTH_BRACKET = 3
+
+
+class ContentCatalog:
+    """
+    Игровые данные, скомпилированные в таблицы с целочисленными ID.
+    Оружие и броня создаются один раз и раздаются всем как общие неизменяемые объекты.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.hero_keys = tuple(data["heroes"])
+        self.enemy_keys = tuple(data["enemies"])
+        self.hero_ids = {key: i for i, key in enumerate(self.hero_keys)}
+        self.enemy_ids = {key: i for i, key in enumerate(self.enemy_keys)}
+        self.heroes = tuple(self._creature(data["heroes"][key]) for key in self.hero_keys)
+        self.enemies = tuple(self._creature(data["enemies"][key]) for key in self.enemy_keys)
+        self.weapon_keys = tuple(data["weapons"])
+        self.armor_keys = tuple(data["armor"])
+        self.weapons = tuple(
+            Weapon(w["name"], w["definition"], w["damage"], w["success_probability"], key).freeze()
+            for key, w in data["weapons"].items()
+        )
+        self.armor = tuple(
+            Armor(a["name"], a["definition"], a["defense"], key).freeze()
+            for key, a in data["armor"].items()
+        )
+        self.room_definitions = tuple(data["room_definitions"])
+        self.weapon_ids = {key: i for i, key in enumerate(self.weapon_keys)}
+        self.armor_ids = {key: i for i, key in enumerate(self.armor_keys)}
+        # поля weight по разделам и таблицы псевдонимов по (раздел, диапазон глубин),
+        # собираются при первом выборе
+        self.weight_specs = {}
+        self.alias_tables = {}
+
+    @staticmethod
+    def _creature(record):
+        return record["name"], record["definition"], record["health"], record["death_definition"]
+
+    @property
+    def hero_list(self):
+        return self.hero_keys
+
+    @property
+    def enemy_list(self):
+        return self.enemy_keys
+
+    def _weight_specs(self, section):
+        """Поле weight каждой записи раздела по порядку ID"""
+        return [record.get("weight", 1) for record in self.data[section].values()]
+
+    def _bracket(self, section, depth):
+        """Поля weight раздела и номер диапазона глубин, дальше которого веса не меняются"""
+        cached = self.weight_specs.get(section)
+        if cached is None:
+            specs = self._weight_specs(section)
+            brackets = max((len(spec) for spec in specs if isinstance(spec, list)), default=1)
+            cached = self.weight_specs[section] = (specs, brackets)
+        specs, brackets = cached
+        return specs, min(depth // DEPTH_BRACKET, brackets - 1)
+
+    def weights(self, section, depth=0):
+        """Веса записей раздела на глубине depth, по порядку ID"""
+        specs, bracket = self._bracket(section, depth)
+        return [spec[min(bracket, len(spec) - 1)] if isinstance(spec, list) else spec for spec in specs]
+
+    def alias_table(self, section, depth=0):
+        """Таблица псевдонимов раздела; строится один раз на версию данных и диапазон глубин"""
+        _, bracket = self._bracket(section, depth)
+        table = self.alias_tables.get((section, bracket))
+        if table is None:
+            table = self.alias_tables[section, bracket] = AliasTable(self.weights(section, depth))
+        return table
+
+    def build_alias_tables(self):
+        """Строит заранее таблицы всех разделов с весами и всех их диапазонов глубин"""
+        for section in WEIGHTED:
+            self._bracket(section, 0)
+            _, brackets = self.weight_specs[section]
+            for bracket in range(brackets):
+                self.alias_table(section, bracket * DEPTH_BRACKET)
+        return self
+
+    # случайный выбор идет через каталог по весам из данных; без весов он равновероятный
+    def random_enemy_id(self, rng, depth=0):
+        return self.alias_table("enemies", depth).sample(rng)
+
+    def random_weapon(self, rng, depth=0):
+        return self.weapons[self.alias_table("weapons", depth).sample(rng)]
+
+    def random_armor(self, rng, depth=0):
+        return self.armor[self.alias_table("armor", depth).sample(rng)]
+
+    def random_room_id(self, rng):
+        return rng.randrange(len(self.room_definitions))
+
+    def random_room(self, rng):
+        return self.room_definitions[self.random_room_id(rng)]
+
+
+class ContentStore:
+    """
+    Текущая версия игровых данных, общая для генератора и всех его копий.
+    Данные и каталог подменяются одним присваиванием, поэтому читатель никогда
+    не увидит каталог от одной версии и данные от другой.
+    """
+
+    def __init__(self, data, source_stat=None, catalog=None):
+        self._current = (data, catalog)
+        self.version = 1
+        # (mtime, размер) файла, из которого загружена текущая версия
+        self.source_stat = source_stat
+        self.reloads = 0
+        self.failed_reloads = 0
+        self.last_reload_seconds = 0.0
+        self.last_error = None
+
+    @property
+    def data(self):
+        return self._current[0]
+
+    @property
+    def catalog(self):
+        current = self._current
+        data, catalog = current
+        if catalog is None:
+            catalog = ContentCatalog(data)
+            # если за это время данные подменили, собранный каталог уже не нужен
+            if self._current is current:
+                self._current = (data, catalog)
+        return catalog
+
+    def swap(self, data, catalog=None, source_stat=None):
+        self._current = (data, catalog)
+        self.source_stat = source_stat
+        self.version += 1
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "reloads": self.reloads,
+            "failed_reloads": self.failed_reloads,
+            "last_reload_seconds": self.last_reload_seconds,
+        }
+
+
+class SessionRandom(random.Random):
+    """
+    Воспроизводимый поток случайных чисел одной сессии.
+
+    Поток задается корневым seed и путем подпотока. Подпотоки получают свой seed
+    хешированием (seed, путь), поэтому параллельные воркеры с разными путями
+    берут независимые последовательности и не зависят от порядка выполнения.
+    """
+    # броски попадания берутся блоками, а не отдельным randint на каждый удар
+    HIT_BLOCK = 256
+
+    def __init__(self, seed=None, stream=()):
+        self.root_seed = random.getrandbits(64) if seed is None else seed
+        self.stream = tuple(stream)
+        self._hits = []
+        super().__init__(self._derive(self.root_seed, self.stream))
+
+    @staticmethod
+    def _derive(seed, stream):
+        import hashlib
+
+        digest = hashlib.blake2b(repr((seed, stream)).encode("utf-8"), digest_size=32).digest()
+        return int.from_bytes(digest, "little")
+
+    def substream(self, *path):
+        return SessionRandom(self.root_seed, self.stream + path)
+
+    def hit_roll(self):
+        """Эквивалент randint(0, 100) для броска попадания"""
+        if not self._hits:
+            self._hits = self.choices(range(101), k=self.HIT_BLOCK)
+        return self._hits.pop()
+
+
+def hit_roller(rng):
+    """Бросок попадания randint(0, 100) из rng: SessionRandom, любого random.Random или модуля random"""
+    if rng is None:
+        return lambda: randint(0, 100)
+    roll = getattr(rng, "hit_roll", None)
+    return roll if roll is not None else lambda: rng.randint(0, 100)
+
+
+class _BackgroundLoad:
+    """Загрузка данных генератора в фоновом потоке; result() ждет ее и отдает ContentStore"""
+
+    def __init__(self, generator, source_stat):
+        import threading
+
+        self.generator = generator
+        self.source_stat = source_stat
+        self.content = None
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="content-load", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            content = ContentStore(self.generator._load_json_data(), self.source_stat)
+            # таблицы каталога тоже строятся здесь, а не на первом ходу игрока
+            content.catalog.build_alias_tables()
+            self.content = content
+        except BaseException as e:
+            self.error = e
+
+    def result(self):
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.content
 
 
 class DungeonGenerator:
-    def __init__(self, json_file="game_data.json"):
+    # по умолчанию используется общий генератор модуля random
+    rng = random
+    # Metrics для счетчиков создания сущностей, None — не считать
+    metrics = None
+
+    # ключи героев из заголовка кеша, пока данные грузятся в фоне
+    hero_keys = None
+
+    def __init__(self, json_file="game_data.json", rng=None, cache=True, cache_dir=None, background=False):
         self.json_file = json_file
-        self.data = self._load_json_data()
+        if rng is not None:
+            self.rng = rng
+        # cache=False — всегда разбирать JSON, cache_dir — хранить кеш не рядом с данными
+        self.content_cache = ContentCache(json_file, cache_dir) if cache else None
+        source_stat = self._source_stat()
+        # background=True — меню героев показывается по заголовку кеша, а остальные
+        # данные дочитываются в фоне; при первом обращении к content загрузка дожидается
+        if background and self.content_cache is not None:
+            self.hero_keys = self.content_cache.read_heroes()
+        if self.hero_keys is not None:
+            self._loader = _BackgroundLoad(self, source_stat)
+        else:
+            self.content = ContentStore(self._load_json_data(), source_stat)
+
+    def __getattr__(self, name):
+        # вызывается, только если обычный поиск атрибута не нашел его
+        if name == "content" and "_loader" in self.__dict__:
+            self.content = self.__dict__.pop("_loader").result()
+            return self.content
+        raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+
+    @classmethod
+    def from_data(cls, data, rng=None):
+        """Генератор над уже загруженным словарем в формате game_data.json"""
+        generator = cls.__new__(cls)
+        generator.json_file = None
+        generator.content_cache = None
+        if rng is not None:
+            generator.rng = rng
+        generator.content = ContentStore(validate_content(data))
+        return generator
+
+    @classmethod
+    def from_packs(cls, paths, rng=None):
+        """
+        Генератор поверх стопки индексированных пакетов (см. content_pack.py).
+        Пакеты — собранные заранее файлы, поэтому reload() для них не применяется.
+        """
+        from content_pack import ContentPack, PackCatalog
+
+        generator = cls.__new__(cls)
+        generator.json_file = None
+        generator.content_cache = None
+        if rng is not None:
+            generator.rng = rng
+        catalog = PackCatalog([ContentPack(path) for path in paths])
+        generator.content = ContentStore(catalog.data, catalog=catalog)
+        return generator
+
+    def with_rng(self, rng):
+        """Копия генератора с общими данными и собственным потоком случайных чисел"""
+        # копия ссылается на тот же ContentStore и видит все перезагрузки данных
+        import copy
+
+        session = copy.copy(self)
+        session.rng = rng
+        return session
 
     @staticmethod
-    def create_dungeon_rooms():
-        length = randint(7, 10)
+    def create_dungeon_rooms(rng=random):
+        length = rng.randint(7, 10)
         map_template = ['St'] + [''] * (length - 2) + ['Ex']
 
-        enemy_count = randint(2, 4)
-        enemy_positions = random.sample(range(1, length - 1), min(enemy_count, length - 2))
+        enemy_count = rng.randint(2, 4)
+        enemy_positions = rng.sample(range(1, length - 1), min(enemy_count, length - 2))
 
         for pos in enemy_positions:
             map_template[pos] = 'E'
@@ -85,179 +716,680 @@ class DungeonGenerator:
     def _load_json_data(self):
         if not os.path.exists(self.json_file):
             raise FileNotFoundError(f"Файл {self.json_file} не найден!")
-        with open(self.json_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        if self.content_cache is None:
+            return load_json(self.json_file)
+        return self.content_cache.load()
+
+    @property
+    def data(self):
+        return self.content.data
+
+    @data.setter
+    def data(self, data):
+        if "content" in self.__dict__:
+            self.content.swap(data)
+        else:
+            self.content = ContentStore(data)
+
+    @property
+    def catalog(self):
+        # таблицы собираются один раз на версию данных
+        return self.content.catalog
+
+    def _source_stat(self):
+        if self.json_file is None:
+            return None
+        try:
+            stat = os.stat(self.json_file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload(self):
+        """
+        Загружает и проверяет данные заново, затем подменяет текущую версию.
+        Уже созданные враги и предметы остаются прежними, новые берутся из новой версии.
+        При ошибке в данных остается старая версия, а ошибка сохраняется в content.last_error.
+        """
+        content = self.content
+        if self.json_file is None:
+            return False
+        started = time.perf_counter()
+        source_stat = self._source_stat()
+        try:
+            data = self._load_json_data()
+            # каталог и его таблицы выбора собираются здесь, а не при первом обращении из игры
+            catalog = ContentCatalog(data).build_alias_tables()
+        except (OSError, ValueError) as error:
+            content.failed_reloads += 1
+            content.last_error = error
+            content.source_stat = source_stat
+            return False
+        content.swap(data, catalog, source_stat)
+        content.reloads += 1
+        content.last_error = None
+        content.last_reload_seconds = time.perf_counter() - started
+        return True
+
+    def reload_if_changed(self):
+        """Перезагружает данные, если файл изменился с прошлой загрузки"""
+        if self._source_stat() == self.content.source_stat:
+            return False
+        return self.reload()
 
     def _get_random_weapon(self):
-        weapon_data = random.choice(list(self.data["weapons"].values()))
-        return Weapon(
-            weapon_data["name"],
-            weapon_data["definition"],
-            weapon_data["damage"],
-            weapon_data["success_probability"]
-        )
+        return self.catalog.random_weapon(self.rng)
 
     def _get_random_armor(self):
-        armor_data = random.choice(list(self.data["armor"].values()))
-        return Armor(
-            armor_data["name"],
-            armor_data["definition"],
-            armor_data["defense"]
-        )
+        return self.catalog.random_armor(self.rng)
 
     def get_room_definitions(self):
         return self.data["room_definitions"]
 
-    def create_enemy(self, enemy_key):
-        enemy_data = self.data["enemies"][enemy_key]
-        enemy = Enemy(
-            enemy_data["name"],
-            enemy_data["definition"],
-            enemy_data["health"],
-            enemy_data["death_definition"]
-        )
-        enemy.weapon = self._get_random_weapon()
-        enemy.armor = self._get_random_armor()
+    def create_enemy(self, enemy_key, pool=None):
+        catalog = self.catalog
+        return self.create_enemy_by_id(catalog.enemy_ids[enemy_key], pool)
+
+    def create_enemy_by_id(self, enemy_id, pool=None, rng=None, depth=0):
+        catalog = self.catalog
+        rng = rng or self.rng
+        weapon = catalog.random_weapon(rng, depth)
+        armor = catalog.random_armor(rng, depth)
+        return self.spawn_enemy(catalog.enemy_keys[enemy_id], weapon, armor, pool)
+
+    def create_enemy_group(self, size, rng=None, depth=0):
+        """
+        Отряд из size врагов с теми же весами выбора, что в create_enemy_by_id.
+        Враг, оружие и броня всех членов выбираются разом массивами numpy из
+        потока rng, а одинаковые сочетания складываются в стопки.
+        """
+        import numpy as np
+        from group_fight import EnemyGroup
+
+        catalog = self.catalog
+        generator = np.random.default_rng((rng or self.rng).getrandbits(64))
+        members = np.stack([
+            catalog.alias_table(section, depth).sample_many(generator, size)
+            for section in ("enemies", "weapons", "armor")
+        ], axis=1)
+        combinations, counts = np.unique(members, axis=0, return_counts=True)
+        stacks = [
+            (self.spawn_enemy(catalog.enemy_keys[enemy_id], catalog.weapons[weapon], catalog.armor[armor]), count)
+            for (enemy_id, weapon, armor), count in zip(combinations.tolist(), counts.tolist())
+        ]
+        if self.metrics is not None:
+            # spawn_enemy посчитал по одному образцу на стопку
+            self.metrics.inc("dungeon_spawns_total", size - len(stacks), kind="enemy")
+        return EnemyGroup(stacks)
+
+    def create_player(self, hero_key, pool=None):
+        weapon = self._get_random_weapon()
+        armor = self._get_random_armor()
+        return self.spawn_player(hero_key, weapon, armor, pool)
+
+    def spawn_enemy(self, enemy_key, weapon, armor, pool=None):
+        catalog = self.catalog
+        name, definition, health, death_definition = catalog.enemies[catalog.enemy_ids[enemy_key]]
+        if self.metrics is not None:
+            self.metrics.inc("dungeon_spawns_total", kind="enemy")
+        if pool is not None:
+            return pool.enemy(pool.add(name, definition, health, death_definition, weapon, armor, enemy_key))
+        enemy = Enemy(name, definition, health, death_definition, enemy_key)
+        enemy.weapon = weapon
+        enemy.armor = armor
         return enemy
 
-    def create_player(self, hero_key):
-        hero_data = self.data["heroes"][hero_key]
-        hero = Hero(
-            hero_data["name"],
-            hero_data["definition"],
-            hero_data["health"],
-            hero_data["death_definition"]
-        )
-        hero.weapon = self._get_random_weapon()
-        hero.armor = self._get_random_armor()
+    def spawn_player(self, hero_key, weapon, armor, pool=None):
+        catalog = self.catalog
+        name, definition, health, death_definition = catalog.heroes[catalog.hero_ids[hero_key]]
+        if self.metrics is not None:
+            self.metrics.inc("dungeon_spawns_total", kind="hero")
+        if pool is not None:
+            return pool.hero(pool.add(name, definition, health, death_definition, weapon, armor, hero_key))
+        hero = Hero(name, definition, health, death_definition, hero_key)
+        hero.weapon = weapon
+        hero.armor = armor
         return hero
 
+    def create_grid_dungeon(self, width, height, enemy_density=0.3):
+        return GridDungeon(width, height, self.rng.getrandbits(64), enemy_density)
+
+    def random_enemy_id(self, rng=None, depth=0):
+        return self.catalog.random_enemy_id(rng or self.rng, depth)
+
+    def random_room_definition(self, rng=None):
+        return self.catalog.random_room(rng or self.rng)
+
+    # общие неизменяемые последовательности, без копии на каждый вызов
     def get_enemies(self):
-        return list(self.data["enemies"].keys())
+        return self.catalog.enemy_list
 
     def get_heroes(self):
-        return list(self.data["heroes"].keys())
+        if self.hero_keys is not None and "content" not in self.__dict__:
+            return list(self.hero_keys)
+        return self.catalog.hero_list
+
+    def fight_odds(self, hero_key, enemy_key, hero_weapon=None, hero_armor=None,
+                   enemy_weapon=None, enemy_armor=None, depth=0):
+        """
+        Точные шансы героя против врага без симуляции.
+        Не указанное снаряжение усредняется с весами случайной выдачи:
+        у героя — как при старте, у врага — как на глубине depth.
+        Ничьи идут в stalemate_probability и не входят в среднее число ходов.
+        """
+        catalog = self.catalog
+        weapons = self.data["weapons"]
+        armor = self.data["armor"]
+
+        def slot(key, section, depth):
+            if key:
+                return [(key, 1)]
+            keys = catalog.weapon_keys if section == "weapons" else catalog.armor_keys
+            # у перекрытых записей пакета вес нулевой, и в словаре остается последняя запись с ключом
+            return list(dict(zip(keys, catalog.weights(section, depth))).items())
+
+        hero = self.data["heroes"][hero_key]
+        enemy = self.data["enemies"][enemy_key]
+        slots = [
+            slot(hero_weapon, "weapons", 0),
+            slot(hero_armor, "armor", 0),
+            slot(enemy_weapon, "weapons", depth),
+            slot(enemy_armor, "armor", depth),
+        ]
+
+        total = win = turns = hp = stalled = 0.0
+        for (hw, w1), (ha, w2), (ew, w3), (ea, w4) in itertools.product(*slots):
+            weight = w1 * w2 * w3 * w4
+            if not weight:
+                continue
+            odds = solve_fight(
+                hero["health"], weapons[hw]["damage"], weapons[hw]["success_probability"], armor[ha]["defense"],
+                enemy["health"], weapons[ew]["damage"], weapons[ew]["success_probability"], armor[ea]["defense"],
+            )
+            total += weight
+            if odds.stalemate_probability:
+                stalled += weight
+                continue
+            win += weight * odds.win_probability
+            turns += weight * odds.expected_turns
+            hp += weight * odds.expected_hp_left * odds.win_probability
+        decided = total - stalled
+        return FightOdds(win / total, turns / decided if decided else float("inf"), hp / win if win else 0.0,
+                         stalled / total)
+
+
+class SessionSnapshot:
+    """
+    Компактный двоичный снимок состояния сессии DungeonController.
+    Герои, враги и предметы хранятся ключами каталога, описания комнат —
+    индексами в room_definitions, запомненными при создании комнаты, поэтому
+    текст в снимок не попадает.
+    """
+    MAGIC = b"DGSS"
+    VERSION = 3
+    ROOM_CODES = {"St": 0, "": 1, "E": 2, "Ex": 3}
+    ROOM_TYPES = ("St", "", "E", "Ex")
+    NONE = 0xFFFF
+    # номер описания комнаты: в пакетах их бывает больше 65535
+    NO_DESCRIPTION = 0xFFFFFFFF
+
+    _header = struct.Struct("<4sBBiHQ")
+    _entity = struct.Struct("<HHHi")
+    _length = struct.Struct("<H")
+    _count = struct.Struct("<I")
+    EXIT_GAME = 1
+    HAS_ROOM_SEED = 2
+
+    @classmethod
+    def dump(cls, controller):
+        catalog = controller.generator.catalog
+        strings = {}
+
+        def ref(key):
+            return strings.setdefault(key, len(strings))
+
+        def item_key(item):
+            if item.key is None:
+                raise ValueError(f"Предмет \"{item.name}\" не из данных игры, его нельзя сохранить в снимок")
+            return item.key
+
+        def entity(record):
+            # отряд не сохраняется: комната заново соберет его из своего seed
+            if record is None or record.key is None:
+                return cls._entity.pack(cls.NONE, cls.NONE, cls.NONE, 0)
+            return cls._entity.pack(
+                ref(record.key),
+                ref(item_key(record.weapon)),
+                ref(item_key(record.armor)),
+                record.current_health,
+            )
+
+        if isinstance(controller.dungeon_map, GridDungeon):
+            raise ValueError("Снимки подземелий-решеток не поддерживаются")
+        dungeon_map = controller.dungeon_map or []
+        body = [entity(controller.hero)]
+        if dungeon_map:
+            body.append(bytes(cls.ROOM_CODES[room] for room in dungeon_map))
+            # комната без запомненного номера описания создаст его заново при посещении
+            description_ids = controller.room_description_ids
+            body.append(struct.pack(f"<{len(dungeon_map)}I", *(
+                cls.NO_DESCRIPTION if index is None else index
+                for index in (description_ids[i] for i in range(len(dungeon_map)))
+            )))
+            enemies = [(i, controller.enemies_in_rooms[i]) for i, room in enumerate(dungeon_map) if room == "E"]
+            body.extend(entity(enemy) for _, enemy in enemies)
+            defeated = set(controller.defeated_rooms)
+            defeated.update(i for i, enemy in enemies
+                            if enemy is not None and enemy.key is None and enemy.current_health <= 0)
+            defeated = sorted(defeated)
+            body.append(cls._count.pack(len(defeated)))
+            body.append(struct.pack(f"<{len(defeated)}I", *defeated))
+
+        table = [cls._length.pack(len(strings))]
+        for key in strings:
+            encoded = key.encode("utf-8")
+            table.append(cls._length.pack(len(encoded)))
+            table.append(encoded)
+
+        position = -1 if controller.position is None else controller.position
+        flags = cls.EXIT_GAME if controller.exit_game else 0
+        if controller.room_seed is not None:
+            flags |= cls.HAS_ROOM_SEED
+        header = cls._header.pack(cls.MAGIC, cls.VERSION, flags, position, len(dungeon_map),
+                                  controller.room_seed or 0)
+        return b"".join([header] + table + body)
+
+    @classmethod
+    def load(cls, controller, data):
+        magic, version, flags, position, length, room_seed = cls._header.unpack_from(data, 0)
+        if magic != cls.MAGIC:
+            raise ValueError("Это не снимок сессии подземелья")
+        if version != cls.VERSION:
+            raise ValueError(f"Неподдерживаемая версия снимка: {version}")
+        offset = cls._header.size
+
+        (count,) = cls._length.unpack_from(data, offset)
+        offset += cls._length.size
+        strings = []
+        for _ in range(count):
+            (size,) = cls._length.unpack_from(data, offset)
+            offset += cls._length.size
+            strings.append(data[offset:offset + size].decode("utf-8"))
+            offset += size
+
+        generator = controller.generator
+        catalog = generator.catalog
+
+        def entity(spawn):
+            nonlocal offset
+            key, weapon, armor, health = cls._entity.unpack_from(data, offset)
+            offset += cls._entity.size
+            if key == cls.NONE:
+                return None
+            record = spawn(strings[key],
+                           catalog.weapons[catalog.weapon_ids[strings[weapon]]],
+                           catalog.armor[catalog.armor_ids[strings[armor]]],
+                           controller.pool)
+            record.current_health = health
+            return record
+
+        controller._release_enemies()
+        controller._release_hero()
+        controller.hero = entity(generator.spawn_player)
+        controller.exit_game = bool(flags & cls.EXIT_GAME)
+        controller.position = None if position < 0 else position
+        if not length:
+            controller.dungeon_map = controller.room_descriptions = controller.enemies_in_rooms = None
+            return controller
+
+        controller.dungeon_map = [cls.ROOM_TYPES[code] for code in data[offset:offset + length]]
+        offset += length
+        descriptions = struct.unpack_from(f"<{length}I", data, offset)
+        offset += 4 * length
+        controller._reset_rooms(room_seed if flags & cls.HAS_ROOM_SEED else None)
+        for i, index in enumerate(descriptions):
+            # после перезагрузки данных описания с таким номером может уже не быть
+            if index != cls.NO_DESCRIPTION and index < len(catalog.room_definitions):
+                controller.room_descriptions[i] = catalog.room_definitions[index]
+                controller.room_description_ids[i] = index
+        for i, room in enumerate(controller.dungeon_map):
+            if room == "E":
+                enemy = entity(generator.spawn_enemy)
+                if enemy is not None:
+                    controller.enemies_in_rooms[i] = enemy
+        (count,) = cls._count.unpack_from(data, offset)
+        offset += cls._count.size
+        controller.defeated_rooms = RoomSet(struct.unpack_from(f"<{count}I", data, offset))
+        return controller
+
+
+# что отдают шаги игры на перерыве в бою при fight_pause; отвечать на это не нужно
+FIGHT_TURN = "fight_turn"
+# один удар в бою: кто бил, итог (hit, miss или blocked), урон и здоровье обоих после удара
+TurnEvent = namedtuple("TurnEvent", ["turn", "attacker", "outcome", "damage", "hero_hp", "enemy_hp"])
 
 
 class DungeonController:
-    def __init__(self, generator):
-        self.generator = generator
+    TRAIL_LENGTH = 1000
+    # настройки, от которых зависит ход игры: журнал записывает их, чтобы повтор шел так же
+    JOURNAL_SETTINGS = ("grid_size", "room_budget", "max_fight_turns", "group_size")
+
+    def __init__(self, generator, output=None, pool=None, rng=None, journal=None, grid_size=None,
+                 room_budget=None, metrics=None, max_fight_turns=None, fight_pause=None, group_size=None):
+        if journal is not None and rng is None:
+            # записанную сессию можно повторить только с известным seed
+            rng = SessionRandom()
+        if journal is not None and not isinstance(rng, SessionRandom):
+            raise TypeError("Для записи в журнал нужен SessionRandom: журнал хранит его seed и подпоток")
+        self.journal = journal
+        # со своим потоком случайных чисел сессия работает через копию генератора
+        self.rng = rng
+        self.generator = generator.with_rng(rng) if rng is not None else generator
+        # Metrics для счетчиков и задержек игры, None — не считать
+        self.metrics = metrics
+        self.output = output if output is not None else ConsoleOutput(metrics)
+        # при общем EntityPool враги сессии хранятся в его колонках
+        self.pool = pool
         self.dungeon_map = None
         self.room_descriptions = None
         self.enemies_in_rooms = None
+        # сколько комнат держать в памяти; вытесненные комнаты восстанавливаются из room_seed
+        self.room_budget = RoomCache.DEFAULT_CAPACITY if room_budget is None else room_budget
+        # номера описаний комнат в room_definitions, по ним комнаты попадают в снимок
+        self.room_description_ids = RoomCache(self.room_budget)
+        self.room_seed = None
+        self.defeated_rooms = RoomSet()
         self.hero = None
+        # индекс текущей комнаты, пока герой в подземелье
+        self.position = None
+        # (ширина, высота) — играть в большом подземелье-решетке вместо короткого коридора
+        self.grid_size = grid_size
+        # бой дольше max_fight_turns ходов останавливается, и герой отступает
+        self.max_fight_turns = max_fight_turns
+        # каждые fight_pause ходов шаги игры отдают FIGHT_TURN, чтобы сервер мог передать
+        # управление другим сессиям посреди долгого боя; None — бой идет без перерывов
+        self.fight_pause = fight_pause
+        # (меньше, больше) — в комнатах с врагами отряды такого размера вместо одиночек
+        self.group_size = group_size
         self.exit_game = False
+        if journal is not None:
+            journal.start(rng, {name: getattr(self, name) for name in self.JOURNAL_SETTINGS})
+
+    def _release_enemies(self):
+        if self.pool is None or self.enemies_in_rooms is None:
+            return
+        enemies = self.enemies_in_rooms
+        if isinstance(enemies, RoomCache):
+            enemies = enemies.values()
+        for enemy in enemies:
+            if enemy is not None and enemy.index is not None:
+                self.pool.release(enemy.index)
+
+    def _release_hero(self):
+        if self.pool is not None and isinstance(self.hero, PooledEntity):
+            self.pool.release(self.hero.index)
+        self.hero = None
+
+    def _reset_rooms(self, room_seed=None):
+        self.room_seed = self.generator.rng.getrandbits(64) if room_seed is None else room_seed
+        self.defeated_rooms = RoomSet()
+        self.room_descriptions = RoomCache(self.room_budget)
+        self.room_description_ids = RoomCache(self.room_budget)
+        self.enemies_in_rooms = RoomCache(self.room_budget, on_evict=self._enemy_evicted)
+
+    def _enemy_evicted(self, room, enemy):
+        # про вытесненного врага помним только то, что он убит
+        if enemy.current_health <= 0:
+            self.defeated_rooms.add(room)
+        if self.pool is not None and enemy.index is not None:
+            self.pool.release(enemy.index)
+
+    def _room_rng(self, room):
+        """Случайные числа комнаты: одинаковые при каждом повторном создании ее содержимого"""
+        if self.room_seed is None:
+            return self.generator.rng
+        return random.Random(derive_seed(self.room_seed, room))
+
+    def _room_description(self, room):
+        """Описание пустой комнаты; его номер в room_definitions запоминается для снимка"""
+        description = self.room_descriptions[room]
+        # обращение держит номер в кеше столько же, сколько описание
+        index = self.room_description_ids[room]
+        if description is None:
+            catalog = self.generator.catalog
+            index = catalog.random_room_id(self._room_rng(room))
+            description = self.room_descriptions[room] = catalog.room_definitions[index]
+            self.room_description_ids[room] = index
+        return description
+
+    def _room_depth(self, room):
+        """Глубина комнаты — число шагов от входа"""
+        if isinstance(self.dungeon_map, GridDungeon):
+            x, y = self.dungeon_map.coordinates(room)
+            start_x, start_y = self.dungeon_map.coordinates(self.dungeon_map.start)
+            return abs(x - start_x) + abs(y - start_y)
+        return room
+
+    def room_cache_stats(self):
+        return {
+            "descriptions": self.room_descriptions.stats(),
+            "enemies": self.enemies_in_rooms.stats(),
+            "defeated": len(self.defeated_rooms),
+        }
+
+    def save_snapshot(self):
+        return SessionSnapshot.dump(self)
+
+    def load_snapshot(self, data):
+        return SessionSnapshot.load(self, data)
+
+    def _ask(self, prompt):
+        self.output.flush()
+        return input(">> ")
+
+    def record_answer(self, prompt, answer):
+        if self.journal is not None:
+            self.journal.record(prompt, answer)
+
+    def _drive(self, steps):
+        """Прогоняет шаги игры, отвечая на каждый вопрос вводом с клавиатуры"""
+        metrics = self.metrics
+        try:
+            started = time.perf_counter()
+            prompt = next(steps)
+            while True:
+                if prompt == FIGHT_TURN:
+                    # перерыв в бою, а не вопрос игроку
+                    prompt = next(steps)
+                    continue
+                if metrics is not None:
+                    # время между ответом игрока и следующим вопросом — работа игры
+                    asked = time.perf_counter()
+                    metrics.observe("dungeon_compute_seconds", asked - started, prompt=prompt)
+                answer = self._ask(prompt)
+                if metrics is not None:
+                    started = time.perf_counter()
+                    metrics.observe("dungeon_input_wait_seconds", started - asked, prompt=prompt)
+                self.record_answer(prompt, answer)
+                prompt = steps.send(answer)
+        except StopIteration as stop:
+            return stop.value
 
     def start_game(self):
+        return self._drive(self.game_steps())
+
+    def select_hero(self):
+        return self._drive(self.select_hero_steps())
+
+    def process_dungeon_room(self, i, hero):
+        return self._drive(self.dungeon_room_steps(i, hero))
+
+    # Шаги игры — генераторы: каждый вопрос игроку отдается через yield идентификатором
+    # меню, а ответ приходит через send(). Так одну и ту же логику можно вести и с клавиатуры,
+    # и из сервера, где сессия не должна блокировать остальных.
+
+    def game_steps(self):
+        if self.position is not None and not self.exit_game:
+            # сессия восстановлена из снимка посреди подземелья
+            if isinstance(self.dungeon_map, GridDungeon):
+                yield from self._grid_dungeon_steps(self.hero)
+            else:
+                yield from self._dungeon_steps(self.hero)
+
         while not self.exit_game:
-            hero = self.select_hero()
+            hero = yield from self.select_hero_steps()
+            self.hero = hero
 
-            print(
-                "Вы подходите к замшелому подземелью, которое не внушает никакого доверия, "
-                "перед вами стоит выбор: рискнуть или пройти мимо?\n"
-                "1. Войти в подземелье\n"
-                "2. Пройти мимо"
-            )
-            choose = input(">> ")
-
-            if choose == "1":
-                self.dungeon_map = self.generator.create_dungeon_rooms()
-                # инициализируем кеши под ту же длину карты
-                self.room_descriptions = [None] * len(self.dungeon_map)
-                self.enemies_in_rooms = [None] * len(self.dungeon_map)
-
-                i = 0
-                while i < len(self.dungeon_map):
-                    result = self.process_dungeon_room(i, hero)
-                    if result == "death":
-                        self.exit_game = True
-                        break
-                    elif result == "exit":
-                        self.exit_game = True
-                        print("Выходим из игры")
-                        break
-                    elif result == -1:
-                        i = i - 1
-                        continue
-                    i = i + 1
+            self.output.emit("dungeon_approach")
+            choose = yield "dungeon_approach"
+
+            if choose == "1" and self.grid_size is not None:
+                self._release_enemies()
+                self.dungeon_map = self.generator.create_grid_dungeon(*self.grid_size)
+                self._reset_rooms()
+                self.position = self.dungeon_map.start
+                yield from self._grid_dungeon_steps(hero)
+            elif choose == "1":
+                self._release_enemies()
+                self.dungeon_map = self.generator.create_dungeon_rooms(self.generator.rng)
+                # кеши комнат заполняются по мере посещения
+                self._reset_rooms()
+                self.position = 0
+                yield from self._dungeon_steps(hero)
             elif choose == "2":
                 self.exit_game = True
-                print("Выходим из игры")
+                self.output.emit("exit_game")
+        self.output.flush()
 
-    def select_hero(self):
+    def _dungeon_steps(self, hero):
+        while self.position < len(self.dungeon_map):
+            result = yield from self.dungeon_room_steps(self.position, hero)
+            if result == "death":
+                self.exit_game = True
+                break
+            elif result == "exit":
+                self.exit_game = True
+                self.output.emit("exit_game")
+                break
+            elif result == -1:
+                self.position = self.position - 1
+                continue
+            self.position = self.position + 1
+        self.position = None
+
+    def _grid_dungeon_steps(self, hero):
+        dungeon = self.dungeon_map
+        # путь для «вернуться назад»; ограничен, чтобы память не росла с числом шагов
+        trail = deque(maxlen=self.TRAIL_LENGTH)
+        while True:
+            dungeon.visit(self.position)
+            result = yield from self.dungeon_room_steps(self.position, hero)
+            if result == "death":
+                self.exit_game = True
+                break
+            elif result == "exit":
+                self.exit_game = True
+                self.output.emit("exit_game")
+                break
+            elif result == -1:
+                if trail:
+                    self.position = trail.pop()
+                continue
+
+            neighbors = dungeon.neighbors(self.position)
+            while True:
+                self.output.emit("room_directions", directions=[name for name, _ in neighbors],
+                                 distance=dungeon.distance_to_exit(self.position))
+                answer = yield "room_directions"
+                if answer.isdigit() and 1 <= int(answer) <= len(neighbors):
+                    break
+            trail.append(self.position)
+            self.position = neighbors[int(answer) - 1][1]
+        self.position = None
+
+    def select_hero_steps(self):
         while True:
             try:
                 heroes_list = self.generator.get_heroes()
-                print(
-                    "\n".join(
-                        f"{i + 1}. {key}" for i, key in enumerate(heroes_list)
-                    ) + "\nВыберите одного из персонажей:")
-                person = int(input(">> ")) - 1
+                self.output.emit("hero_menu", heroes=heroes_list)
+                person = int((yield "hero_menu")) - 1
                 hero_name = heroes_list[person]
                 hero = self.generator.create_player(hero_name)
-                print(f"Вы выбрали персонажа \"{hero.name}\", {hero.definition}")
-                print("--------------------------------------------------------------------")
+                self.output.emit("hero_selected", name=hero.name, definition=hero.definition)
+                self.output.emit("separator")
                 return hero
             except ValueError:
-                print("Ошибка ввода! Введите число.")
+                self.output.emit("input_not_number")
             except IndexError:
-                print("Номер персонажа вне диапазона!")
+                self.output.emit("hero_out_of_range")
             except Exception as e:
-                print(f"Критическая ошибка: {e}")
+                self.output.emit("critical_error", error=e)
+                self.output.flush()
                 import traceback
                 traceback.print_exc()
 
-    def process_dungeon_room(self, i, hero):
-        print("--------------------------------------------------------------------")
+    def dungeon_room_steps(self, i, hero):
+        self.output.emit("separator")
         room_type = self.dungeon_map[i]
+        if self.metrics is not None:
+            self.metrics.inc("dungeon_rooms_entered_total", type=room_type or "empty")
 
         if room_type == "St":
-            print("Перед вами: начало подземелья, его ворота уже не открываются изнутри...\n"
-                "1. Пройти дальше")
-            step = input(">> ")
+            self.output.emit("room_start")
+            step = yield "room_start"
             return 1 if step == "1" else 0
 
         elif room_type == "":
 
-            if self.room_descriptions[i] is None:
-                self.room_descriptions[i] = random.choice(self.generator.get_room_definitions())
-            description = self.room_descriptions[i]
-            print(
-                f"Перед вами: {description}\n"
-                "1. Пройти дальше\n"
-                "2. Вернуться назад")
-            step = input(">> ")
+            description = self._room_description(i)
+            self.output.emit("room_empty", description=description)
+            step = yield "room_empty"
             if step == "2":
                 return -1
             return 1
 
         elif room_type == "E":
-            if self.enemies_in_rooms[i] is None:
-                enemy_key = random.choice(self.generator.get_enemies())
-                self.enemies_in_rooms[i] = self.generator.create_enemy(enemy_key)
             enemy = self.enemies_in_rooms[i]
+            if enemy is None:
+                rng = self._room_rng(i)
+                depth = self._room_depth(i)
+                if self.group_size is not None:
+                    enemy = self.generator.create_enemy_group(rng.randint(*self.group_size), rng, depth)
+                else:
+                    enemy_id = self.generator.random_enemy_id(rng, depth)
+                    enemy = self.generator.create_enemy_by_id(enemy_id, self.pool, rng, depth)
+                if i in self.defeated_rooms:
+                    enemy.current_health = 0
+                self.enemies_in_rooms[i] = enemy
 
             if enemy.current_health <= 0:
-                print(f"Вы вошли в комнату и наблюдаете: {enemy.death_definition}\n"
-                      "1. Пройти дальше\n2. Вернуться назад")
-                step = input(">> ")
+                self.output.emit("room_enemy_dead", death_definition=enemy.death_definition)
+                step = yield "room_enemy_dead"
                 if step == "2":
                     return -1
                 return 1
 
-            print(
-                f"Вы зашли в комнату и прямо напротив вас стоит {enemy.name}!\n"
-                "1. Атаковать\n"
-                "2. Вернуться назад")
-            step = input(">> ")
+            self.output.emit("room_enemy", name=enemy.name)
+            step = yield "room_enemy"
 
             if step == "1":
-                fight_result = self.auto_fight(hero, enemy)
+                if self.group_size is not None:
+                    from group_fight import group_fight_steps as fight_steps
+                else:
+                    fight_steps = self.fight_steps
+                fight = fight_steps(hero, enemy, self.output, self.rng, self.metrics, self.max_fight_turns,
+                                    events=False)
+                if self.fight_pause is None:
+                    fight_result = self.run_fight(fight)
+                else:
+                    fight_result = yield from self._paced_fight(fight)
+                if fight_result is None:
+                    return -1
                 if fight_result is False:
                     return "death"
                 else:
-                    print("1. Пройти дальше\n2. Вернуться назад")
-                    step = input(">> ")
+                    self.output.emit("room_cleared")
+                    step = yield "room_cleared"
                     if step == "2":
                         return -1
                     return 1
@@ -266,13 +1398,8 @@ class DungeonController:
                 return -1
 
         elif room_type == "Ex":
-            print(
-                "Вы успешно зачистили подземелье, выход прямо перед вами, "
-                "но вы все еще можете прогуляться по нему:\n"
-                "1. Выйти из подземелья\n"
-                "2. Вернуться назад"
-            )
-            step = input(">> ")
+            self.output.emit("room_exit")
+            step = yield "room_exit"
             if step == "1":
                 return "exit"
             elif step == "2":
@@ -280,56 +1407,218 @@ class DungeonController:
 
         return 1
 
+    def _paced_fight(self, fight):
+        turns = 0
+        try:
+            while True:
+                next(fight)
+                turns += 1
+                if turns % self.fight_pause == 0:
+                    yield FIGHT_TURN
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            # сессию закрыли посреди боя
+            fight.close()
+
+    @staticmethod
+    def auto_fight(hero, enemy, output=None, rng=None, metrics=None, max_turns=None):
+        """Бой целиком: True — победа героя, False — смерть, None — бой остановлен по max_turns"""
+        steps = DungeonController.fight_steps(hero, enemy, output, rng, metrics, max_turns, events=False)
+        return DungeonController.run_fight(steps)
+
     @staticmethod
-    def auto_fight(hero, enemy):
+    def run_fight(steps):
+        """Прогоняет оставшиеся ходы боя без остановок и возвращает его итог"""
+        try:
+            while True:
+                next(steps)
+        except StopIteration as stop:
+            return stop.value
+
+    @staticmethod
+    def fight_steps(hero, enemy, output=None, rng=None, metrics=None, max_turns=None, events=True):
+        """
+        Бой по ходам: после каждого удара отдает TurnEvent, итог — значение StopIteration,
+        как у auto_fight. Вызывающий может ставить бой на паузу, просто не запрашивая
+        следующий ход, прервать его через close() или дойти до итога через run_fight().
+        events=False — отдавать None вместо событий, если они никому не нужны.
+        """
+        if output is None:
+            output = ConsoleOutput()
+        roll = hit_roller(rng)
         i = 1
 
-        while hero.current_health > 0 and enemy.current_health > 0:
-            print(HealthBarDrawer.draw_health_bar("hero", hero.name, hero.current_health, hero.max_health))
-            print(HealthBarDrawer.draw_health_bar("enemy", enemy.name, enemy.current_health, enemy.max_health))
-            if i == 1:
-                print("Вы решительно бросаетесь на противника. Завязался бой:")
-            if i % 2 == 1:
-                print("Вы наносите удар!")
-                if hero.weapon.success_probability >= randint(0, 100) / 100:
-                    if hero.weapon.damage > enemy.armor.defense:
-                        damage = hero.weapon.damage - enemy.armor.defense
-                        enemy.current_health = enemy.current_health - damage
-                        print(f"Удар пришелся точно в цель! Вы нанесли {damage} урона по цели \"{enemy.name}\"")
+        try:
+            while hero.current_health > 0 and enemy.current_health > 0:
+                if max_turns is not None and i > max_turns:
+                    output.emit("fight_stalled", name=enemy.name)
+                    output.emit("separator")
+                    if metrics is not None:
+                        metrics.inc("dungeon_fights_total", result="stalled")
+                    return None
+                output.emit("health_bar", entity_type="hero", name=hero.name,
+                            current_hp=hero.current_health, max_hp=hero.max_health)
+                output.emit("health_bar", entity_type="enemy", name=enemy.name,
+                            current_hp=enemy.current_health, max_hp=enemy.max_health)
+                if i == 1:
+                    output.emit("fight_start")
+                damage = 0
+                if i % 2 == 1:
+                    attacker = "hero"
+                    output.emit("hero_attack")
+                    if hero.weapon.success_probability >= roll() / 100:
+                        if hero.weapon.damage > enemy.armor.defense:
+                            outcome = "hit"
+                            damage = hero.weapon.damage - enemy.armor.defense
+                            enemy.current_health = enemy.current_health - damage
+                            output.emit("hero_hit", damage=damage, name=enemy.name)
+                        else:
+                            outcome = "blocked"
+                            output.emit("hero_blocked")
                     else:
-                        print("Броня противника не пробита, вы не нанесли урон.")
+                        outcome = "miss"
+                        output.emit("hero_missed", name=enemy.name)
                 else:
-                    print(f"{enemy.name} смог увернуться от вашего удара!")
-            else:
-                print(f"{enemy.name} наносит ответный удар. Берегитесь!")
-                if enemy.weapon.success_probability >= randint(0, 100) / 100:
-                    if enemy.weapon.damage > hero.armor.defense:
-                        damage = enemy.weapon.damage - hero.armor.defense
-                        hero.current_health = hero.current_health - damage
-                        print(f"На этот раз вы не смогли увернуться, \"{enemy.name}\" нанес вам {damage} урона")
+                    attacker = "enemy"
+                    output.emit("enemy_attack", name=enemy.name)
+                    if enemy.weapon.success_probability >= roll() / 100:
+                        if enemy.weapon.damage > hero.armor.defense:
+                            outcome = "hit"
+                            damage = enemy.weapon.damage - hero.armor.defense
+                            hero.current_health = hero.current_health - damage
+                            output.emit("enemy_hit", damage=damage, name=enemy.name)
+                        else:
+                            outcome = "blocked"
+                            output.emit("enemy_blocked", name=enemy.name)
                     else:
-                        print(f"\"{enemy.name}\" не смог пробить вашу броню!")
-                else:
-                    print("Удар был внезапным, но вы смогли увернуться! ")
+                        outcome = "miss"
+                        output.emit("enemy_missed")
 
-            if enemy.current_health <= 0:
-                print(HealthBarDrawer.draw_health_bar("enemy", enemy.name, 0, enemy.max_health))
-                print(f"Вы одержали победу над {enemy.name}! {enemy.death_definition}")
-                if hero.current_health < hero.max_health:
-                    hero.current_health = hero.max_health
-                    print(f"Запасы вашего здоровья восстановлены!")
-                print("--------------------------------------------------------------------")
-                return True
-
-            elif hero.current_health <= 0:
-                print(HealthBarDrawer.draw_health_bar("hero", hero.name, 0, hero.max_health))
-                print(f"{hero.death_definition}")
-                print("--------------------------------------------------------------------")
-                return False
-            i = i + 1
+                # создание события заметно в цене хода, поэтому без потребителя его нет
+                yield TurnEvent(i, attacker, outcome, damage, hero.current_health,
+                                enemy.current_health) if events else None
+
+                if enemy.current_health <= 0:
+                    output.emit("health_bar", entity_type="enemy", name=enemy.name,
+                                current_hp=0, max_hp=enemy.max_health)
+                    output.emit("victory", name=enemy.name, death_definition=enemy.death_definition)
+                    if hero.current_health < hero.max_health:
+                        hero.current_health = hero.max_health
+                        output.emit("hero_healed")
+                    output.emit("separator")
+                    if metrics is not None:
+                        metrics.inc("dungeon_fights_total", result="win")
+                        metrics.observe("dungeon_fight_turns", i, metrics.TURN_BUCKETS)
+                    return True
+
+                elif hero.current_health <= 0:
+                    output.emit("health_bar", entity_type="hero", name=hero.name,
+                                current_hp=0, max_hp=hero.max_health)
+                    output.emit("hero_death", death_definition=hero.death_definition)
+                    output.emit("separator")
+                    if metrics is not None:
+                        metrics.inc("dungeon_fights_total", result="loss")
+                        metrics.observe("dungeon_fight_turns", i, metrics.TURN_BUCKETS)
+                    return False
+                i = i + 1
+        except GeneratorExit:
+            if metrics is not None:
+                metrics.inc("dungeon_fights_total", result="cancelled")
+            raise
+
+
+def _group_size(text):
+    low, _, high = text.partition(":")
+    low = int(low)
+    high = int(high) if high else low
+    if not 1 <= low <= high:
+        raise ValueError(text)
+    return low, high
+
+
+def parse_args(argv):
+    if not argv:
+        # без аргументов argparse не нужен, а его импорт — заметная доля времени запуска
+        from types import SimpleNamespace
+        return SimpleNamespace(seed=None, journal=None, room_budget=None, metrics=None, profile=None,
+                               batch=None, output=None, transcript=False, render="auto", fps=None,
+                               group_size=None)
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Подземелье")
+    parser.add_argument("--seed", type=int, help="seed для воспроизводимой игры")
+    parser.add_argument("--journal", help="дописывать ответы игрока в этот журнал")
+    parser.add_argument("--room-budget", type=int,
+                        help=f"сколько комнат держать в памяти, по умолчанию {RoomCache.DEFAULT_CAPACITY}")
+    parser.add_argument("--metrics", help="после игры записать метрики в этот файл в формате Prometheus")
+    parser.add_argument("--profile", help="профилировать игру через cProfile и сохранить статистику в файл")
+    parser.add_argument("--batch", help="прогнать сессии из файла JSON Lines (- для stdin) вместо игры с клавиатуры")
+    parser.add_argument("--output", help="куда писать итоги --batch, по умолчанию stdout")
+    parser.add_argument("--transcript", action="store_true", help="добавить в итоги --batch текст сессии")
+    parser.add_argument("--render", choices=("auto", "plain", "frame"), default="auto",
+                        help="frame — рисовать бой кадрами на месте, plain — обычный текст; "
+                             "auto — кадры, только если вывод в терминал")
+    parser.add_argument("--fps", type=float, help="не больше стольких кадров боя в секунду")
+    parser.add_argument("--group-size", type=_group_size, metavar="MIN:MAX",
+                        help="в комнатах с врагами отряды от MIN до MAX врагов вместо одиночек")
+    return parser.parse_args(argv)
+
+
+def cli(argv):
+    """Точка входа python main.py; возвращает код завершения"""
+    if argv[:1] == ["sweep"]:
+        from balance import main
+        return main(argv[1:])
+    if argv[:1] == ["autoplay"]:
+        from bots import main
+        return main(argv[1:])
+
+    args = parse_args(argv)
+
+    dungeon = DungeonGenerator("data/game_data.json", background=True)
+    journal = None
+    if args.journal:
+        from journal import SessionJournal
+        journal = SessionJournal.open(args.journal)
+    metrics = None
+    if args.metrics:
+        from metrics import Metrics
+        metrics = dungeon.metrics = Metrics()
+    rng = SessionRandom(args.seed) if args.seed is not None else None
+    output = None
+    if args.render == "frame" or (args.render == "auto" and sys.stdout.isatty()):
+        from frame_output import FrameOutput
+        output = FrameOutput(sys.stdout, metrics, max_fps=args.fps)
+    controller = DungeonController(dungeon, output, rng=rng, journal=journal, room_budget=args.room_budget,
+                                   metrics=metrics, group_size=args.group_size)
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    status = 0
+    try:
+        if args.batch:
+            # seed здесь — общий корень для сессий без собственного seed
+            from batch import main as run_batch
+            status = run_batch(dungeon, args.batch, args.output, args.seed, args.transcript, metrics)
+        else:
+            controller.start_game()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if metrics is not None:
+            metrics.write_prometheus(args.metrics)
+        if journal is not None:
+            journal.close()
+    return status
 
 
 if __name__ == "__main__":
-    dungeon = DungeonGenerator("data/game_data.json")
-    controller = DungeonController(dungeon)
-    controller.start_game()
+    # frame_output, batch, bots и другие модули делают import main; если бы игра шла в этом
+    # модуле __main__, файл загрузился бы второй раз со второй копией каждого класса и кеша
+    import main
+    sys.exit(main.cli(sys.argv[1:]))
@@ -0,0 +1,113 @@
+"""
+Счетчики и гистограммы горячих путей игры.
+
+Контроллер, генератор и выводы пишут сюда, только если им передан Metrics;
+без него на горячем пути остается одна проверка на None. Снимок доступен
+в процессе через snapshot(), а для Prometheus — текстовый формат экспозиции:
+
+    metrics.write_prometheus("/var/lib/node_exporter/dungeon.prom")
+"""
+import os
+from bisect import bisect_left
+
+
+# секунды: от долей миллисекунды на ход игры до минут ожидания ввода
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, 120.0)
+TURN_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class Histogram:
+    """Гистограмма с фиксированными верхними границами корзин"""
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Пары (граница, число наблюдений не больше нее), последняя граница — +Inf"""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """Метрики одного процесса: счетчики и гистограммы с метками"""
+    TURN_BUCKETS = TURN_BUCKETS
+    LATENCY_BUCKETS = LATENCY_BUCKETS
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def snapshot(self):
+        """Текущие значения в виде словаря, ключи — имена рядов в записи Prometheus"""
+        return {
+            "counters": {_series(name, labels): value for (name, labels), value in self.counters.items()},
+            "histograms": {
+                _series(name, labels): {
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "buckets": histogram.cumulative(),
+                }
+                for (name, labels), histogram in self.histograms.items()
+            },
+        }
+
+    def to_prometheus(self):
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{_series(name, labels)} {_number(value)}")
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            for bound, count in histogram.cumulative():
+                lines.append(f"{_series(name + '_bucket', labels + (('le', _number(bound)),))} {count}")
+            lines.append(f"{_series(name + '_sum', labels)} {_number(histogram.sum)}")
+            lines.append(f"{_series(name + '_count', labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Записывает файл целиком через временный, чтобы сборщик не прочитал его наполовину"""
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(temporary, path)
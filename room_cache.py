@@ -0,0 +1,96 @@
+from collections import OrderedDict
+
+
+class RoomCache:
+    """
+    Разреженное хранилище состояния комнат по ID с ограничением по числу комнат.
+
+    Непосещенные комнаты в нем не хранятся и читаются как None. При превышении
+    capacity вытесняется комната, к которой дольше всего не обращались.
+    Вытеснение безопасно, только если содержимое комнаты можно получить заново —
+    контроллер для этого генерирует комнаты детерминированно из seed.
+    capacity=None снимает ограничение.
+    """
+    DEFAULT_CAPACITY = 4096
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, on_evict=None):
+        self.capacity = capacity
+        self.on_evict = on_evict
+        self._rooms = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getitem__(self, room):
+        value = self._rooms.get(room)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._rooms.move_to_end(room)
+        return value
+
+    def __setitem__(self, room, value):
+        self._rooms[room] = value
+        self._rooms.move_to_end(room)
+        if self.capacity is not None:
+            while len(self._rooms) > self.capacity:
+                evicted_room, evicted = self._rooms.popitem(last=False)
+                self.evictions += 1
+                if self.on_evict is not None:
+                    self.on_evict(evicted_room, evicted)
+
+    def __contains__(self, room):
+        return room in self._rooms
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def values(self):
+        return self._rooms.values()
+
+    def stats(self):
+        return {
+            "rooms": len(self._rooms),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class RoomSet:
+    """
+    Множество ID комнат в битовой карте: бит на комнату до наибольшего добавленного ID.
+    В решетке 1000 × 1000 все комнаты займут 125 КБ, тогда как set — десятки мегабайт.
+    """
+    __slots__ = ("_bits", "_count")
+
+    def __init__(self, rooms=()):
+        self._bits = bytearray()
+        self._count = 0
+        for room in rooms:
+            self.add(room)
+
+    def add(self, room):
+        byte = room >> 3
+        if byte >= len(self._bits):
+            self._bits.extend(bytes(byte + 1 - len(self._bits)))
+        mask = 1 << (room & 7)
+        if not self._bits[byte] & mask:
+            self._bits[byte] |= mask
+            self._count += 1
+
+    def __contains__(self, room):
+        byte = room >> 3
+        return byte < len(self._bits) and bool(self._bits[byte] >> (room & 7) & 1)
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for byte, value in enumerate(self._bits):
+            if value:
+                for bit in range(8):
+                    if value >> bit & 1:
+                        yield byte * 8 + bit
@@ -0,0 +1,261 @@
+"""
+Сервер на asyncio: много независимых игр в одном цикле событий.
+
+Протокол строковый, подойдет обычный telnet:
+
+    python server.py --port 8023
+    telnet 127.0.0.1 8023
+"""
+import argparse
+import asyncio
+import cProfile
+import io
+import os
+import random
+import time
+
+from content_watcher import ContentWatcher
+from journal import JournalBuffer, SessionJournal, append_text
+from main import FIGHT_TURN, BufferedOutput, DungeonController, DungeonGenerator
+from metrics import Metrics
+
+
+PROMPT = ">> "
+
+
+class GameSession:
+    """Одна игра: собственный контроллер поверх общего генератора"""
+
+    def __init__(self, session_id, generator, journal=None, metrics=None, profiler=None, fight_pause=None,
+                 max_fight_turns=None):
+        self.session_id = session_id
+        self.buffer = io.StringIO()
+        self.metrics = metrics
+        self.controller = DungeonController(generator, BufferedOutput(self.buffer, metrics), journal=journal,
+                                            metrics=metrics, max_fight_turns=max_fight_turns,
+                                            fight_pause=fight_pause)
+        self.steps = self.controller.game_steps()
+        # cProfile.Profile, если сессию выбрали для профилирования
+        self.profiler = profiler
+        self.prompt = None
+        self.finished = False
+
+    def _step(self, answer=None):
+        started = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.enable()
+        try:
+            if answer is None:
+                self.prompt = next(self.steps)
+            else:
+                self.controller.record_answer(self.prompt, answer)
+                self.prompt = self.steps.send(answer)
+        except StopIteration:
+            self.finished = True
+        finally:
+            if self.profiler is not None:
+                self.profiler.disable()
+        if self.metrics is not None:
+            # у завершившей игру сессии вопроса нет
+            prompt = "finished" if self.finished else self.prompt
+            self.metrics.observe("dungeon_compute_seconds", time.perf_counter() - started, prompt=prompt)
+        self.controller.output.flush()
+        text = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return text if self.finished or self.fighting else text + PROMPT
+
+    @property
+    def fighting(self):
+        """Игра остановилась на перерыве в бою и ждет resume(), а не ответа игрока"""
+        return self.prompt == FIGHT_TURN and not self.finished
+
+    def start(self):
+        return self._step()
+
+    def answer(self, line):
+        return self._step(line)
+
+    def resume(self):
+        return self._step()
+
+    def close(self):
+        self.steps.close()
+
+
+class GameServer:
+    """Принимает подключения и ведет по сессии на каждое"""
+
+    def __init__(self, generator, idle_timeout=300.0, max_sessions=10000, journal_file=None,
+                 metrics=None, profile_rate=0.0, profile_dir=".", fight_pause=None, max_fight_turns=None):
+        self.generator = generator
+        # ходов боя между передачами управления другим сессиям и предел длины боя
+        self.fight_pause = fight_pause
+        self.max_fight_turns = max_fight_turns
+        self.metrics = metrics
+        # доля сессий, которые целиком профилируются через cProfile
+        self.profile_rate = profile_rate
+        self.profile_dir = profile_dir
+        # общий поток журнала, обычно JournalBuffer: каждая сессия пишет в него под своим ID
+        self.journal_file = journal_file
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.evicted = 0
+        self._next_id = 0
+        self._server = None
+
+    async def start(self, host="127.0.0.1", port=8023, backlog=1024):
+        self._server = await asyncio.start_server(self.handle_client, host, port, backlog=backlog)
+        return self._server
+
+    @property
+    def port(self):
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self, host="127.0.0.1", port=8023):
+        server = await self.start(host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def handle_client(self, reader, writer):
+        if len(self.sessions) >= self.max_sessions:
+            writer.write("Сервер переполнен, попробуйте позже\n".encode("utf-8"))
+            await self._close(writer)
+            return
+
+        self._next_id += 1
+        journal = None
+        if self.journal_file is not None:
+            journal = SessionJournal(self.journal_file, f"{os.getpid()}-{self._next_id}")
+        profiler = None
+        if self.profile_rate and random.random() < self.profile_rate:
+            profiler = cProfile.Profile()
+        session = GameSession(self._next_id, self.generator, journal, self.metrics, profiler, self.fight_pause,
+                              self.max_fight_turns)
+        self.sessions[session.session_id] = session
+        if self.metrics is not None:
+            self.metrics.inc("dungeon_sessions_total")
+        try:
+            await self._send(writer, session, session.start())
+            while not session.finished:
+                waiting = time.perf_counter()
+                try:
+                    line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    self.evicted += 1
+                    writer.write("\nСессия закрыта из-за бездействия\n".encode("utf-8"))
+                    break
+                if not line:
+                    break
+                if self.metrics is not None:
+                    self.metrics.observe("dungeon_input_wait_seconds", time.perf_counter() - waiting,
+                                         prompt=session.prompt)
+                answer = line.decode("utf-8", errors="replace").rstrip("\r\n")
+                await self._send(writer, session, session.answer(answer))
+        except ConnectionError:
+            pass
+        finally:
+            session.close()
+            if profiler is not None:
+                profiler.dump_stats(os.path.join(self.profile_dir, f"session-{os.getpid()}-{session.session_id}.prof"))
+            del self.sessions[session.session_id]
+            await self._close(writer)
+
+    @staticmethod
+    async def _send(writer, session, text):
+        writer.write(text.encode("utf-8"))
+        # drain ждет только этого клиента, остальные сессии продолжают работать
+        await writer.drain()
+        while session.fighting:
+            # долгий бой идет частями: ходы уже отправлены клиенту, очередь за другими сессиями
+            await asyncio.sleep(0)
+            writer.write(session.resume().encode("utf-8"))
+            await writer.drain()
+
+    @staticmethod
+    async def _close(writer):
+        try:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+async def export_metrics(metrics, path, interval):
+    while True:
+        await asyncio.sleep(interval)
+        metrics.write_prometheus(path)
+
+
+async def flush_journal(buffer, file, interval):
+    """Раз в interval секунд переносит накопленные записи журнала в файл в пуле потоков"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        text = buffer.take()
+        if text:
+            await loop.run_in_executor(None, append_text, file, text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сервер подземелья для множества игроков")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8023)
+    parser.add_argument("--data", default="data/game_data.json")
+    parser.add_argument("--idle-timeout", type=float, default=300.0)
+    parser.add_argument("--max-sessions", type=int, default=10000)
+    parser.add_argument("--journal", help="дописывать ответы всех сессий в этот журнал")
+    parser.add_argument("--journal-interval", type=float, default=0.5,
+                        help="как часто переносить накопленные записи журнала в файл")
+    parser.add_argument("--watch-interval", type=float, default=1.0,
+                        help="как часто проверять изменения файла данных, 0 — не проверять")
+    parser.add_argument("--metrics", help="периодически записывать метрики в этот файл в формате Prometheus")
+    parser.add_argument("--metrics-interval", type=float, default=15.0)
+    parser.add_argument("--profile-rate", type=float, default=0.0,
+                        help="доля сессий, которые профилируются через cProfile")
+    parser.add_argument("--profile-dir", default=".")
+    parser.add_argument("--fight-pause", type=int, default=32,
+                        help="через сколько ходов боя уступать цикл событий другим сессиям, 0 — не уступать")
+    parser.add_argument("--max-fight-turns", type=int, default=10000,
+                        help="после стольких ходов бой останавливается и герой отступает, 0 — без предела")
+    args = parser.parse_args()
+
+    journal_file = open(args.journal, "a", encoding="utf-8") if args.journal else None
+    journal = JournalBuffer() if journal_file is not None else None
+    generator = DungeonGenerator(args.data)
+    metrics = None
+    if args.metrics:
+        metrics = generator.metrics = Metrics()
+    server = GameServer(generator, args.idle_timeout, args.max_sessions, journal,
+                        metrics, args.profile_rate, args.profile_dir, args.fight_pause or None,
+                        args.max_fight_turns or None)
+    watcher = ContentWatcher(generator, args.watch_interval).start() if args.watch_interval > 0 else None
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        if metrics is not None:
+            loop.create_task(export_metrics(metrics, args.metrics, args.metrics_interval))
+        if journal is not None:
+            loop.create_task(flush_journal(journal, journal_file, args.journal_interval))
+        await server.serve_forever(args.host, args.port)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if watcher is not None:
+            watcher.stop()
+        if journal_file is not None:
+            append_text(journal_file, journal.take())
+            journal_file.close()
+
+
+if __name__ == "__main__":
+    main()
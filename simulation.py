@@ -0,0 +1,149 @@
+import itertools
+from dataclasses import dataclass
+
+import numpy as np
+
+
+# Бой, в котором никто не может пробить броню, в auto_fight не заканчивается никогда,
+# поэтому в пакетном движке число ходов ограничено
+MAX_TURNS = 1000
+
+
+@dataclass
+class FightStats:
+    """Итоги серии боев для одной комбинации героя, врага и снаряжения"""
+    fights: int
+    wins: int
+    losses: int
+    unresolved: int
+    turns: np.ndarray
+    mean_hp_left: float
+
+    @property
+    def win_rate(self):
+        return self.wins / self.fights if self.fights else 0.0
+
+    @property
+    def mean_turns(self):
+        counts = self.turns
+        total = counts.sum()
+        if total == 0:
+            return 0.0
+        return float((counts * np.arange(len(counts))).sum() / total)
+
+
+def combat_params(data, hero_key, enemy_key, hero_weapon, hero_armor, enemy_weapon, enemy_armor):
+    """Собирает числовые параметры боя из словаря game_data.json"""
+    hero = data["heroes"][hero_key]
+    enemy = data["enemies"][enemy_key]
+    hw = data["weapons"][hero_weapon]
+    ew = data["weapons"][enemy_weapon]
+    return {
+        "hero_health": hero["health"],
+        "hero_damage": hw["damage"],
+        "hero_probability": hw["success_probability"],
+        "hero_defense": data["armor"][hero_armor]["defense"],
+        "enemy_health": enemy["health"],
+        "enemy_damage": ew["damage"],
+        "enemy_probability": ew["success_probability"],
+        "enemy_defense": data["armor"][enemy_armor]["defense"],
+    }
+
+
+def _column(values, size, dtype):
+    column = np.asarray(values, dtype=dtype).reshape(-1, 1)
+    if column.shape[0] == 1 and size > 1:
+        column = np.repeat(column, size, axis=0)
+    return column
+
+
+def simulate_fights(hero_health, hero_damage, hero_probability, hero_defense,
+                    enemy_health, enemy_damage, enemy_probability, enemy_defense,
+                    n_fights=10000, rng=None, max_turns=MAX_TURNS):
+    """
+    Пакетный аналог DungeonController.auto_fight.
+
+    Каждый параметр — число или массив длины k (по одному значению на комбинацию).
+    Для каждой комбинации разыгрывается n_fights независимых боев с теми же правилами:
+    герой бьет на нечетных ходах, враг на четных, попадание —
+    success_probability >= randint(0, 100) / 100, урон — damage - defense,
+    если он положительный. Возвращает список FightStats длины k.
+    """
+    rng = np.random.default_rng(rng)
+    params = [hero_health, hero_damage, hero_probability, hero_defense,
+              enemy_health, enemy_damage, enemy_probability, enemy_defense]
+    k = max(np.size(p) for p in params)
+
+    hero_hp = np.repeat(_column(hero_health, k, np.int64), n_fights, axis=1)
+    enemy_hp = np.repeat(_column(enemy_health, k, np.int64), n_fights, axis=1)
+    hero_hit = _column(hero_probability, k, np.float64)
+    enemy_hit = _column(enemy_probability, k, np.float64)
+    # урон по правилам auto_fight: только если оружие пробивает броню
+    hero_blow = np.maximum(_column(hero_damage, k, np.int64) - _column(enemy_defense, k, np.int64), 0)
+    enemy_blow = np.maximum(_column(enemy_damage, k, np.int64) - _column(hero_defense, k, np.int64), 0)
+
+    hero_hp = hero_hp.ravel()
+    enemy_hp = enemy_hp.ravel()
+    combo = np.repeat(np.arange(k), n_fights)
+    hero_hit, enemy_hit = hero_hit.ravel()[combo], enemy_hit.ravel()[combo]
+    hero_blow, enemy_blow = hero_blow.ravel()[combo], enemy_blow.ravel()[combo]
+
+    total = k * n_fights
+    outcome = np.zeros(total, dtype=np.int8)  # 1 — победа героя, -1 — поражение, 0 — не завершен
+    turns = np.zeros(total, dtype=np.int64)
+    active = np.arange(total)
+
+    turn = 1
+    while active.size and turn <= max_turns:
+        # как и в auto_fight: бросок целого числа 0..100 и сравнение с вероятностью
+        rolls = rng.integers(0, 101, size=active.size) / 100
+        if turn % 2 == 1:
+            hit = hero_hit[active] >= rolls
+            enemy_hp[active] -= np.where(hit, hero_blow[active], 0)
+            done = enemy_hp[active] <= 0
+            outcome[active[done]] = 1
+        else:
+            hit = enemy_hit[active] >= rolls
+            hero_hp[active] -= np.where(hit, enemy_blow[active], 0)
+            done = hero_hp[active] <= 0
+            outcome[active[done]] = -1
+        turns[active[done]] = turn
+        active = active[~done]
+        turn += 1
+
+    outcome = outcome.reshape(k, n_fights)
+    turns = turns.reshape(k, n_fights)
+    hero_hp = hero_hp.reshape(k, n_fights)
+
+    results = []
+    for c in range(k):
+        won = outcome[c] == 1
+        resolved = outcome[c] != 0
+        results.append(FightStats(
+            fights=n_fights,
+            wins=int(won.sum()),
+            losses=int((outcome[c] == -1).sum()),
+            unresolved=int((~resolved).sum()),
+            turns=np.bincount(turns[c][resolved], minlength=1),
+            # здоровье до восстановления: после победы auto_fight лечит героя до максимума,
+            # так что следующий бой всегда начинается с полного здоровья
+            mean_hp_left=float(hero_hp[c][won].mean()) if won.any() else 0.0,
+        ))
+    return results
+
+
+def sweep(data, n_fights=10000, rng=None, max_turns=MAX_TURNS):
+    """
+    Прогоняет все комбинации герой × враг × оружие и броня героя × оружие и броня врага
+    одним пакетом. Возвращает словарь {(hero, enemy, hero_weapon, hero_armor,
+    enemy_weapon, enemy_armor): FightStats}.
+    """
+    keys = list(itertools.product(data["heroes"], data["enemies"],
+                                  data["weapons"], data["armor"],
+                                  data["weapons"], data["armor"]))
+    columns = {}
+    for key in keys:
+        for name, value in combat_params(data, *key).items():
+            columns.setdefault(name, []).append(value)
+    results = simulate_fights(n_fights=n_fights, rng=rng, max_turns=max_turns, **columns)
+    return dict(zip(keys, results))
@@ -1,6 +1,26 @@
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+import random
 from unittest.mock import patch
 import pytest
 from main import Armor, Weapon, Hero, Enemy, DungeonController
+from main import NullOutput, BufferedOutput, StructuredOutput, render_message, EntityPool
+from main import SessionRandom, DungeonGenerator, TurnEvent, FIGHT_TURN
+from balance import ResumeError, apply_point, expand_grid, parse_param, sweep
+from content_watcher import ContentWatcher
+from grid_dungeon import GridDungeon
+from room_cache import RoomCache
+from metrics import Metrics
+from server import GameServer, GameSession, flush_journal
+from journal import JournalBuffer, SessionJournal, read_journal, replay_journal
+from batch import run_batch
+from bots import AlwaysAdvance, BotController, QuitOnBadOdds, RandomPolicy, RetreatOnBadOdds, autoplay
+from frame_output import FrameOutput
+from group_fight import EnemyGroup, group_fight_steps
 from tests.conftest import controller
 
 
@@ -63,6 +83,209 @@ class TestAutoFight:
         assert hero_with_equipment.death_definition in captured.out
 
 
+class TestFightSteps:
+    """Тесты пошагового боя"""
+
+    @staticmethod
+    def _pair(enemy_hp=60, hero_damage=15, enemy_damage=12):
+        hero = Hero("Герой", "воин", 100, "Герой пал")
+        hero.weapon = Weapon("Меч", "меч", hero_damage, 0.7)
+        hero.armor = Armor("Броня", "броня", 5)
+        enemy = Enemy("Враг", "враг", enemy_hp, "Враг повержен")
+        enemy.weapon = Weapon("Топор", "топор", enemy_damage, 0.7)
+        enemy.armor = Armor("Щит", "щит", 5)
+        return hero, enemy
+
+    def test_events_match_auto_fight(self):
+        """События описывают тот же бой, что и auto_fight с тем же seed, а итог — в StopIteration"""
+        hero, enemy = self._pair()
+        steps = DungeonController.fight_steps(hero, enemy, NullOutput(), SessionRandom(4))
+        events = []
+        with pytest.raises(StopIteration) as stop:
+            while True:
+                events.append(next(steps))
+        reference_hero, reference_enemy = self._pair()
+        expected = DungeonController.auto_fight(reference_hero, reference_enemy, NullOutput(), SessionRandom(4))
+
+        assert stop.value.value == expected
+        assert all(isinstance(event, TurnEvent) for event in events)
+        assert [event.turn for event in events] == list(range(1, len(events) + 1))
+        assert [event.attacker for event in events[:2]] == ["hero", "enemy"]
+        assert all(event.damage == 0 for event in events if event.outcome != "hit")
+        assert 60 - sum(event.damage for event in events if event.attacker == "hero") == events[-1].enemy_hp
+        assert events[-1].enemy_hp == reference_enemy.current_health
+
+    def test_cancel_and_skip(self):
+        """Бой можно прервать посреди ходов или досчитать до итога без событий"""
+        metrics = Metrics()
+        hero, enemy = self._pair(enemy_hp=1000)
+        steps = DungeonController.fight_steps(hero, enemy, NullOutput(), SessionRandom(1), metrics)
+        for _ in range(3):
+            next(steps)
+        steps.close()
+
+        assert hero.current_health > 0 and enemy.current_health > 0
+        assert metrics.snapshot()["counters"] == {'dungeon_fights_total{result="cancelled"}': 1}
+
+        hero, enemy = self._pair()
+        steps = DungeonController.fight_steps(hero, enemy, NullOutput(), SessionRandom(1))
+        next(steps)
+        assert DungeonController.run_fight(steps) in (True, False)
+
+    def test_runaway_fight_is_stopped(self, generator):
+        """Бой, в котором никто не пробивает броню, останавливается по пределу ходов, и герой отступает"""
+        hero, enemy = self._pair(hero_damage=5, enemy_damage=5)
+        output = StructuredOutput()
+
+        assert DungeonController.auto_fight(hero, enemy, output, SessionRandom(1), max_turns=50) is None
+        assert ("fight_stalled", {"name": "Враг"}) in output.events
+
+        controller = DungeonController(generator, NullOutput(), max_fight_turns=50)
+        controller.dungeon_map = ["St", "", "E", "Ex"]
+        controller._reset_rooms(1)
+        controller.enemies_in_rooms[2] = enemy
+        steps = controller.dungeon_room_steps(2, hero)
+        assert next(steps) == "room_enemy"
+        with pytest.raises(StopIteration) as stop:
+            steps.send("1")
+        assert stop.value.value == -1
+
+    def test_session_yields_during_long_fight(self, generator):
+        """С fight_pause сессия сервера отдает бой частями, а в журнал попадают только ответы игрока"""
+        stream = io.StringIO()
+        session = GameSession(1, generator, journal=SessionJournal(stream), fight_pause=1)
+        session.start()
+        pauses = 0
+        while not session.finished:
+            text = session.answer("1")
+            while session.fighting:
+                pauses += 1
+                assert not text.endswith(">> ")
+                text = session.resume()
+
+        assert pauses > 0
+        prompts = [prompt for prompt, _ in read_journal(stream.getvalue().splitlines())[0].answers]
+        assert prompts and FIGHT_TURN not in prompts
+
+    def test_finished_session_compute_label(self, generator):
+        """Последний шаг сессии попадает в задержки с меткой finished, а не с вопросом None"""
+        metrics = Metrics()
+        session = GameSession(1, generator, metrics=metrics)
+        session.start()
+        session.answer("1")
+        session.answer("2")
+
+        series = metrics.snapshot()["histograms"]
+        assert session.finished
+        assert 'dungeon_compute_seconds{prompt="finished"}' in series
+        assert not any('prompt="None"' in name for name in series)
+
+
+class TestGroupFight:
+    """Тесты боя героя с отрядом"""
+
+    @staticmethod
+    def _group(*stacks):
+        """stacks — пары (здоровье, число врагов)"""
+        templates = []
+        for health, count in stacks:
+            enemy = Enemy("Зомби", "зомби", health, "Зомби упокоен")
+            enemy.weapon = Weapon("Когти", "когти", 8, 0.5)
+            enemy.armor = Armor("Лохмотья", "лохмотья", 2)
+            templates.append((enemy, count))
+        return EnemyGroup(templates)
+
+    def test_group_health(self):
+        """Здоровье отряда — сумма живых, удар по переднему врагу убивает его и открывает следующего"""
+        group = self._group((10, 3), (20, 1))
+
+        assert group.size == group.alive == 4
+        assert group.max_health == group.current_health == 50
+        assert group.name == "Зомби ×3, Зомби ×1"
+        assert group.hit_target(0, 4) is False
+        assert group.current_health == 46
+        assert group.hit_target(0, 6) is True
+        assert (group.alive, group.current_health, group.target()) == (3, 40, 0)
+
+        group.current_health = 0
+        assert group.alive == 0 and group.target() is None
+        assert group.current_health == 0
+
+    def test_group_health_writes(self):
+        """Здоровье отряда можно восстановить до полного, частичная запись — ошибка"""
+        group = self._group((10, 3), (20, 1))
+        group.hit_target(0, 10)
+
+        with pytest.raises(ValueError):
+            group.current_health = 45
+        assert group.current_health == 40
+
+        group.current_health = group.max_health
+        assert (group.alive, group.current_health) == (4, 50)
+        group.current_health = 0
+        group.current_health = 0
+        assert group.alive == 0
+
+    def test_create_enemy_group(self, generator):
+        """Отряд повторяется при том же seed, а стопки в сумме дают его размер"""
+        groups = [generator.create_enemy_group(500, SessionRandom(4)) for _ in range(2)]
+
+        assert groups[0].size == 500
+        assert len(groups[0].templates) == len(set(
+            (enemy.name, enemy.weapon.name, enemy.armor.name) for enemy in groups[0].templates
+        ))
+        assert groups[0].counts.tolist() == groups[1].counts.tolist()
+        assert [enemy.name for enemy in groups[0].templates] == [enemy.name for enemy in groups[1].templates]
+
+    def test_seeded_fight_repeats(self):
+        """Бой с отрядом при том же seed повторяется ход в ход"""
+        results = []
+        for _ in range(2):
+            hero, _ = TestFightSteps._pair()
+            events = []
+            steps = group_fight_steps(hero, self._group((15, 4), (25, 2)), NullOutput(), SessionRandom(9))
+            with pytest.raises(StopIteration) as stop:
+                while True:
+                    events.append(next(steps))
+            results.append((stop.value.value, events))
+
+        assert results[0] == results[1]
+        assert [event.attacker for event in results[0][1][:2]] == ["hero", "group"]
+
+    def test_volley_matches_hit_chance(self):
+        """Число попаданий залпа в среднем равно численности отряда, умноженной на шанс попадания"""
+        import numpy as np
+
+        group = self._group((10, 1000))
+        generator = np.random.default_rng(1)
+        hits = [group.volley(0, generator)[0] for _ in range(200)]
+
+        assert abs(sum(hits) / len(hits) / 1000 - group.chance[0]) < 0.01
+        assert group.volley(8, generator) == (0, 0)
+
+    def test_group_room(self, generator):
+        """С group_size в комнате стоит отряд, победа над ним сохраняется в снимке"""
+        metrics = Metrics()
+        generator.metrics = metrics
+        controller = DungeonController(generator, NullOutput(), rng=SessionRandom(3), group_size=(3, 3))
+        controller.hero = hero = generator.create_player("hero1")
+        weapon, hero.weapon = hero.weapon, Weapon("Молот", "молот", 500, 1.0)
+        controller.dungeon_map = ["St", "E", "Ex"]
+        controller._reset_rooms(1)
+
+        steps = controller.dungeon_room_steps(1, hero)
+        assert next(steps) == "room_enemy"
+        group = controller.enemies_in_rooms[1]
+        assert isinstance(group, EnemyGroup) and group.size == 3
+        assert steps.send("1") == "room_cleared"
+        assert group.alive == 0
+        assert metrics.snapshot()["counters"]['dungeon_spawns_total{kind="enemy"}'] == 3
+
+        hero.weapon = weapon
+        restored = DungeonController(generator, group_size=(3, 3)).load_snapshot(controller.save_snapshot())
+        assert 1 in restored.defeated_rooms
+
+
 class TestEmptyRooms:
     """Тесты взаимодействия с пустыми комнатами"""
 
@@ -208,6 +431,35 @@ class TestEnemyRooms:
 class TestMainMenu:
     """Тесты взаимодействия с главным меню подземелья"""
 
+    def test_script_runs_in_main_module(self):
+        """python main.py играет в уже загруженном модуле main, а не во второй копии файла под именем __main__"""
+        import runpy
+        import main
+
+        with patch.object(main, "cli", return_value=0) as cli, patch.object(sys, "argv", ["main.py", "--seed", "1"]):
+            with pytest.raises(SystemExit) as exit:
+                runpy.run_path(main.__file__, run_name="__main__")
+
+        cli.assert_called_once_with(["--seed", "1"])
+        assert exit.value.code == 0
+
+    def test_cli_closes_journal(self, tmp_path, monkeypatch):
+        """Файл журнала закрывается, даже если игра упала"""
+        import main
+
+        monkeypatch.chdir(os.path.dirname(main.__file__))
+        journals = []
+
+        def start_game(controller):
+            journals.append(controller.journal)
+            raise RuntimeError("игра упала")
+
+        with patch.object(DungeonController, "start_game", start_game):
+            with pytest.raises(RuntimeError):
+                main.cli(["--seed", "1", "--journal", str(tmp_path / "journal.jsonl"), "--render", "plain"])
+
+        assert journals[0].stream.closed
+
     def test_pass_dungeon_choice(self, controller, test_hero, capsys):
         """Игрок проходит мимо подземелья"""
         with patch('builtins.input', return_value='2'):  # "Пройти мимо"
@@ -258,3 +510,965 @@ class TestMainMenu:
         captured = capsys.readouterr()
 
         assert "Номер персонажа вне диапазона!" in captured.out
+
+
+class TestOutputSinks:
+    """Тесты подключаемого вывода контроллера"""
+
+    def test_null_output_is_silent(self, hero_with_equipment, enemy_with_equipment, capsys):
+        """Бой с пустым выводом ничего не печатает"""
+        hero_with_equipment.weapon.success_probability = 1.0
+
+        result = DungeonController.auto_fight(hero_with_equipment, enemy_with_equipment, NullOutput())
+
+        assert result is True
+        assert capsys.readouterr().out == ""
+
+    def test_buffered_output_matches_console(self, generator, test_hero, capsys):
+        """Буферизованный вывод дает тот же текст, что и консольный"""
+        results = []
+        for output in (None, BufferedOutput()):
+            controller = DungeonController(generator, output)
+            controller.dungeon_map = ['St', '', 'Ex']
+            controller.room_descriptions = [None, "пустая комната", None]
+            controller.enemies_in_rooms = [None, None, None]
+            with patch('builtins.input', return_value='1'):
+                controller.process_dungeon_room(1, test_hero)
+            results.append(capsys.readouterr().out)
+
+        assert results[0] == results[1]
+        assert "пустая комната" in results[1]
+
+    def test_buffered_output_writes_once_per_prompt(self, hero_with_equipment, enemy_with_equipment):
+        """Буферизованный вывод пишет в поток только при сбросе"""
+        stream = io.StringIO()
+        output = BufferedOutput(stream)
+
+        DungeonController.auto_fight(hero_with_equipment, enemy_with_equipment, output)
+        assert stream.getvalue() == ""
+
+        output.flush()
+        assert "Завязался бой" in stream.getvalue()
+
+    def test_structured_output_records_message_ids(self, hero_with_equipment, enemy_with_equipment):
+        """Структурный вывод сохраняет идентификаторы и параметры сообщений"""
+        hero_with_equipment.weapon.success_probability = 1.0
+        enemy_with_equipment.current_health = 10
+        output = StructuredOutput()
+
+        DungeonController.auto_fight(hero_with_equipment, enemy_with_equipment, output)
+
+        message_ids = [message_id for message_id, _ in output.events]
+        assert message_ids[0] == "health_bar"
+        assert "fight_start" in message_ids
+        assert ("hero_hit", {"damage": 12, "name": enemy_with_equipment.name}) in output.events
+        assert render_message("hero_hit", {"damage": 12, "name": "Враг"}) == \
+            "Удар пришелся точно в цель! Вы нанесли 12 урона по цели \"Враг\""
+
+
+class TestGameServer:
+    """Тесты многопользовательского сервера"""
+
+    @staticmethod
+    async def _read_until_prompt(reader):
+        data = b""
+        while not data.endswith(b">> "):
+            chunk = await reader.read(4096)
+            if not chunk:
+                break
+            data += chunk
+        return data.decode("utf-8")
+
+    def test_sessions_are_independent(self, generator):
+        """Две сессии идут одновременно и не мешают друг другу"""
+        async def scenario():
+            server = GameServer(generator)
+            await server.start(port=0)
+            first = await asyncio.open_connection("127.0.0.1", server.port)
+            second = await asyncio.open_connection("127.0.0.1", server.port)
+            assert "Выберите одного из персонажей" in await self._read_until_prompt(first[0])
+            assert "Выберите одного из персонажей" in await self._read_until_prompt(second[0])
+            assert len(server.sessions) == 2
+
+            second[1].write(b"2\n")
+            text = await self._read_until_prompt(second[0])
+            assert "Тестовый герой Два" in text
+
+            first[1].write(b"1\n2\n")
+            text = (await first[0].read()).decode("utf-8")
+            assert "Тестовый герой Один" in text
+            assert "Выходим из игры" in text
+
+            second[1].close()
+            await server.stop()
+
+        asyncio.run(scenario())
+
+    def test_idle_session_is_evicted(self, generator):
+        """Бездействующая сессия закрывается по таймауту"""
+        async def scenario():
+            server = GameServer(generator, idle_timeout=0.05)
+            await server.start(port=0)
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            text = (await reader.read()).decode("utf-8")
+            await asyncio.sleep(0)
+
+            assert "бездействия" in text
+            assert server.evicted == 1
+            assert server.sessions == {}
+            writer.close()
+            await server.stop()
+
+        asyncio.run(scenario())
+
+    def test_journal_written_outside_loop(self, generator, tmp_path):
+        """Сессии пишут журнал в память, а в файл он уходит пачкой из пула потоков"""
+        path = tmp_path / "journal.jsonl"
+
+        async def scenario(file):
+            journal = JournalBuffer()
+            server = GameServer(generator, journal_file=journal)
+            await server.start(port=0)
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            writer.write(b"1\n2\n")
+            await reader.read()
+            assert journal.parts and path.read_text(encoding="utf-8") == ""
+            flusher = asyncio.get_running_loop().create_task(flush_journal(journal, file, 0.01))
+            await asyncio.sleep(0.1)
+            flusher.cancel()
+            writer.close()
+            await server.stop()
+
+        with open(path, "a", encoding="utf-8") as file:
+            asyncio.run(scenario(file))
+        sessions = read_journal(path.read_text(encoding="utf-8").splitlines())
+
+        assert [answer for _, answer in sessions[0].answers] == ["1", "2"]
+
+
+class TestSessionSnapshot:
+    """Тесты двоичных снимков сессии"""
+
+    @staticmethod
+    def _session_in_dungeon(controller):
+        controller.hero = controller.generator.create_player("hero1")
+        controller.dungeon_map = ['St', '', 'E', '', 'Ex']
+        controller.room_descriptions = [None] * 5
+        controller._room_description(1)
+        enemy = controller.generator.create_enemy("enemy2")
+        enemy.current_health = 7
+        controller.enemies_in_rooms = [None, None, enemy, None, None]
+        controller.hero.current_health = 42
+        controller.position = 2
+        return controller
+
+    def test_snapshot_round_trip(self, generator):
+        """Состояние сессии восстанавливается из снимка полностью"""
+        source = self._session_in_dungeon(DungeonController(generator))
+        data = source.save_snapshot()
+
+        restored = DungeonController(generator).load_snapshot(data)
+
+        assert isinstance(data, bytes)
+        assert "Тестовая комната".encode("utf-8") not in data
+        assert restored.dungeon_map == source.dungeon_map
+        assert [restored.room_descriptions[i] for i in range(5)] == source.room_descriptions
+        assert restored.position == 2
+        assert restored.hero.name == source.hero.name
+        assert restored.hero.current_health == 42
+        assert restored.hero.weapon is source.hero.weapon
+        enemy = restored.enemies_in_rooms[2]
+        assert enemy.key == "enemy2"
+        assert enemy.current_health == 7
+        assert enemy.armor is source.enemies_in_rooms[2].armor
+
+    def test_restored_session_resumes_in_same_room(self, generator, capsys):
+        """Восстановленная игра продолжается с той же комнаты"""
+        source = self._session_in_dungeon(DungeonController(generator))
+        controller = DungeonController(generator).load_snapshot(source.save_snapshot())
+
+        with patch('builtins.input', side_effect=['2', '2', '1', '1', '1', '1', '1']), \
+                patch('main.randint', return_value=0):
+            controller.start_game()
+
+        output = capsys.readouterr().out
+        assert "Враг Два" in output
+        assert output.index("Враг Два") < output.index(source.room_descriptions[1])
+
+    def test_snapshot_into_pool(self, generator):
+        """Враги из снимка попадают в пул контроллера"""
+        data = self._session_in_dungeon(DungeonController(generator)).save_snapshot()
+        pool = EntityPool()
+
+        controller = DungeonController(generator, pool=pool).load_snapshot(data)
+
+        assert len(pool) == 2
+        assert controller.enemies_in_rooms[2].current_health == 7
+
+        controller.load_snapshot(data)
+        assert len(pool) == 2
+
+    def test_invalid_snapshot_rejected(self, generator):
+        """Чужие данные не принимаются за снимок"""
+        with pytest.raises(ValueError):
+            DungeonController(generator).load_snapshot(b"not a snapshot at all")
+
+
+class TestSessionRandom:
+    """Тесты потоков случайных чисел сессии"""
+
+    @staticmethod
+    def _transcript(generator, rng):
+        output = StructuredOutput()
+        controller = DungeonController(generator, output, rng=rng)
+        with patch('builtins.input', side_effect=['1', '1'] + ['1'] * 50):
+            try:
+                controller.start_game()
+            except StopIteration:
+                pass
+        return output.events
+
+    def test_same_seed_same_game(self, generator):
+        """Одинаковый seed дает одинаковую игру"""
+        first = self._transcript(generator, SessionRandom(42))
+        second = self._transcript(generator, SessionRandom(42))
+
+        assert first == second
+
+    def test_substreams_are_independent(self):
+        """Подпотоки с разными путями дают разные последовательности и не зависят от порядка"""
+        root = SessionRandom(7)
+        a = [root.substream(1).random() for _ in range(3)]
+        b = root.substream(2).random()
+        again = SessionRandom(7).substream(1).random()
+
+        assert a[0] == a[1] == a[2] == again
+        assert a[0] != b
+
+    def test_hit_roll_range(self):
+        """Броски попадания лежат в диапазоне randint(0, 100)"""
+        rng = SessionRandom(1)
+        rolls = [rng.hit_roll() for _ in range(5000)]
+
+        assert min(rolls) == 0
+        assert max(rolls) == 100
+
+    def test_session_generator_shares_data(self, generator):
+        """Сессия со своим потоком использует общие данные генератора"""
+        controller = DungeonController(generator, rng=SessionRandom(3))
+
+        assert controller.generator is not generator
+        assert controller.generator.catalog is generator.catalog
+        assert generator.rng is random
+
+    def test_plain_random_rng(self, generator):
+        """Бой идет и с обычным random.Random, а журнал без SessionRandom отклоняется сразу"""
+        controller = DungeonController(generator, NullOutput(), rng=random.Random(1))
+        hero = generator.create_player("hero1")
+        enemy = generator.create_enemy("enemy2")
+
+        assert controller.auto_fight(hero, enemy, NullOutput(), controller.rng) in (True, False)
+        hero = generator.create_player("hero1")
+        group = generator.create_enemy_group(3, random.Random(2))
+        assert DungeonController.run_fight(group_fight_steps(hero, group, NullOutput(), random.Random(3))) \
+            in (True, False)
+        with pytest.raises(TypeError):
+            DungeonController(generator, rng=random.Random(1), journal=SessionJournal(io.StringIO()))
+
+
+class TestSessionJournal:
+    """Тесты журнала ответов и воспроизведения"""
+
+    @staticmethod
+    def _record(generator, answers, stream, **settings):
+        journal = SessionJournal(stream)
+        controller = DungeonController(generator, NullOutput(), journal=journal, **settings)
+        with patch('builtins.input', side_effect=answers):
+            try:
+                controller.start_game()
+            except StopIteration:
+                pass
+        return controller
+
+    def test_journal_records_seed_and_answers(self, generator):
+        """В журнал попадают seed сессии и каждый ответ с его вопросом"""
+        stream = io.StringIO()
+        controller = self._record(generator, ['abc', '1', '2'], stream)
+
+        sessions = read_journal(stream.getvalue().splitlines())
+
+        assert len(sessions) == 1
+        assert sessions[0].seed == controller.rng.root_seed
+        assert sessions[0].answers == [("hero_menu", "abc"), ("hero_menu", "1"), ("dungeon_approach", "2")]
+
+    def test_replay_reproduces_session(self, generator):
+        """Воспроизведение проходит игру так же, как она была сыграна"""
+        stream = io.StringIO()
+        answers = ['2', '1', '1'] + ['1', '1', '2', '1', '1'] * 10
+        played = [self._record(generator, answers, stream) for _ in range(5)]
+
+        results = replay_journal(generator, stream.getvalue().splitlines())
+
+        assert len(results) == 5
+        for controller, result in zip(played, results):
+            assert result.divergence is None
+            assert result.exit_game == controller.exit_game
+            assert result.hero_alive == (controller.hero.current_health > 0)
+
+    def test_replay_reports_divergence(self, generator):
+        """Если игра пошла иначе, воспроизведение сообщает, где именно"""
+        stream = io.StringIO()
+        self._record(generator, ['1', '2'], stream)
+        lines = stream.getvalue().splitlines()
+        lines[-1] = lines[-1].replace("dungeon_approach", "room_exit")
+
+        result = replay_journal(generator, lines)[0]
+
+        assert result.divergence == (1, "room_exit", "dungeon_approach")
+
+    def test_replay_of_stalled_fight(self, game_data, tmp_path):
+        """Бой, остановленный пределом ходов, при повторе останавливается так же, а не идет вечно"""
+        game_data["weapons"]["weapon1"]["damage"] = 1
+        path = tmp_path / "stalemate.json"
+        path.write_text(json.dumps(game_data, ensure_ascii=False), encoding="utf-8")
+        generator = DungeonGenerator(str(path))
+        stream = io.StringIO()
+        self._record(generator, ['1'] * 30, stream, max_fight_turns=40)
+        lines = stream.getvalue().splitlines()
+
+        session = read_journal(lines)[0]
+        prompts = [prompt for prompt, _ in session.answers]
+        assert session.settings["max_fight_turns"] == 40
+        assert "room_enemy" in prompts and "room_cleared" not in prompts
+        result = replay_journal(generator, lines)[0]
+        assert result.divergence is None
+        assert result.answers_used == len(session.answers)
+
+    def test_replay_uses_recorded_settings(self, generator):
+        """Сессия в решетке с отрядами и бюджетом комнат повторяется с теми же настройками"""
+        stream = io.StringIO()
+        self._record(generator, ['1'] * 60, stream, grid_size=(6, 6), room_budget=4, group_size=(2, 3))
+        lines = stream.getvalue().splitlines()
+
+        session = read_journal(lines)[0]
+        assert session.settings == {"grid_size": (6, 6), "room_budget": 4, "max_fight_turns": None,
+                                    "group_size": (2, 3)}
+        result = replay_journal(generator, lines)[0]
+        assert result.divergence is None
+        assert result.answers_used == len(session.answers)
+
+        start = json.loads(lines[0])
+        del start["settings"]
+        lines[0] = json.dumps(start)
+        assert replay_journal(generator, lines)[0].divergence is not None
+
+
+class TestBatchMode:
+    """Тесты пакетного режима"""
+
+    class CountingStream(io.StringIO):
+        writes = 0
+
+        def write(self, text):
+            self.writes += 1
+            return super().write(text)
+
+    def test_batch_runs_sessions_in_order(self, generator):
+        """Сессии идут по порядку, итоги пишутся пачками, ошибочные строки не останавливают пакет"""
+        lines = [json.dumps({"answers": ["1", "2"]}) for _ in range(5)]
+        lines.insert(2, "не json")
+        lines.append(json.dumps({"id": "short", "answers": ["1"]}))
+        output = self.CountingStream()
+
+        sessions, errors = run_batch(generator, lines, output, seed=7, flush_every=4)
+
+        results = [json.loads(line) for line in output.getvalue().splitlines()]
+        assert (sessions, errors) == (6, 1)
+        assert output.writes == 2
+        assert results[2] == {"line": 3, "error": "Expecting value: line 1 column 1 (char 0)"}
+        assert [result["id"] for result in results if "id" in result] == [1, 2, 4, 5, 6, "short"]
+        assert all(result["finished"] and result["exit_game"] for result in results[:-1] if "id" in result)
+        assert results[-1]["finished"] is False
+        assert results[-1]["waiting"] == "dungeon_approach"
+
+    def test_batch_is_reproducible(self, generator):
+        """С тем же seed пакет дает те же итоги, а записанный seed воспроизводит сессию отдельно"""
+        lines = [json.dumps({"answers": ["1"] * 40}) for _ in range(20)]
+        first, second = io.StringIO(), io.StringIO()
+
+        run_batch(generator, lines, first, seed=11)
+        run_batch(generator, lines, second, seed=11)
+
+        assert first.getvalue() == second.getvalue()
+        result = json.loads(first.getvalue().splitlines()[3])
+        single = io.StringIO()
+        run_batch(generator, [json.dumps({"seed": result["seed"], "stream": result["stream"],
+                                          "answers": ["1"] * 40})], single)
+        assert {**json.loads(single.getvalue()), "id": 4} == result
+
+    def test_batch_transcript(self, generator):
+        """С transcript в итог попадает текст, который увидел бы игрок"""
+        output = io.StringIO()
+        run_batch(generator, [json.dumps({"answers": ["1", "2"]})], output, seed=1, transcript=True)
+
+        transcript = json.loads(output.getvalue())["transcript"]
+        assert "Выберите одного из персонажей:" in transcript
+        assert "Выходим из игры" in transcript
+
+
+class TestAutoplay:
+    """Тесты автоигры ботами"""
+
+    def test_advance_is_reproducible(self, generator):
+        """С тем же seed прогон повторяется, исходы покрывают все игры"""
+        first = autoplay(generator, AlwaysAdvance(), 50, seed=3)
+        second = autoplay(generator, AlwaysAdvance(), 50, seed=3)
+
+        assert first.outcomes == second.outcomes
+        assert sum(first.outcomes.values()) == first.games == 50
+        assert set(first.outcomes) <= {"cleared", "died"}
+        assert first.rooms >= 50 and first.games_per_second > 0
+
+    def test_quitter_leaves_on_bad_odds(self, generator):
+        """Осторожный бот бросает игру вместо боя, если шанс победы ниже порога"""
+        report = autoplay(generator, QuitOnBadOdds(min_odds=1.0), 20, seed=1)
+
+        assert report.outcomes == {"quit": 20}
+
+    def test_cautious_routes_around_on_grid(self, generator):
+        """В решетке осторожный бот отступает от врага и обходит его, а в коридоре бросает игру"""
+        controller = BotController(generator, RetreatOnBadOdds(min_odds=1.0), rng=SessionRandom(1),
+                                   grid_size=(8, 8))
+
+        assert controller.play() == "cleared"
+        assert controller.avoided
+        # до выхода бот дошел, не тронув ни одного врага, от которого отступил
+        assert all(controller.enemies_in_rooms[room].current_health > 0 for room in controller.avoided)
+        assert autoplay(generator, RetreatOnBadOdds(min_odds=1.0), 20, seed=1).outcomes == {"quit": 20}
+
+    def test_group_rooms_rejected(self, generator):
+        """Автоигра сразу отказывается от комнат с отрядами, а не падает посреди игры"""
+        with pytest.raises(ValueError):
+            BotController(generator, QuitOnBadOdds(), group_size=(2, 4))
+
+    def test_unwinnable_fight_is_stuck(self, game_data):
+        """Бой, где никто не пробивает броню, заканчивает игру исходом stuck, а не зависанием"""
+        game_data["weapons"]["weapon1"]["damage"] = 3
+        generator = DungeonGenerator.from_data(game_data)
+
+        controller = BotController(generator, AlwaysAdvance(), rng=SessionRandom(5))
+
+        assert controller.play() == "stuck"
+
+    def test_random_policy_on_grid(self, generator):
+        """Случайный бот в решетке всегда завершает игру: либо исходом, либо по пределу ответов"""
+        report = autoplay(generator, RandomPolicy(rng=random.Random(2)), 30, seed=2, grid_size=(8, 8),
+                          max_answers=300)
+
+        assert report.games == 30
+        assert report.answers <= 30 * 300
+        assert set(report.outcomes) <= {"cleared", "died", "passed", "stuck"}
+
+
+class VirtualTerminal:
+    """Минимальный терминал: текст, перевод строки и последовательности, которые использует FrameOutput"""
+
+    def __init__(self):
+        self.lines = [[]]
+        self.row = self.col = 0
+        self.style = ""
+
+    def feed(self, text):
+        import re
+        for token in re.findall(r"\x1b\[(\d*)([ABGKMm])|(\n)|(\r)|(.)", text, re.S):
+            number, command, newline, carriage, char = token
+            if newline:
+                self.row += 1
+                self.col = 0
+            elif carriage:
+                self.col = 0
+            elif char:
+                line = self._line()
+                line.extend([(" ", "")] * (self.col + 1 - len(line)))
+                line[self.col] = (char, self.style)
+                self.col += 1
+            elif command == "A":
+                self.row -= int(number)
+            elif command == "B":
+                self.row += int(number)
+            elif command == "G":
+                self.col = int(number) - 1
+            elif command == "K":
+                del self._line()[self.col:]
+            elif command == "M":
+                for _ in range(int(number)):
+                    self._line()
+                    del self.lines[self.row]
+                    self.lines.append([])
+            elif command == "m":
+                self.style = "" if number == "0" else f"\x1b[{number}m"
+
+    def _line(self):
+        while len(self.lines) <= self.row:
+            self.lines.append([])
+        return self.lines[self.row]
+
+
+class TestFrameOutput:
+    """Тесты покадрового вывода боя"""
+
+    @staticmethod
+    def _fight(generator, output, seed):
+        rng = SessionRandom(seed)
+        hero = generator.create_player("hero1")
+        enemy = generator.create_enemy("enemy1")
+        DungeonController.auto_fight(hero, enemy, output, rng)
+        output.emit("room_cleared")
+        output.flush()
+
+    @pytest.mark.parametrize("seed", range(5))
+    def test_diffs_reproduce_full_frame(self, generator, seed):
+        """Разностные кадры на экране дают то же, что полная отрисовка последнего кадра"""
+        stream = io.StringIO()
+        output = FrameOutput(stream, log_lines=3)
+        self._fight(generator, output, seed)
+
+        terminal = VirtualTerminal()
+        terminal.feed(stream.getvalue())
+        final = output.render()
+        text = ["".join(char for char, _ in line) for line in terminal.lines]
+        separator = text.index(render_message("separator", {}))
+
+        assert output.frames > 1
+        assert terminal.lines[separator - len(final):separator] == final
+        assert text[separator + 1:separator + 3] == render_message("room_cleared", {}).splitlines()
+
+    def test_frame_rate_cap_merges_turns(self, generator):
+        """С ограничением частоты ходы без паузы сливаются в последний кадр, а вывод меньше построчного"""
+        capped, uncapped, plain = io.StringIO(), io.StringIO(), io.StringIO()
+        output = FrameOutput(capped, max_fps=10, clock=lambda: 0.0)
+
+        self._fight(generator, output, 1)
+        self._fight(generator, FrameOutput(uncapped), 1)
+        self._fight(generator, BufferedOutput(plain), 1)
+
+        # первый кадр открывает область боя, остальные ходы попадают в последний
+        assert output.frames == 2
+        assert len(capped.getvalue()) < len(uncapped.getvalue()) < len(plain.getvalue())
+
+    def test_text_outside_fight_is_plain(self):
+        """Вне боя сообщения выводятся обычным текстом без управляющих последовательностей"""
+        stream = io.StringIO()
+        output = FrameOutput(stream)
+        output.emit("exit_game")
+        output.flush()
+
+        assert stream.getvalue() == "Выходим из игры\n"
+
+
+class TestGridDungeon:
+    """Тесты больших подземелий-решеток"""
+
+    def test_chunks_are_deterministic(self):
+        """Выгруженный чанк генерируется заново точно таким же"""
+        dungeon = GridDungeon(1000, 1000, seed=5, max_chunks=1)
+        first = [dungeon[room] for room in range(0, 1000 * 64, 1000)]
+        dungeon.visit(999_999)
+        second = [dungeon[room] for room in range(0, 1000 * 64, 1000)]
+
+        assert first == second
+        assert dungeon[dungeon.start] == "St"
+        assert dungeon[dungeon.exit] == "Ex"
+        assert dungeon.unloaded > 0
+
+    def test_neighbors_and_exit_direction(self):
+        """Соседи считаются по координатам, направление ведет к выходу"""
+        dungeon = GridDungeon(10, 10, seed=1)
+
+        assert dungeon.neighbors(0) == [("south", 10), ("east", 1)]
+        assert len(dungeon.neighbors(55)) == 4
+        assert dungeon.direction_to_exit(dungeon.exit) is None
+
+    def test_walk_to_exit_keeps_memory_flat(self, generator):
+        """Герой доходит до выхода огромного подземелья, загружено лишь несколько чанков"""
+        controller = DungeonController(generator, NullOutput(), grid_size=(1000, 1000))
+        steps = controller.game_steps()
+        max_chunks = 0
+        with patch('main.randint', return_value=0):
+            prompt = next(steps)
+            try:
+                while True:
+                    answer = "1"
+                    if prompt == "room_directions":
+                        dungeon = controller.dungeon_map
+                        max_chunks = max(max_chunks, len(dungeon.chunks))
+                        direction = dungeon.direction_to_exit(controller.position)
+                        names = [name for name, _ in dungeon.neighbors(controller.position)]
+                        answer = str(names.index(direction) + 1)
+                    prompt = steps.send(answer)
+            except StopIteration:
+                pass
+
+        assert controller.exit_game is True
+        assert controller.hero.current_health > 0
+        assert max_chunks <= (2 * GridDungeon(1, 2, 0).unload_radius + 1) ** 2
+        assert len(controller.room_descriptions) + len(controller.enemies_in_rooms) <= 2000
+
+
+class TestRoomCache:
+    """Тесты ограниченного кеша состояния комнат"""
+
+    @staticmethod
+    def _controller(generator, room_budget):
+        controller = DungeonController(generator, NullOutput(), rng=SessionRandom(3), room_budget=room_budget)
+        controller.hero = controller.generator.create_player("hero1")
+        controller.dungeon_map = ['St', '', '', 'E', 'E', 'Ex']
+        controller._reset_rooms()
+        return controller
+
+    @staticmethod
+    def _enter(controller, room):
+        steps = controller.dungeon_room_steps(room, controller.hero)
+        prompt = next(steps)
+        steps.close()
+        return prompt
+
+    def test_evicted_room_regenerates_identically(self, generator):
+        """Вытесненная комната при повторном посещении получает то же описание"""
+        controller = self._controller(generator, room_budget=1)
+        self._enter(controller, 1)
+        description = controller.room_descriptions[1]
+        self._enter(controller, 2)
+
+        assert 1 not in controller.room_descriptions
+        self._enter(controller, 1)
+        assert controller.room_descriptions[1] == description
+        assert len(controller.room_descriptions) == 1
+
+    def test_rooms_bounded_by_default(self, generator):
+        """Без room_budget кеш комнат все равно ограничен, а убитые комнаты хранятся битами"""
+        controller = DungeonController(generator, NullOutput())
+        controller._reset_rooms()
+        defeated = controller.defeated_rooms
+        for room in (5, 0, 1_000_000, 5):
+            defeated.add(room)
+
+        assert controller.enemies_in_rooms.capacity == RoomCache.DEFAULT_CAPACITY
+        assert len(defeated) == 3 and 1_000_000 in defeated and 6 not in defeated
+        assert list(defeated) == [0, 5, 1_000_000]
+        assert sys.getsizeof(defeated._bits) < 200_000
+
+    def test_defeated_enemy_stays_dead_after_eviction(self, generator):
+        """Убитый враг не оживает, когда его комната вытеснена и создана заново"""
+        pool = EntityPool()
+        controller = self._controller(generator, room_budget=1)
+        controller.pool = pool
+        self._enter(controller, 3)
+        enemy = controller.enemies_in_rooms[3]
+        enemy.current_health = 0
+        self._enter(controller, 4)
+
+        assert set(controller.defeated_rooms) == {3}
+        assert len(pool) == 1
+        assert self._enter(controller, 3) == "room_enemy_dead"
+        assert controller.enemies_in_rooms[3].name == enemy.name
+
+    def test_cache_stats(self, generator):
+        """Кеш считает попадания, промахи и вытеснения"""
+        controller = self._controller(generator, room_budget=1)
+        for room in (1, 1, 2, 1):
+            self._enter(controller, room)
+
+        stats = controller.room_cache_stats()["descriptions"]
+        assert stats["capacity"] == 1
+        assert stats["hits"] == 1
+        assert stats["misses"] == 3
+        assert stats["evictions"] == 2
+
+
+class TestContentReload:
+    """Тесты перезагрузки игровых данных на ходу"""
+
+    @staticmethod
+    def _rewrite(json_file, data):
+        with open(json_file, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        stat = os.stat(json_file)
+        os.utime(json_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    def test_reload_keeps_spawned_enemies(self, generator, mock_json_file, game_data):
+        """Новые враги берутся из новой версии, уже созданные остаются прежними"""
+        session = generator.with_rng(SessionRandom(1))
+        old_enemy = session.create_enemy("enemy1")
+
+        game_data["enemies"]["enemy1"]["name"] = "Враг Один Обновленный"
+        self._rewrite(mock_json_file, game_data)
+
+        assert generator.reload_if_changed() is True
+        assert generator.reload_if_changed() is False
+        assert old_enemy.name == "Враг Один"
+        assert session.create_enemy("enemy1").name == "Враг Один Обновленный"
+        stats = generator.content.stats()
+        assert stats["version"] == 2
+        assert stats["reloads"] == 1
+
+    def test_reload_builds_alias_tables(self, generator, mock_json_file, game_data):
+        """Таблицы выбора новой версии строятся при перезагрузке, до первого врага"""
+        game_data["enemies"]["enemy1"]["weight"] = [1, 0, 2]
+        self._rewrite(mock_json_file, game_data)
+
+        assert generator.reload() is True
+        assert sorted(generator.catalog.alias_tables) == [
+            ("armor", 0), ("enemies", 0), ("enemies", 1), ("enemies", 2), ("weapons", 0),
+        ]
+
+    def test_snapshot_after_reload(self, generator, mock_json_file, game_data):
+        """Сессия, начатая до перезагрузки данных, сохраняется в снимок и после нее"""
+        controller = DungeonController(generator, NullOutput(), rng=SessionRandom(1))
+        controller.hero = controller.generator.create_player("hero1")
+        controller.dungeon_map = ["St", "", "E", "", "Ex"]
+        controller.room_descriptions = [None] * 5
+        controller.enemies_in_rooms = [None, None, controller.generator.create_enemy("enemy2"), None, None]
+        assert [controller._room_description(i) for i in (1, 3)] == ["Тестовая комната №3", "Тестовая комната №2"]
+
+        game_data["weapons"]["weapon1"]["damage"] = 25
+        # посещенные комнаты: описания правятся и удаляются
+        game_data["room_definitions"] = [text + " (правка)" for text in game_data["room_definitions"][:2]]
+        self._rewrite(mock_json_file, game_data)
+        assert generator.reload() is True
+
+        restored = DungeonController(generator).load_snapshot(controller.save_snapshot())
+        assert restored.hero.weapon.key == "weapon1"
+        assert restored.hero.weapon.damage == 25
+        assert restored.enemies_in_rooms[2].armor.key == "armor1"
+        assert restored.room_descriptions[3] == "Тестовая комната №2 (правка)"
+        # описания удаленной комнаты нет: она создаст новое при посещении
+        assert restored.room_descriptions[1] is None
+
+    def test_invalid_reload_keeps_old_version(self, generator, mock_json_file, game_data):
+        """Данные с ошибкой не подменяют рабочую версию"""
+        del game_data["armor"]["armor1"]["defense"]
+        self._rewrite(mock_json_file, game_data)
+
+        assert generator.reload_if_changed() is False
+        assert generator.content.version == 1
+        assert generator.content.failed_reloads == 1
+        assert generator.create_player("hero1").armor.defense == 5
+
+    def test_zero_weight_bracket_rejected(self, generator, mock_json_file, game_data):
+        """Диапазон глубин, где у всех врагов нулевой вес, не проходит проверку при перезагрузке"""
+        for record in game_data["enemies"].values():
+            record["weight"] = [1, 0]
+        self._rewrite(mock_json_file, game_data)
+
+        assert generator.reload_if_changed() is False
+        assert "диапазоне глубин 1" in str(generator.content.last_error)
+        assert generator.content.version == 1
+        assert generator.create_enemy_by_id(0, depth=10).key == "enemy1"
+
+    def test_watcher_picks_up_changes(self, generator, mock_json_file, game_data):
+        """Фоновый поток сам замечает изменение файла"""
+        game_data["room_definitions"] = ["Перестроенная комната"]
+        with ContentWatcher(generator, interval=0.01):
+            self._rewrite(mock_json_file, game_data)
+            deadline = time.monotonic() + 5
+            while generator.content.version == 1 and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        assert generator.random_room_definition() == "Перестроенная комната"
+
+
+class TestContentPacks:
+    """Тесты индексированных пакетов данных с дополнениями"""
+
+    @pytest.fixture
+    def packs(self, tmp_path, game_data):
+        from content_pack import write_pack
+
+        base = tmp_path / "base.pack"
+        write_pack(str(base), game_data)
+        overlay = tmp_path / "overlay.pack"
+        write_pack(str(overlay), {
+            "enemies": {
+                "enemy1": dict(game_data["enemies"]["enemy1"], name="Враг Один Усиленный", health=500),
+                "enemy3": dict(game_data["enemies"]["enemy2"], name="Враг Три"),
+            },
+            "room_definitions": ["Комната из дополнения"],
+        })
+        return [str(base), str(overlay)]
+
+    def test_later_pack_overrides_earlier(self, packs):
+        """Запись из дополнения перекрывает базовую, новые записи добавляются"""
+        generator = DungeonGenerator.from_packs(packs)
+
+        enemy = generator.create_enemy("enemy1")
+        assert enemy.name == "Враг Один Усиленный"
+        assert enemy.max_health == 500
+        assert generator.create_enemy("enemy3").name == "Враг Три"
+        assert list(generator.get_enemies()) == ["enemy2", "enemy1", "enemy3"]
+        assert len(generator.catalog.room_definitions) == 4
+
+    def test_random_pick_skips_overridden_records(self, packs):
+        """Случайный выбор не возвращает перекрытые записи и разбирает только выбранное"""
+        generator = DungeonGenerator.from_packs(packs, rng=random.Random(0))
+        catalog = generator.catalog
+
+        ids = {generator.random_enemy_id() for _ in range(200)}
+        assert {catalog.enemy_keys[i] for i in ids} == {"enemy1", "enemy2", "enemy3"}
+        assert catalog.enemy_ids["enemy1"] in ids
+        assert len(ids) == 3
+        assert catalog.enemies.built == {}
+
+    def test_weighted_pick_reads_weight_column(self, tmp_path, game_data):
+        """Веса берутся из колонки пакета: выбор по весам не разбирает ни одной записи"""
+        from content_pack import PackSection, write_pack
+
+        game_data["enemies"]["enemy1"]["weight"] = [3, 0]
+        base = tmp_path / "base.pack"
+        write_pack(str(base), game_data)
+        overlay = tmp_path / "overlay.pack"
+        write_pack(str(overlay), {"enemies": {"enemy2": dict(game_data["enemies"]["enemy2"], weight=2)}})
+        generator = DungeonGenerator.from_packs([str(base), str(overlay)], rng=random.Random(0))
+        catalog = generator.catalog
+
+        with patch.object(PackSection, "record", side_effect=AssertionError("запись разобрана")):
+            assert catalog.weights("enemies") == [3.0, 0.0, 2.0]
+            assert catalog.weights("enemies", depth=10) == [0.0, 0.0, 2.0]
+            picks = {generator.random_enemy_id() for _ in range(100)}
+            keys = list(generator.get_enemies())
+        assert picks == {0, 2}
+        assert keys == ["enemy1", "enemy2"]
+
+    def test_large_pack_snapshot(self, tmp_path, game_data):
+        """Номера описаний комнат больше 65535 сохраняются в снимок"""
+        from content_pack import write_pack
+
+        game_data["room_definitions"] = [f"Комната {i}" for i in range(100_000)]
+        pack = tmp_path / "rooms.pack"
+        write_pack(str(pack), game_data)
+        generator = DungeonGenerator.from_packs([str(pack)], rng=random.Random(1))
+        source = TestSessionSnapshot._session_in_dungeon(DungeonController(generator))
+        for room, index in ((1, 0xFFFF), (3, 99_999)):
+            source.room_descriptions[room] = generator.catalog.room_definitions[index]
+            source.room_description_ids[room] = index
+
+        restored = DungeonController(generator).load_snapshot(source.save_snapshot())
+
+        assert restored.room_descriptions[1] == "Комната 65535"
+        assert restored.room_descriptions[3] == "Комната 99999"
+
+    def test_pack_game_snapshot_round_trip(self, packs):
+        """Игра на пакетах сохраняется в снимок и восстанавливается"""
+        generator = DungeonGenerator.from_packs(packs, rng=random.Random(1))
+        source = TestSessionSnapshot._session_in_dungeon(DungeonController(generator))
+
+        restored = DungeonController(generator).load_snapshot(source.save_snapshot())
+
+        assert restored.room_descriptions[1] is not None
+        assert restored.room_descriptions[1] == source.room_descriptions[1]
+        assert restored.enemies_in_rooms[2].armor is source.enemies_in_rooms[2].armor
+
+
+class TestBalanceSweep:
+    """Тесты подбора баланса по сетке параметров"""
+
+    def test_grid_expansion(self, game_data):
+        """Параметры раскладываются в точки сетки и подставляются во все записи по *"""
+        params = [parse_param("heroes.*.health=6,9"), parse_param("weapons.weapon1.damage=3:5")]
+        grid = expand_grid(params)
+
+        assert len(grid) == 6
+        data = apply_point(game_data, grid[-1])
+        assert [hero["health"] for hero in data["heroes"].values()] == [9, 9]
+        assert data["weapons"]["weapon1"]["damage"] == 5
+        assert game_data["weapons"]["weapon1"]["damage"] == 15
+
+    def test_sweep_resumes_from_output(self, game_data, tmp_path):
+        """Прерванный подбор досчитывает только недостающие блоки и дает тот же итог"""
+        output = tmp_path / "sweep.jsonl"
+        params = [parse_param("heroes.hero2.health=10,80")]
+        _, full = sweep(game_data, params, runs=40, chunk=10, seed=3, workers=2, output=str(output))
+
+        lines = output.read_text(encoding="utf-8").splitlines()
+        output.write_text("\n".join(lines[:5]) + "\n" + lines[5][:10], encoding="utf-8")
+        rerun = []
+        _, resumed = sweep(game_data, params, runs=40, chunk=10, seed=3, workers=1, output=str(output),
+                           on_result=rerun.append)
+
+        assert len(rerun) == len(lines) - 5
+        assert resumed == full
+        assert full[0, "hero2"]["clear_rate"] < full[1, "hero2"]["clear_rate"]
+        assert full[1, "hero1"]["runs"] == 40
+
+    def test_sweep_refuses_other_settings(self, game_data, tmp_path):
+        """Файл результатов не продолжается подбором с другими настройками или данными"""
+        output = tmp_path / "sweep.jsonl"
+        params = [parse_param("heroes.hero2.health=10,80")]
+        sweep(game_data, params, runs=20, chunk=10, seed=3, workers=1, output=str(output))
+        before = output.read_text(encoding="utf-8")
+
+        with pytest.raises(ResumeError):
+            sweep(game_data, params, runs=20, chunk=10, seed=4, workers=1, output=str(output))
+        with pytest.raises(ResumeError):
+            sweep(game_data, params, runs=20, chunk=5, seed=3, workers=1, output=str(output))
+        with pytest.raises(ResumeError):
+            sweep(game_data, [parse_param("heroes.hero2.health=10,90")], runs=20, chunk=10, seed=3,
+                  workers=1, output=str(output))
+        game_data["weapons"]["weapon1"]["damage"] = 1
+        with pytest.raises(ResumeError):
+            sweep(game_data, params, runs=20, chunk=10, seed=3, workers=1, output=str(output))
+        assert output.read_text(encoding="utf-8") == before
+
+
+class TestMetrics:
+    """Тесты метрик и профилирования"""
+
+    def test_game_metrics(self, generator, capsys):
+        """Сыгранная партия оставляет счетчики комнат, боев, созданий и вывода"""
+        metrics = Metrics()
+        generator.metrics = metrics
+        controller = DungeonController(generator, rng=SessionRandom(5), metrics=metrics)
+        with patch('builtins.input', side_effect=['1'] * 60):
+            controller.start_game()
+
+        snapshot = metrics.snapshot()
+        counters = snapshot["counters"]
+        assert counters['dungeon_rooms_entered_total{type="St"}'] >= 1
+        assert counters['dungeon_spawns_total{kind="hero"}'] == 1
+        assert counters["dungeon_output_bytes_total"] == len(capsys.readouterr().out.encode("utf-8"))
+        waits = [name for name in snapshot["histograms"] if name.startswith("dungeon_input_wait_seconds")]
+        assert 'dungeon_input_wait_seconds{prompt="hero_menu"}' in waits
+        fights = sum(value for name, value in counters.items() if name.startswith("dungeon_fights_total"))
+        assert fights == snapshot["histograms"].get("dungeon_fight_turns", {"count": 0})["count"]
+
+    def test_prometheus_text(self, tmp_path):
+        """Экспорт в текстовом формате Prometheus с накопленными корзинами"""
+        metrics = Metrics()
+        metrics.inc("dungeon_fights_total", result="win")
+        metrics.observe("dungeon_fight_turns", 3, (1, 4))
+        metrics.observe("dungeon_fight_turns", 9, (1, 4))
+        path = tmp_path / "dungeon.prom"
+        metrics.write_prometheus(str(path))
+
+        lines = path.read_text(encoding="utf-8").splitlines()
+        assert 'dungeon_fights_total{result="win"} 1' in lines
+        assert "# TYPE dungeon_fight_turns histogram" in lines
+        assert 'dungeon_fight_turns_bucket{le="4"} 1' in lines
+        assert 'dungeon_fight_turns_bucket{le="+Inf"} 2' in lines
+        assert "dungeon_fight_turns_sum 12" in lines
+
+    def test_sampled_session_profile(self, generator, tmp_path):
+        """Выбранная для профилирования сессия сохраняет статистику cProfile"""
+        async def scenario():
+            server = GameServer(generator, metrics=Metrics(), profile_rate=1.0, profile_dir=str(tmp_path))
+            await server.start(port=0)
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            writer.write(b"1\n2\n")
+            await reader.read()
+            writer.close()
+            await server.stop()
+            return server.metrics.snapshot()
+
+        snapshot = asyncio.run(scenario())
+        assert len(list(tmp_path.glob("session-*.prof"))) == 1
+        assert snapshot["counters"]["dungeon_sessions_total"] == 1
@@ -1,7 +1,14 @@
 import pytest
 from main import HealthBarDrawer, DungeonController, DungeonGenerator, Entity, Weapon, Armor, Hero, Enemy
+from main import EntityPool, ContentError
 import json
+import os
+import random
+import sys
 from unittest.mock import mock_open, patch, Mock
+from simulation import simulate_fights, sweep
+from fight_odds import hit_chance, solve_fight
+from alias_table import AliasTable
 
 
 class TestHealthBarDrawer:
@@ -19,27 +26,48 @@ class TestHealthBarDrawer:
         assert isinstance(result, str), "Метод вернул не строку"
         assert "Воин" in result, "Результат должен содержать имя "
         assert f"{current_hp}/{full_hp}" in result, "Результат должен содержать текущее и максимальное здоровье"
-        if current_hp == 0:
-            assert HealthBarDrawer.BAR_LENGTH * f"{HealthBarDrawer.GREEN}_" in result
-        else:
-            assert f"{HealthBarDrawer.GREEN}█" * int(HealthBarDrawer.BAR_LENGTH / (full_hp/current_hp)) in result
+        filled = max(int(HealthBarDrawer.BAR_LENGTH * current_hp / full_hp), 0)
+        assert (f"|{HealthBarDrawer.GREEN}" + "█" * filled
+                + "_" * (HealthBarDrawer.BAR_LENGTH - filled) + f"{HealthBarDrawer.RESET}|") in result
 
     @pytest.mark.parametrize("current_hp, full_hp",
                              [(100, 100),
                               (50, 100),
                               (0, 100),
                               (-50, 100)])
-    def test_draw_health_bar_for_hero_full_health(self, current_hp, full_hp):
-        """Полоска здоровья для героя с полным здоровьем"""
+    def test_draw_health_bar_for_enemy_full_health(self, current_hp, full_hp):
+        """Полоска здоровья для врага"""
         result = HealthBarDrawer.draw_health_bar("enemy", "тестовый враг", current_hp, full_hp)
 
         assert isinstance(result, str), "Метод вернул не строку"
         assert "тестовый враг" in result, "Результат должен содержать имя "
         assert f"{current_hp}/{full_hp}" in result, "Результат должен содержать текущее и максимальное здоровье"
-        if current_hp == 0:
-            assert HealthBarDrawer.BAR_LENGTH * f"{HealthBarDrawer.RED}_" in result
-        else:
-            assert f"{HealthBarDrawer.RED}█" * int(HealthBarDrawer.BAR_LENGTH / (full_hp/current_hp)) in result
+        filled = max(int(HealthBarDrawer.BAR_LENGTH * current_hp / full_hp), 0)
+        assert (f"|{HealthBarDrawer.RED}" + "█" * filled
+                + "_" * (HealthBarDrawer.BAR_LENGTH - filled) + f"{HealthBarDrawer.RESET}|") in result
+
+    def test_draw_health_bar_single_color_escape(self):
+        """Цвет полоски задается одним escape-кодом на всю полоску"""
+        result = HealthBarDrawer.draw_health_bar("hero", "Воин", 50, 100)
+
+        assert result.count(HealthBarDrawer.GREEN) == 1
+        assert result.count(HealthBarDrawer.RESET) == 1
+
+    def test_draw_health_bar_custom_length(self):
+        """Длину полоски можно настроить"""
+        result = HealthBarDrawer.draw_health_bar("enemy", "Враг", 5, 10, bar_length=8)
+
+        assert f"|{HealthBarDrawer.RED}████____{HealthBarDrawer.RESET}|" in result
+
+    def test_render_bar_is_cached(self):
+        """Повторная отрисовка берет полоску из кеша"""
+        HealthBarDrawer.render_bar.cache_clear()
+        HealthBarDrawer.draw_health_bar("hero", "Воин", 7, 10)
+        HealthBarDrawer.draw_health_bar("hero", "Другой воин", 14, 20)
+
+        info = HealthBarDrawer.render_bar.cache_info()
+        assert info.hits == 1
+        assert info.maxsize == HealthBarDrawer.CACHE_SIZE
 
 
 class TestEntities:
@@ -94,6 +122,63 @@ class TestEntities:
         assert enemy.current_health == 80
 
 
+    def test_entities_have_no_instance_dict(self):
+        """Сущности и снаряжение хранятся в слотах"""
+        hero = Hero("Рыцарь", "Тестовый воин", 120, "Пал в бою")
+        weapon = Weapon("Меч", "Острый меч", 15, 0.85)
+
+        assert not hasattr(hero, "__dict__")
+        assert not hasattr(weapon, "__dict__")
+
+
+class TestEntityPool:
+    """Тесты хранилища сущностей в колонках"""
+
+    def test_pooled_enemy_reads_and_writes_columns(self, generator):
+        """Представление врага работает поверх колонок пула"""
+        pool = EntityPool()
+        enemy = generator.create_enemy("enemy1", pool)
+
+        assert isinstance(enemy, Enemy)
+        assert not hasattr(enemy, "__dict__")
+        assert sys.getsizeof(enemy) < sys.getsizeof(Enemy("Враг", "", 1, ""))
+        assert enemy.name == "Враг Один"
+        assert enemy.max_health == 50
+        assert enemy.weapon is generator.catalog.weapons[0]
+        assert pool.weapons[enemy.index] is enemy.weapon
+
+        enemy.current_health -= 20
+        assert pool.current_health[enemy.index] == 30
+        assert pool.damage[enemy.index] == enemy.damage == enemy.weapon.damage
+        assert pool.defense[enemy.index] == enemy.defense == enemy.armor.defense
+
+    def test_released_row_is_reused(self, generator):
+        """Освобожденная строка пула используется повторно"""
+        pool = EntityPool()
+        first = generator.create_enemy("enemy1", pool)
+        pool.release(first.index)
+        second = generator.create_enemy("enemy2", pool)
+
+        assert second.index == first.index
+        assert second.name == "Враг Два"
+        assert len(pool) == 1
+
+    def test_auto_fight_with_pooled_entities(self, generator):
+        """Бой идет так же, как с обычными объектами"""
+        pool = EntityPool()
+        hero = generator.create_player("hero1", pool)
+        enemy = generator.create_enemy("enemy2", pool)
+        hero.weapon = Weapon("Меч", "", 40, 1.0)
+
+        with patch('builtins.print'):
+            result = DungeonController.auto_fight(hero, enemy)
+
+        assert result is True
+        assert enemy.current_health <= 0
+        assert pool.weapons[hero.index].damage == 40
+        assert (pool.damage[hero.index], pool.hit_probability[hero.index]) == (40, 1.0)
+
+
 class TestDungeonGenerator:
     """Тесты для генератора подземелья"""
 
@@ -109,10 +194,10 @@ class TestDungeonGenerator:
     def test_load_json_data_success(self):
         """Успешная загрузка JSON данных"""
         mock_data = {
-            "weapons": {"sword": {"name": "Меч", "damage": 10}},
-            "heroes": {"hero1": {"name": "Герой", "health": 100}},
-            "enemies": {"enemy1": {"name": "Враг", "health": 50}},
-            "armor": {"plate": {"name": "Броня", "defense": 5}},
+            "weapons": {"sword": {"name": "Меч", "definition": "", "damage": 10, "success_probability": 0.8}},
+            "heroes": {"hero1": {"name": "Герой", "definition": "", "health": 100, "death_definition": ""}},
+            "enemies": {"enemy1": {"name": "Враг", "definition": "", "health": 50, "death_definition": ""}},
+            "armor": {"plate": {"name": "Броня", "definition": "", "defense": 5}},
             "room_definitions": ["Комната"]
         }
 
@@ -121,6 +206,58 @@ class TestDungeonGenerator:
                 generator = DungeonGenerator("test.json")
                 assert generator.data == mock_data
 
+    def test_invalid_content_rejected(self, tmp_path, game_data):
+        """Данные без обязательного поля отвергаются при загрузке, а не при первом бое"""
+        del game_data["weapons"]["weapon1"]["damage"]
+        json_file = tmp_path / "game_data.json"
+        json_file.write_text(json.dumps(game_data), encoding="utf-8")
+
+        with pytest.raises(ContentError, match="weapon1"):
+            DungeonGenerator(str(json_file))
+
+    def test_content_cache_invalidation(self, mock_json_file, game_data):
+        """Кеш используется повторно и пересобирается после изменения файла"""
+        first = DungeonGenerator(mock_json_file)
+        second = DungeonGenerator(mock_json_file)
+
+        assert first.content_cache.misses == 1
+        assert second.content_cache.hits == 1
+        assert second.data == first.data
+
+        game_data["room_definitions"].append("Новая комната")
+        with open(mock_json_file, "w", encoding="utf-8") as f:
+            json.dump(game_data, f)
+        stat = os.stat(mock_json_file)
+        os.utime(mock_json_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+        third = DungeonGenerator(mock_json_file)
+        assert third.content_cache.misses == 1
+        assert "Новая комната" in third.data["room_definitions"]
+
+    def test_background_load_from_cache_header(self, mock_json_file, game_data):
+        """Без кеша данные грузятся сразу, с кешем меню героев берется из заголовка, а остальное — в фоне"""
+        cold = DungeonGenerator(mock_json_file, background=True)
+        assert cold.hero_keys is None
+        assert "content" in cold.__dict__
+
+        warm = DungeonGenerator(mock_json_file, background=True)
+        assert warm.content_cache.read_heroes() == tuple(game_data["heroes"])
+        assert warm.get_heroes() == list(game_data["heroes"])
+
+        hero = warm.create_player("hero1")
+        assert hero.name == game_data["heroes"]["hero1"]["name"]
+        assert warm.data == cold.data
+        assert warm.get_heroes() == cold.get_heroes()
+
+    def test_read_heroes_stale_cache(self, mock_json_file):
+        """Ключи героев из заголовка не отдаются, если исходный файл изменился"""
+        generator = DungeonGenerator(mock_json_file)
+        stat = os.stat(mock_json_file)
+        os.utime(mock_json_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+        assert generator.content_cache.read_heroes() is None
+        assert DungeonGenerator(mock_json_file, background=True).hero_keys is None
+
     def test_get_random_weapon(self):
         """Получение случайного оружия"""
         mock_data = {
@@ -133,13 +270,13 @@ class TestDungeonGenerator:
         generator = DungeonGenerator.__new__(DungeonGenerator)
         generator.data = mock_data
 
-        with patch('random.choice') as mock_choice:
-            mock_choice.return_value = mock_data["weapons"]["sword"]
+        with patch('random.choice', side_effect=lambda items: items[0]):
             weapon = generator._get_random_weapon()
 
             assert weapon.name == "Меч"
             assert weapon.damage == 10
             assert weapon.success_probability == 0.8
+            assert weapon is generator._get_random_weapon()
 
     def test_create_player(self):
         """Создание игрока"""
@@ -168,6 +305,40 @@ class TestDungeonGenerator:
             assert hero.armor is not None
 
 
+
+class TestContentCatalog:
+    """Тесты скомпилированного каталога игровых данных"""
+
+    def test_catalog_ids_follow_json_order(self, generator):
+        """ID соответствуют порядку ключей в JSON"""
+        catalog = generator.catalog
+
+        assert catalog.enemy_keys == ("enemy1", "enemy2")
+        assert catalog.enemy_ids["enemy2"] == 1
+        assert catalog.enemies[1][0] == "Враг Два"
+
+    def test_items_are_shared_and_frozen(self, generator):
+        """Оружие и броня — общие неизменяемые объекты"""
+        first = generator.create_enemy("enemy1")
+        second = generator.create_player("hero1")
+
+        assert first.weapon is second.weapon
+        assert first.armor is second.armor
+        with pytest.raises(AttributeError):
+            first.weapon.damage = 100
+
+    def test_catalog_rebuilt_when_data_replaced(self, generator, game_data):
+        """При замене данных каталог собирается заново"""
+        catalog = generator.catalog
+        assert generator.catalog is catalog
+
+        game_data["enemies"]["enemy3"] = dict(game_data["enemies"]["enemy1"], name="Враг Три")
+        generator.data = game_data
+
+        assert generator.catalog is not catalog
+        assert generator.create_enemy("enemy3").name == "Враг Три"
+
+
 class TestDungeonControllerUnit:
     """Юнит-тесты для контроллера подземелья"""
 
@@ -240,4 +411,145 @@ class TestDungeonControllerUnit:
         with patch('random.randint', return_value=50):
             with patch('builtins.print'):
                 result = DungeonController.auto_fight(hero, enemy)
-                assert result is False
\ No newline at end of file
+                assert result is False
+
+
+class TestCombatSimulation:
+    """Тесты пакетного движка боя"""
+
+    def test_simulation_matches_auto_fight(self, hero_with_equipment, enemy_with_equipment):
+        """При стопроцентном попадании исход и число ходов совпадают с auto_fight"""
+        hero_with_equipment.weapon.success_probability = 1.0
+        enemy_with_equipment.weapon.success_probability = 1.0
+
+        stats = simulate_fights(100, 15, 1.0, 5, 50, 12, 1.0, 3, n_fights=100, rng=1)[0]
+        with patch('builtins.print'):
+            result = DungeonController.auto_fight(hero_with_equipment, enemy_with_equipment)
+
+        assert result is True
+        assert stats.wins == 100
+        assert stats.mean_turns == 9
+        assert stats.mean_hp_left == 72
+
+    def test_simulation_unresolved_when_armor_not_pierced(self):
+        """Бой, в котором никто не пробивает броню, не зависает"""
+        stats = simulate_fights(10, 1, 1.0, 5, 10, 1, 1.0, 5, n_fights=10, max_turns=50)[0]
+
+        assert stats.unresolved == 10
+        assert stats.win_rate == 0.0
+
+    def test_simulation_is_reproducible(self):
+        """Одинаковый seed дает одинаковый результат"""
+        first = simulate_fights(12, 5, 0.5, 1, 10, 4, 0.75, 0, n_fights=1000, rng=7)[0]
+        second = simulate_fights(12, 5, 0.5, 1, 10, 4, 0.75, 0, n_fights=1000, rng=7)[0]
+
+        assert first.wins == second.wins
+        assert 0 < first.win_rate < 1
+
+    def test_sweep_covers_all_combinations(self, game_data):
+        """Перебор покрывает все комбинации героев, врагов и снаряжения"""
+        results = sweep(game_data, n_fights=50, rng=0)
+
+        assert len(results) == 2 * 2 * 1 * 1 * 1 * 1
+        for stats in results.values():
+            assert stats.wins + stats.losses + stats.unresolved == 50
+
+
+class TestFightOdds:
+    """Тесты точного решения боя"""
+
+    def test_hit_chance_matches_randint_roll(self):
+        """Вероятность попадания учитывает все 101 значение броска"""
+        assert hit_chance(1.0) == 1.0
+        assert hit_chance(0.8) == 81 / 101
+        assert hit_chance(0.0) == 1 / 101
+
+    def test_solve_fight_deterministic(self):
+        """При стопроцентном попадании ответ совпадает с auto_fight"""
+        odds = solve_fight(100, 15, 1.0, 5, 50, 12, 1.0, 3)
+
+        assert odds.win_probability == 1.0
+        assert odds.expected_turns == 9
+        assert odds.expected_hp_left == 72
+
+    def test_solve_fight_close_to_simulation(self):
+        """Точный ответ совпадает с результатом пакетной симуляции"""
+        odds = solve_fight(12, 5, 0.5, 1, 10, 4, 0.75, 0)
+        stats = simulate_fights(12, 5, 0.5, 1, 10, 4, 0.75, 0, n_fights=100000, rng=3)[0]
+
+        assert odds.win_probability == pytest.approx(stats.win_rate, abs=0.01)
+        assert odds.expected_turns == pytest.approx(stats.mean_turns, abs=0.1)
+
+    def test_solve_fight_stalemate(self):
+        """Если никто не пробивает броню, герой не побеждает"""
+        odds = solve_fight(10, 1, 1.0, 5, 10, 1, 1.0, 5)
+
+        assert odds.win_probability == 0.0
+        assert odds.expected_turns == float("inf")
+
+    def test_generator_fight_odds(self, generator):
+        """Шансы доступны из генератора"""
+        odds = generator.fight_odds("hero1", "enemy2")
+
+        assert odds == solve_fight(100, 15, 0.8, 5, 30, 15, 0.8, 5)
+
+    def test_generator_fight_odds_stalemate_apart(self, game_data, tmp_path):
+        """Ничьи считаются отдельно и не делают среднее число ходов бесконечным"""
+        game_data["weapons"]["stick"] = {"name": "Палка", "definition": "палка", "damage": 1,
+                                         "success_probability": 1.0}
+        path = tmp_path / "stick.json"
+        path.write_text(json.dumps(game_data, ensure_ascii=False), encoding="utf-8")
+        generator = DungeonGenerator(str(path))
+
+        odds = generator.fight_odds("hero1", "enemy2", hero_weapon="stick", hero_armor="armor1",
+                                    enemy_armor="armor1")
+        decided = solve_fight(100, 1, 1.0, 5, 30, 15, 0.8, 5)
+        weight = dict(zip(generator.catalog.weapon_keys, generator.catalog.weights("weapons", 0)))
+
+        assert odds.stalemate_probability == pytest.approx(weight["stick"] / sum(weight.values()))
+        assert odds.expected_turns == pytest.approx(decided.expected_turns)
+        assert solve_fight(10, 1, 1.0, 5, 10, 1, 1.0, 5).stalemate_probability == 1.0
+
+
+class TestAliasTable:
+    """Тесты выбора по весам методом псевдонимов"""
+
+    def test_frequencies_follow_weights(self):
+        """Частоты выбора пропорциональны весам, нулевой вес не выбирается"""
+        table = AliasTable([1, 0, 3, 6])
+        rng = random.Random(0)
+        counts = [0] * 4
+        for _ in range(20000):
+            counts[table.sample(rng)] += 1
+
+        assert counts[1] == 0
+        assert counts[0] / 20000 == pytest.approx(0.1, abs=0.01)
+        assert counts[2] / 20000 == pytest.approx(0.3, abs=0.015)
+        assert counts[3] / 20000 == pytest.approx(0.6, abs=0.015)
+
+    def test_uniform_table_matches_choice(self):
+        """Равные веса дают те же выборы, что random.choice"""
+        items = ["a", "b", "c", "d", "e"]
+        table = AliasTable([2] * 5)
+        first, second = random.Random(3), random.Random(3)
+
+        assert [items[table.sample(first)] for _ in range(50)] == [second.choice(items) for _ in range(50)]
+
+    def test_empty_weights_rejected(self):
+        """Без положительных весов таблицу не построить"""
+        with pytest.raises(ValueError):
+            AliasTable([0, 0])
+
+    def test_depth_weights_in_catalog(self, game_data):
+        """Веса по диапазонам глубин: глубже встречаются другие враги"""
+        game_data["enemies"]["enemy1"]["weight"] = [1, 0]
+        game_data["enemies"]["enemy2"]["weight"] = [0, 1]
+        generator = DungeonGenerator.__new__(DungeonGenerator)
+        generator.data = game_data
+        rng = random.Random(1)
+
+        shallow = {generator.random_enemy_id(rng, depth=0) for _ in range(20)}
+        deep = {generator.random_enemy_id(rng, depth=100) for _ in range(20)}
+
+        assert shallow == {0}
+        assert deep == {1}